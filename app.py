@@ -1,26 +1,57 @@
 #app.py
 
-from flask import Flask, render_template, request, jsonify, Response, request
+from flask import Flask, g, render_template, request, jsonify, Response, request, stream_with_context
 from flask_cors import CORS
-import requests
-import folium
-from geopy.geocoders import Nominatim
-from geopy.distance import geodesic
+import upstream
+import singleflight
+import quota
+import metrics
+from metrics import span
 import os
+import gzip
+import json
+import logging
+import time
+import queue
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
 from dotenv import load_dotenv
-from soap_service import soap_wsgi_app
+from charging_planner import plan_stops, prune_candidates
+from communes_index import load_commune_index
+from corridor_table import load_corridor_table
+from jobs import JobQueue, QueueFull
+from geocode_cache import GeocodeCache, normalize_city_name
+from polyline import decode as decode_polyline, encode as encode_polyline, simplify
+from route_cache import RouteCache
+from route_profile import cumulative_distance_km, points_at_distances, route_array, route_position, stop_distances
+from station_index import load_station_index
+from trip_model import BATTERY_SAFETY_MARGIN, FALLBACK_SPEED_KMH, stops_needed, usable_range_km
+from vehicle_catalogue import VehicleCatalogue
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
-from werkzeug.serving import run_simple
 
 
 
 
 load_dotenv()
 
+# 📝 Logs : LOG_LEVEL=DEBUG pour le détail de chaque plan, OFF pour tout couper
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(
+    level=logging.INFO if LOG_LEVEL == "OFF" else LOG_LEVEL,
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+if LOG_LEVEL == "OFF":
+    logging.disable(logging.CRITICAL)
+# Bibliothèques trop bavardes en DEBUG
+for noisy in ("spyne", "urllib3"):
+    logging.getLogger(noisy).setLevel(logging.WARNING)
+logger = logging.getLogger("ev_planner")
+
 app = Flask(__name__)
 CORS(app)
 
-ORS_BASE_URL = "https://api.openrouteservice.org"
+ORS_BASE_URL = os.getenv("ORS_BASE_URL", "https://api.openrouteservice.org")
 ORS_API_KEY = os.getenv("ORS_API_KEY")
 if not ORS_API_KEY:
     raise RuntimeError("ORS_API_KEY manquante")
@@ -31,13 +62,25 @@ CHARGETRIP_APP_ID = os.getenv("CHARGETRIP_APP_ID")
 if not CHARGETRIP_APP_ID:
     raise RuntimeError("CHARGETRIP_APP_ID manquante")
 
-# 🔋 MARGE DE SÉCURITÉ : on ne descend pas en dessous de 10% de batterie
-BATTERY_SAFETY_MARGIN = 0.10  # 10% de réserve minimale
+# 🔌 Source des bornes : index local (snapshot IRVE) ou API distante
+IRVE_API_URL = os.getenv(
+    "IRVE_API_URL",
+    "https://opendata.reseaux-energies.fr/api/explore/v2.1/catalog/datasets/bornes-irve/records"
+)
+IRVE_SOURCE = os.getenv("IRVE_SOURCE", "local")  # "local" ou "remote"
+
+
+# ⚡ folium, geopy et spyne/lxml (SOAP) ne sont importés qu'à leur première
+# utilisation : un worker qui ne sert ni carte ni SOAP ne les charge jamais
+def soap_application(environ, start_response):
+    """Service SOAP (spyne), importé au premier appel"""
+    from soap_service import soap_wsgi_app
+    return soap_wsgi_app(environ, start_response)
 
 
 @app.route("/soap", methods=["GET", "POST"])
 def soap():
-    response = soap_wsgi_app(request.environ, lambda *args: None)
+    response = soap_application(request.environ, lambda *args: None)
     return Response(response, content_type="text/xml")
 
 
@@ -68,7 +111,7 @@ def ors_geocode(city_name):
             "size": 1
         }
 
-        r = requests.get(url, params=params)
+        r = upstream.get("ors", url, params=params)
         data = r.json()
 
         features = data.get("features", [])
@@ -79,7 +122,7 @@ def ors_geocode(city_name):
         return (lat, lon)
 
     except Exception as e:
-        print("Erreur géocodage ORS:", e)
+        logger.warning("Erreur géocodage ORS: %s", e)
         return None
 
 
@@ -89,6 +132,19 @@ def api_geocode():
     if not query or len(query) < 2:
         return jsonify([])
 
+    # 🔥 Index local des communes d'abord, ORS seulement si rien n'est trouvé
+    communes = load_commune_index()
+    if communes:
+        results = communes.search(query, limit=5)
+        if results:
+            return jsonify(results)
+
+    # Même préfixe tapé dans plusieurs onglets : un seul appel ORS
+    return jsonify(singleflight.group("autocomplete").do(query, lambda: ors_autocomplete(query)))
+
+
+def ors_autocomplete(query):
+    """Autocomplétion ORS (fallback de l'index des communes)"""
     try:
         url = f"{ORS_BASE_URL}/geocode/autocomplete"
         params = {
@@ -99,7 +155,8 @@ def api_geocode():
             "layers": "locality"
         }
 
-        r = requests.get(url, params=params, timeout=5)
+        # Basse priorité : rejeté plutôt que de consommer le budget des plans
+        r = upstream.get("ors", url, params=params, priority=upstream.LOW)
         features = r.json().get("features", [])
 
         results = []
@@ -150,18 +207,45 @@ def api_geocode():
             })
 
         # Sécurité : couper à 5 maximum
-        return jsonify(results[:5])
+        return results[:5]
 
     except Exception as e:
-        print("Erreur geocode:", e)
-        return jsonify([])
+        logger.warning("Erreur geocode: %s", e)
+        return []
+
+
+route_cache = RouteCache(
+    path=os.getenv("ROUTE_CACHE_PATH", "data/route_cache.sqlite3") or None,
+    precision=int(os.getenv("ROUTE_CACHE_PRECISION", "4")),
+    max_memory_entries=int(os.getenv("ROUTE_CACHE_MEMORY_SIZE", "256")),
+    max_disk_entries=int(os.getenv("ROUTE_CACHE_DISK_SIZE", "20000")),
+    max_age_s=float(os.getenv("ROUTE_CACHE_MAX_AGE_S", str(7 * 86400)))
+)
+
+# Sondes dans leur propre cache (LRU et base SQLite) : un flot de plans
+# nouveaux n'évince pas les routes complètes
+probe_cache = RouteCache(
+    path=os.getenv("PROBE_CACHE_PATH", "data/probe_cache.sqlite3" if route_cache.path else "") or None,
+    precision=route_cache.precision,
+    max_memory_entries=int(os.getenv("PROBE_CACHE_MEMORY_SIZE", "256")),
+    max_disk_entries=int(os.getenv("PROBE_CACHE_DISK_SIZE", "20000")),
+    max_age_s=route_cache.max_age_s
+)
 
 
 def ors_route(coordinates):
     """
-    Route via ORS avec plusieurs waypoints
+    Route via ORS avec plusieurs waypoints, mise en cache par waypoints arrondis
     coordinates: liste de tuples [(lat, lon), ...]
     """
+    return singleflight.group("route").do(
+        route_cache.key(coordinates),
+        lambda: route_cache.get_or_compute(coordinates, lambda: fetch_ors_route(coordinates))
+    )
+
+
+def fetch_ors_route(coordinates):
+    """Appel ORS directions (sans cache)"""
     try:
         url = f"{ORS_BASE_URL}/v2/directions/driving-car/geojson"
 
@@ -178,7 +262,7 @@ def ors_route(coordinates):
             "Content-Type": "application/json"
         }
 
-        r = requests.post(url, json=body, headers=headers)
+        r = upstream.post("ors", url, json=body, headers=headers)
         data = r.json()
 
         coords = data["features"][0]["geometry"]["coordinates"]
@@ -194,19 +278,157 @@ def ors_route(coordinates):
         }
 
     except Exception as e:
-        print("Erreur ORS route:", e)
+        logger.warning("Erreur ORS route: %s", e)
         if 'r' in locals():
-            print("Réponse brute ORS:", r.text)
+            logger.debug("Réponse brute ORS: %s", r.text)
         return None
 
 
+def ors_route_probe(coordinates):
+    """
+    Première route d'un plan, qui ne sert qu'à connaître la distance et à
+    placer les arrêts : résumé + géométrie grossière (coords en tableau (n, 2)).
+    Une route complète déjà en cache pour ces waypoints est utilisée telle quelle.
+    """
+    key = route_cache.key(coordinates)
+
+    def compute():
+        # Une route complète en cache sert de sonde ; sinon ce n'est pas un
+        # échec du cache des routes, seule la recherche de la sonde compte
+        route = route_cache.peek(key) or probe_cache.get(key)
+        if route is None:
+            route = fetch_ors_probe(coordinates)
+            if route:
+                probe_cache.put(key, route)
+        return route
+
+    route = singleflight.group("probe").do(key, compute)
+    return dict(route, coords=route_array(route["coords"])) if route else None
+
+
+def fetch_ors_probe(coordinates):
+    """
+    Appel ORS directions au format JSON (sans cache) : géométrie simplifiée par
+    ORS, en encoded polyline décodée directement en tableau NumPy.
+    """
+    try:
+        url = f"{ORS_BASE_URL}/v2/directions/driving-car/json"
+
+        body = {
+            "coordinates": [[coord[1], coord[0]] for coord in coordinates],
+            "radiuses": [500] * len(coordinates),
+            "geometry_simplify": True,
+            "instructions": False
+        }
+
+        headers = {
+            "Authorization": ORS_API_KEY,
+            "Content-Type": "application/json"
+        }
+
+        r = upstream.post("ors", url, json=body, headers=headers)
+        route = r.json()["routes"][0]
+        summary = route["summary"]
+
+        return {
+            "coords": decode_polyline(route["geometry"]),
+            "distance_km": summary.get("distance", 0) / 1000,
+            "duration_h": summary.get("duration", 0) / 3600
+        }
+
+    except Exception as e:
+        logger.warning("Erreur ORS route (sonde): %s", e)
+        if 'r' in locals():
+            logger.debug("Réponse brute ORS: %s", r.text)
+        return None
+
+
+def as_final_route(route):
+    """Route initiale réutilisée comme route finale (trajet sans arrêt) : coords en liste de (lat, lon)"""
+    if not route:
+        return None
+    return dict(route, coords=[tuple(c) for c in route_array(route["coords"]).tolist()])
+
+
+ORS_MATRIX_MAX_ELEMENTS = int(os.getenv("ORS_MATRIX_MAX_ELEMENTS", "3500"))
+
+
+def matrix_requests(pairs):
+    """
+    Découpe des paires (source, destination) en appels /v2/matrix sans paire
+    inutile : chaque source ne demande que ses destinations, et seules les
+    sources qui vont vers les mêmes destinations partagent un appel (au plus
+    ORS_MATRIX_MAX_ELEMENTS éléments). Retourne [(sources, destinations), ...].
+    """
+    by_source = {}
+    for source, destination in pairs:
+        by_source.setdefault(source, set()).add(destination)
+
+    by_destinations = {}
+    for source, destinations in by_source.items():
+        by_destinations.setdefault(tuple(sorted(destinations)), []).append(source)
+
+    calls = []
+    for destinations, sources in sorted(by_destinations.items()):
+        sources.sort()
+        dest_chunk = min(len(destinations), ORS_MATRIX_MAX_ELEMENTS)
+        src_chunk = max(1, ORS_MATRIX_MAX_ELEMENTS // dest_chunk)
+        for d0 in range(0, len(destinations), dest_chunk):
+            for s0 in range(0, len(sources), src_chunk):
+                calls.append((sources[s0:s0 + src_chunk], list(destinations[d0:d0 + dest_chunk])))
+    return calls
+
+
+def ors_matrix(sources, destinations):
+    """
+    Distances (km) et durées (h) routières de chaque source vers chaque
+    destination, en un appel /v2/matrix (voir matrix_requests pour découper).
+    Retourne {(source, destination): (distance_km, duration_h)} ; les paires en échec sont absentes.
+    """
+    results = {}
+    if not sources or not destinations:
+        return results
+
+    url = f"{ORS_BASE_URL}/v2/matrix/driving-car"
+    headers = {
+        "Authorization": ORS_API_KEY,
+        "Content-Type": "application/json"
+    }
+
+    locations = [[c[1], c[0]] for c in list(sources) + list(destinations)]
+    body = {
+        "locations": locations,
+        "sources": list(range(len(sources))),
+        "destinations": list(range(len(sources), len(locations))),
+        "metrics": ["distance", "duration"],
+        "units": "km"
+    }
+    try:
+        r = upstream.post("ors", url, json=body, headers=headers)
+        data = r.json()
+        for i, src in enumerate(sources):
+            for j, dst in enumerate(destinations):
+                distance = data["distances"][i][j]
+                duration = data["durations"][i][j]
+                if distance is not None and duration is not None:
+                    results[(src, dst)] = (distance, duration / 3600)
+    except Exception as e:
+        logger.warning("Erreur ORS matrix: %s", e)
+
+    return results
+
+
 # ---------------------------------------------------------
 # 🔥 CONFIG Chargetrip (API véhicules)
 # ---------------------------------------------------------
 
+CHARGETRIP_URL = os.getenv("CHARGETRIP_URL", "https://api.chargetrip.io/graphql")
+CHARGETRIP_PAGE_SIZE = int(os.getenv("CHARGETRIP_PAGE_SIZE", "50"))
+CHARGETRIP_MAX_PAGES = int(os.getenv("CHARGETRIP_MAX_PAGES", "100"))
+
 VEHICLES_QUERY = """
-query vehicleList {
-  vehicleList(page: 0, size: 50) {
+query vehicleList($page: Int, $size: Int) {
+  vehicleList(page: $page, size: $size) {
     id
     naming {
       make
@@ -228,43 +450,50 @@ query vehicleList {
 """
 
 
-def get_vehicles_from_chargetrip():
-    """Récupérer les véhicules via Chargetrip"""
-    try:
-        url = "https://api.chargetrip.io/graphql"
-        headers = {
-            "x-client-id": CHARGETRIP_CLIENT_ID,
-            "x-app-id": CHARGETRIP_APP_ID,
-            "Content-Type": "application/json"
+def fetch_vehicles_from_chargetrip():
+    """Récupérer tout le catalogue Chargetrip, page par page (lève une exception en cas d'échec)"""
+    headers = {
+        "x-client-id": CHARGETRIP_CLIENT_ID,
+        "x-app-id": CHARGETRIP_APP_ID,
+        "Content-Type": "application/json"
+    }
+
+    vehicles = []
+    for page in range(CHARGETRIP_MAX_PAGES):
+        body = {
+            "query": VEHICLES_QUERY,
+            "variables": {"page": page, "size": CHARGETRIP_PAGE_SIZE}
         }
+        response = upstream.post("chargetrip", CHARGETRIP_URL, headers=headers, json=body)
+
+        if response.status_code != 200:
+            raise RuntimeError(f"Chargetrip HTTP {response.status_code}: {response.text}")
+
+        data = (response.json().get("data") or {}).get("vehicleList") or []
+
+        for v in data:
+            try:
+                vehicles.append({
+                    "id": v["id"],
+                    "make": v["naming"]["make"],
+                    "model": v["naming"]["model"],
+                    "version": v["naming"]["version"],
+                    "range": v["range"]["chargetrip_range"]["best"] or 300,
+                    "battery": v["battery"]["usable_kwh"] or 50
+                })
+            except (KeyError, TypeError):
+                continue
 
-        response = requests.post(url, headers=headers, json={"query": VEHICLES_QUERY})
-
-        if response.status_code == 200:
-            data = response.json().get("data", {}).get("vehicleList", [])
-            vehicles = []
-
-            for v in data:
-                try:
-                    vehicles.append({
-                        "id": v["id"],
-                        "make": v["naming"]["make"],
-                        "model": v["naming"]["model"],
-                        "version": v["naming"]["version"],
-                        "range": v["range"]["chargetrip_range"]["best"] or 300,
-                        "battery": v["battery"]["usable_kwh"] or 50
-                    })
-                except:
-                    continue
+        # Dernière page atteinte
+        if len(data) < CHARGETRIP_PAGE_SIZE:
+            break
 
-            return vehicles
+    return vehicles
 
-        print("Erreur Chargetrip:", response.text)
-        return get_fallback_vehicles()
 
-    except Exception as e:
-        print("Erreur Chargetrip:", e)
-        return get_fallback_vehicles()
+def get_vehicles_from_chargetrip():
+    """Catalogue des véhicules (cache en mémoire, véhicules par défaut si Chargetrip est indisponible)"""
+    return vehicle_catalogue.all()
 
 
 def get_fallback_vehicles():
@@ -276,14 +505,28 @@ def get_fallback_vehicles():
     ]
 
 
+vehicle_catalogue = VehicleCatalogue(
+    fetch=fetch_vehicles_from_chargetrip,
+    ttl_s=float(os.getenv("VEHICLES_CACHE_TTL_S", str(6 * 3600))),
+    snapshot_path=os.getenv("VEHICLES_SNAPSHOT_PATH") or None,
+    fallback=get_fallback_vehicles
+)
+
+
 # ---------------------------------------------------------
 # 🔥 Géocodage fallback si ORS ne répond pas
 # ---------------------------------------------------------
+_nominatim = None
+
+
 def geocode_city(city_name):
     """Fallback Nominatim"""
+    global _nominatim
     try:
-        geo = Nominatim(user_agent="ev_planner")
-        loc = geo.geocode(city_name + ", France")
+        if _nominatim is None:
+            from geopy.geocoders import Nominatim
+            _nominatim = Nominatim(user_agent="ev_planner")
+        loc = _nominatim.geocode(city_name + ", France")
         if loc:
             return (loc.latitude, loc.longitude)
         return None
@@ -291,30 +534,79 @@ def geocode_city(city_name):
         return None
 
 
+# ---------------------------------------------------------
+# 🔥 Cache de géocodage (mémoire + SQLite)
+# ---------------------------------------------------------
+geocode_cache = GeocodeCache(
+    path=os.getenv("GEOCODE_CACHE_PATH", "data/geocode_cache.sqlite3") or None,
+    max_entries=int(os.getenv("GEOCODE_CACHE_SIZE", "2048")),
+    negative_ttl_s=float(os.getenv("GEOCODE_NEGATIVE_TTL_S", "600"))
+)
+
+
+def resolve_city(city_name):
+    """Coordonnées d'une ville : cache, puis ORS, puis Nominatim"""
+    with span("geocode"):
+        return singleflight.group("geocode").do(
+            normalize_city_name(city_name),
+            lambda: geocode_cache.get_or_compute(
+                city_name,
+                lambda: ors_geocode(city_name) or geocode_city(city_name)
+            )
+        )
+
+
 # ---------------------------------------------------------
 # 🔥 Bornes IRVE (rayon augmenté à 50 km)
 # ---------------------------------------------------------
-def get_charging_stations(lat, lon, radius=50):
-    print(f"🔍 Recherche bornes autour de {lat}, {lon} (rayon {radius}km)...")
+def local_station_index():
+    """
+    Index IRVE local, ou None s'il n'est pas utilisé (IRVE_SOURCE=remote) ou
+    vide (snapshot absent) : les bornes viennent alors de l'API IRVE.
+    """
+    if IRVE_SOURCE != "local":
+        return None
+    index = load_station_index()
+    return index if len(index) else None
+
+
+def get_charging_stations(lat, lon, radius=50, limit=10):
+    """Bornes les plus proches : index local par défaut, API IRVE si IRVE_SOURCE=remote ou sans snapshot"""
+    with span("station_lookup"):
+        index = local_station_index()
+        if index is None:
+            return singleflight.group("stations").do(
+                (lat, lon, radius, limit),
+                lambda: get_charging_stations_remote(lat, lon, radius, limit)
+            )
+
+        try:
+            return index.search(lat, lon, radius_km=radius, k=limit)
+        except Exception as e:
+            logger.error("❌ Exception index IRVE local: %s", e)
+            return []
 
-    try:
-        url = "https://opendata.reseaux-energies.fr/api/explore/v2.1/catalog/datasets/bornes-irve/records"
 
+def get_charging_stations_remote(lat, lon, radius=50, limit=10):
+    logger.debug("🔍 Recherche bornes autour de %s, %s (rayon %skm)...", lat, lon, radius)
+
+    try:
         where_clause = f"distance(geo_point_borne, geom'POINT({lon} {lat})', {radius}km)"
 
         params = {
             "where": where_clause,
-            "limit": 10  # on en prend plusieurs, on triera ensuite
+            "limit": limit  # on en prend plusieurs, on triera ensuite
         }
 
-        r = requests.get(url, params=params, timeout=10)
+        r = upstream.get("irve", IRVE_API_URL, params=params)
 
         if r.status_code != 200:
-            print(f"❌ Erreur API ({r.status_code}): {r.text}")
+            logger.warning("❌ Erreur API (%s): %s", r.status_code, r.text)
             return []
 
         data = r.json().get("results", [])
-        print(f"✅ API a répondu : {len(data)} stations trouvées brute")
+        from geopy.distance import geodesic
+        logger.debug("✅ API a répondu : %d stations trouvées brute", len(data))
 
         stations = []
         for s in data:
@@ -335,115 +627,292 @@ def get_charging_stations(lat, lon, radius=50):
         # 🔥 TRI CÔTÉ PYTHON (borne la plus proche en premier)
         stations.sort(key=lambda x: x["distance"])
 
-        print(f"   -> {len(stations)} stations valides après tri")
+        logger.debug("   -> %d stations valides après tri", len(stations))
         return stations
 
     except Exception as e:
-        print(f"❌ Exception critique get_charging_stations: {e}")
+        logger.error("❌ Exception critique get_charging_stations: %s", e)
+        return []
+
+# ---------------------------------------------------------
+# 🔥 Recherche parallèle des bornes pour tous les arrêts
+# ---------------------------------------------------------
+STATION_LOOKUP_WORKERS = int(os.getenv("STATION_LOOKUP_WORKERS", "8"))
+STATION_LOOKUP_DEADLINE_S = float(os.getenv("STATION_LOOKUP_DEADLINE_S", "8"))
+
+_station_pool = ThreadPoolExecutor(max_workers=STATION_LOOKUP_WORKERS, thread_name_prefix="irve")
+
+
+def find_stations_for_stops(positions, radius=50, deadline_s=None, on_result=None):
+    """
+    Lance les recherches de bornes de tous les arrêts en même temps.
+    Le résultat garde l'ordre des positions ; une recherche en échec ou
+    non terminée avant la deadline du plan donne une liste vide.
+    on_result(index, stations) est appelé dès qu'une recherche se termine.
+    """
+    if not positions:
+        return []
+
+    deadline_s = STATION_LOOKUP_DEADLINE_S if deadline_s is None else deadline_s
+    futures = {
+        _station_pool.submit(get_charging_stations, lat, lon, radius=radius): i
+        for i, (lat, lon) in enumerate(positions)
+    }
+
+    results = [None] * len(positions)
+    try:
+        for future in as_completed(futures, timeout=deadline_s):
+            i = futures[future]
+            if future.exception():
+                logger.warning("❌ Recherche borne %d en échec: %s", i + 1, future.exception())
+                results[i] = []
+            else:
+                results[i] = future.result()
+            if on_result:
+                on_result(i, results[i])
+    except FutureTimeout:
+        for future, i in futures.items():
+            if results[i] is None:
+                future.cancel()
+                logger.warning("⏱️ Recherche borne %d abandonnée (deadline %ss)", i + 1, deadline_s)
+                results[i] = []
+                if on_result:
+                    on_result(i, results[i])
+    return results
+
+
+# ---------------------------------------------------------
+# 🔥 Choix des bornes sur tout le couloir de la route
+# ---------------------------------------------------------
+CORRIDOR_BUFFER_KM = float(os.getenv("CORRIDOR_BUFFER_KM", "5"))
+
+
+def corridor_candidates(points, profile):
+    """
+    Bornes candidates du couloir (index local), une par tronçon :
+    (indices, position_km, detour_km) triés par position le long de la route.
+    """
+    index = load_station_index()
+    idx, positions, detours = index.corridor(points, profile, buffer_km=CORRIDOR_BUFFER_KM)
+    keep = prune_candidates(positions, detours, index.powers[idx])
+    return idx[keep], positions[keep], detours[keep]
+
+
+def plan_corridor_stops(points, profile, total_distance, usable_range, charging_time, speed_kmh):
+    """
+    Bornes qui minimisent le temps total, choisies parmi toutes celles à moins de
+    CORRIDOR_BUFFER_KM de la route. None si l'index local n'est pas utilisable ou
+    si aucune suite de bornes ne couvre le trajet (on revient alors au placement simple).
+    """
+    if total_distance <= usable_range:
         return []
+    index = local_station_index()
+    if index is None:
+        return None
+
+    idx, positions, detours = corridor_candidates(points, profile)
+
+    chosen = plan_stops(positions, detours, total_distance, usable_range, charging_time / 60, speed_kmh)
+    if chosen is None:
+        logger.info("⚠️ Pas de suite de bornes à moins de %s km de la route", CORRIDOR_BUFFER_KM)
+        return None
+
+    return [index.station(int(idx[c]), float(detours[c])) for c in chosen]
+
+
+# ---------------------------------------------------------
+# 🔥 Arrêts sans index local : placement avec marge + bornes à portée
+# ---------------------------------------------------------
+STOP_SEARCH_RADIUS_KM = 50
+# Marge retirée à chaque étape (au plus la moitié de l'autonomie) : une borne
+# est retenue si son écart le long de la route à l'arrêt prévu, plus son
+# détour, reste sous la moitié de cette marge ; aucune étape ne dépasse
+# alors l'autonomie utilisable
+STOP_SLACK_KM = float(os.getenv("STOP_SLACK_KM", "50"))
+
+
+def stop_slack_km(usable_range):
+    return min(STOP_SLACK_KM, usable_range / 2)
+
+
+def stations_in_reach(stations, points, profile, target_km, window_km):
+    """Bornes (dans l'ordre reçu) dont |position - target_km| + détour <= window_km"""
+    reachable = []
+    for station in stations:
+        position, detour = route_position(points, profile, station["lat"], station["lon"])
+        if abs(position - target_km) + detour <= window_km:
+            reachable.append(station)
+    return reachable
+
+
+def stop_entry(number, position, stations, charging_time):
+    """Arrêt n° number : la première borne trouvée, sinon une zone de recharge autour de position"""
+    if stations:
+        chosen = stations[0]
+        return {
+            "stop_number": number,
+            "lat": chosen["lat"],
+            "lon": chosen["lon"],
+            "name": chosen["name"],
+            "address": chosen["address"],
+            "city": chosen.get("city", ""),
+            "power": chosen["power"],
+            "charging_time": charging_time,
+            "found": True
+        }
+
+    stop_lat, stop_lon = position
+    return {
+        "stop_number": number,
+        "lat": stop_lat,
+        "lon": stop_lon,
+        "name": f"Zone de recharge {number}",
+        "address": "⚠️ Aucune borne à portée de l'autonomie autour de ce point",
+        "city": "",
+        "power": "N/A",
+        "charging_time": charging_time,
+        "found": False
+    }
+
 
 # ---------------------------------------------------------
 # 🔥 Calcul avec MARGE DE SÉCURITÉ (10% de batterie restante)
 # ---------------------------------------------------------
-def calculate_trip_with_stops_and_route(start_coords, end_coords, vehicle_range, charging_time=30):
+def route_profile_of(route, start_coords, end_coords):
+    """
+    Polyligne, profil de distance cumulée (recalé sur la distance routière),
+    distance totale et vitesse moyenne d'une route ORS ; ligne droite
+    géodésique si la route manque.
+    """
+    if not route:
+        # Fallback géodésique
+        from geopy.distance import geodesic
+        total_distance = geodesic(start_coords, end_coords).kilometers
+    else:
+        total_distance = route["distance_km"]
+
+    if route and len(route["coords"]):
+        points = route_array(route["coords"])
+        speed_kmh = total_distance / route["duration_h"] if route["duration_h"] else FALLBACK_SPEED_KMH
+    else:
+        # Fallback : ligne droite entre départ et arrivée
+        points = route_array([start_coords, end_coords])
+        speed_kmh = FALLBACK_SPEED_KMH
+
+    profile = cumulative_distance_km(points)
+    if profile[-1] > 0:
+        # Recaler le profil sur la distance routière annoncée par ORS
+        profile *= total_distance / profile[-1]
+    return points, profile, total_distance, speed_kmh
+
+
+def calculate_trip_with_stops_and_route(start_coords, end_coords, vehicle_range, charging_time=30, router=None,
+                                        on_event=None):
     """
     Calcule le trajet avec arrêts de recharge ET route réelle
     🔋 NOUVEAU : Marge de sécurité de 10% (on ne descend pas sous 10% de batterie)
+    router : fonction de routage à utiliser à la place de ors_route (ex. mémoïsée par un batch)
+    on_event(nom, données) : progression du calcul ("distance" puis un "stop" par arrêt)
     """
+    # Sans routeur imposé, la route initiale n'est qu'une sonde (résumé + géométrie grossière)
+    probe = router or ors_route_probe
+    router = router or ors_route
+    emit = on_event or (lambda name, data: None)
+
     # 1. Calculer une route initiale pour avoir la distance
-    initial_route = ors_route([start_coords, end_coords])
+    with span("initial_route"):
+        initial_route = probe([start_coords, end_coords])
     
-    if not initial_route:
-        # Fallback géodésique
-        total_distance = geodesic(start_coords, end_coords).kilometers
-    else:
-        total_distance = initial_route["distance_km"]
+    points, profile, total_distance, speed_kmh = route_profile_of(initial_route, start_coords, end_coords)
 
     # 2. 🔋 Autonomie utilisable avec marge de sécurité
     # On garde 10% de réserve au minimum
-    usable_range = vehicle_range * (1 - BATTERY_SAFETY_MARGIN)
+    usable_range = usable_range_km(vehicle_range)
     
-    print(f"🔋 Autonomie véhicule: {vehicle_range} km")
-    print(f"🔋 Autonomie utilisable (avec 10% de marge): {usable_range:.1f} km")
+    logger.debug("🔋 Autonomie véhicule: %s km", vehicle_range)
+    logger.debug("🔋 Autonomie utilisable (avec 10%% de marge): %.1f km", usable_range)
     
-    # 3. Calculer le nombre d'arrêts nécessaires
-    num_stops = max(0, int(total_distance / usable_range))
-    
-    print(f"📏 Distance totale: {total_distance:.1f} km")
-    print(f"⚡ Nombre d'arrêts nécessaires: {num_stops}")
+    logger.debug("📏 Distance totale: %.1f km", total_distance)
 
-    # 4. Trouver les bornes de recharge sur le trajet
+    # 3. Trouver les bornes de recharge sur le trajet
     stops = []
     waypoints = [start_coords]
-    
-    if num_stops > 0:
-        for i in range(1, num_stops + 1):
-            # Position interpolée sur le trajet initial
-            ratio = i / (num_stops + 1)
-            
-            if initial_route and initial_route["coords"]:
-                # Trouver le point sur la route réelle
-                route_length = len(initial_route["coords"])
-                index = int(route_length * ratio)
-                stop_lat, stop_lon = initial_route["coords"][index]
-            else:
-                # Fallback interpolation linéaire
-                stop_lat = start_coords[0] + (end_coords[0] - start_coords[0]) * ratio
-                stop_lon = start_coords[1] + (end_coords[1] - start_coords[1]) * ratio
 
-            # 🔍 Chercher une borne proche (rayon 50 km)
-            print(f"🔍 Recherche borne {i} autour de ({stop_lat:.4f}, {stop_lon:.4f})")
-            stations = get_charging_stations(stop_lat, stop_lon, radius=50)
-            
-            print(f"   → {len(stations)} bornes trouvées")
+    # 🔥 Meilleure suite de bornes dans le couloir de la route (index local)
+    with span("corridor"):
+        corridor = plan_corridor_stops(points, profile, total_distance, usable_range, charging_time, speed_kmh)
+
+    if corridor is not None:
+        positions = [(station["lat"], station["lon"]) for station in corridor]
+    else:
+        # Sinon : un arrêt tous les usable_range - marge km, sur la route
+        slack = stop_slack_km(usable_range)
+        targets = stop_distances(total_distance, usable_range, slack)
+        positions = [tuple(p) for p in points_at_distances(points, profile, targets).tolist()]
+
+    num_stops = len(positions)
+    logger.debug("⚡ Nombre d'arrêts nécessaires: %d", num_stops)
+    emit("distance", {
+        "total_distance": round(total_distance, 2),
+        "num_stops": num_stops,
+        "usable_range": round(usable_range, 1)
+    })
+
+    if corridor is not None:
+        stations_per_stop = [[station] for station in corridor]
+        for i, station in enumerate(corridor):
+            emit("stop", stop_entry(i + 1, positions[i], [station], charging_time))
+    else:
+        # Borne la plus proche de chaque arrêt parmi celles qui gardent les
+        # étapes voisines dans l'autonomie (recherches en parallèle) ; sans
+        # borne à portée, l'arrêt reste au point prévu
+        def in_reach(i, stations):
+            return stations_in_reach(stations, points, profile, float(targets[i]), slack / 2)
+
+        stations_per_stop = find_stations_for_stops(
+            positions, radius=STOP_SEARCH_RADIUS_KM,
+            on_result=lambda i, stations: emit("stop", stop_entry(i + 1, positions[i], in_reach(i, stations),
+                                                                  charging_time))
+        )
+        stations_per_stop = [in_reach(i, stations) for i, stations in enumerate(stations_per_stop)]
+
+    for i, (position, stations) in enumerate(zip(positions, stations_per_stop), start=1):
+        logger.debug("🔍 Borne %d autour de (%.4f, %.4f) → %d bornes trouvées", i, position[0], position[1], len(stations))
+
+        stop = stop_entry(i, position, stations, charging_time)
+        if stop["found"]:
+            logger.debug("   ✅ Borne trouvée: %s à %s", stop["name"], stop["city"] or "ville inconnue")
+        else:
+            logger.debug("   ⚠️ Aucune borne à portée de l'autonomie")
+
+        stops.append(stop)
+        waypoints.append((stop["lat"], stop["lon"]))
 
-            if stations:
-                chosen = stations[0]
-                stop_coords = (chosen["lat"], chosen["lon"])
-                
-                stops.append({
-                    "stop_number": i,
-                    "lat": chosen["lat"],
-                    "lon": chosen["lon"],
-                    "name": chosen["name"],
-                    "address": chosen["address"],
-                    "city": chosen.get("city", ""),
-                    "power": chosen["power"],
-                    "charging_time": charging_time,
-                    "found": True
-                })
-                print(f"   ✅ Borne trouvée: {chosen['name']} à {chosen.get('city', 'ville inconnue')}")
-            else:
-                stop_coords = (stop_lat, stop_lon)
-                stops.append({
-                    "stop_number": i,
-                    "lat": stop_lat,
-                    "lon": stop_lon,
-                    "name": f"Zone de recharge {i}",
-                    "address": "⚠️ Aucune borne trouvée dans un rayon de 50 km",
-                    "city": "",
-                    "power": "N/A",
-                    "charging_time": charging_time,
-                    "found": False
-                })
-                print(f"   ⚠️ Aucune borne trouvée dans un rayon de 50 km")
-            
-            waypoints.append(stop_coords)
-    
     waypoints.append(end_coords)
 
-    # 5. Calculer la route FINALE qui passe par toutes les bornes
-    final_route = ors_route(waypoints)
+    # 4. Calculer la route FINALE qui passe par toutes les bornes (aucun
+    # arrêt : c'est la route initiale, pas de second appel)
+    if not stops and initial_route:
+        final_route = as_final_route(initial_route)
+    else:
+        with span("final_route"):
+            final_route = router(waypoints)
+
+    return trip_result(final_route, total_distance, stops, vehicle_range, charging_time)
 
+
+def trip_result(final_route, total_distance, stops, vehicle_range, charging_time):
+    """Résultat d'un plan depuis sa route finale (distance directe si la route manque)"""
     if final_route:
         total_distance = final_route["distance_km"]
         driving_time = final_route["duration_h"]
         route_coords = final_route["coords"]
     else:
         # Fallback
-        driving_time = total_distance / 90
+        driving_time = total_distance / FALLBACK_SPEED_KMH
         route_coords = None
 
+    num_stops = len(stops)
     charging_total = num_stops * (charging_time / 60)
 
     return {
@@ -454,14 +923,114 @@ def calculate_trip_with_stops_and_route(start_coords, end_coords, vehicle_range,
         "charging_time": round(charging_total, 2),
         "total_time": round(driving_time + charging_total, 2),
         "route_coords": route_coords,
-        "usable_range": round(usable_range, 1),
+        "usable_range": round(usable_range_km(vehicle_range), 1),
         "safety_margin_km": round(vehicle_range * BATTERY_SAFETY_MARGIN, 1)
     }
 
+
+# ---------------------------------------------------------
+# 🔥 Comparaison de plusieurs véhicules sur le même trajet
+# ---------------------------------------------------------
+def compare_trips(start_coords, end_coords, vehicle_ranges, charging_time=30, router=None):
+    """
+    Même résultat que calculate_trip_with_stops_and_route pour chaque autonomie
+    de vehicle_ranges (dans le même ordre), en partageant le travail commun :
+    une route initiale, un couloir de bornes, une recherche par position
+    distincte, et une route finale par suite de waypoints distincte.
+    """
+    probe = router or ors_route_probe
+    router = router or ors_route
+
+    with span("initial_route"):
+        initial_route = probe([start_coords, end_coords])
+    points, profile, total_distance, speed_kmh = route_profile_of(initial_route, start_coords, end_coords)
+
+    # Les véhicules de même autonomie ont le même plan
+    ranges = sorted(set(vehicle_ranges))
+    usable = usable_range_km(np.asarray(ranges, dtype=np.float64))
+    counts = stops_needed(total_distance, usable)
+    logger.debug("⚡ Comparaison de %d autonomies sur %.1f km : %s arrêts", len(ranges), total_distance, counts.tolist())
+
+    # 1. Bornes du couloir (index local) : un seul couloir, un plan par autonomie
+    stations_by_range = {}
+    index = local_station_index()
+    if index is not None and counts.any():
+        with span("corridor"):
+            idx, positions, detours = corridor_candidates(points, profile)
+            for vehicle_range, usable_range, count in zip(ranges, usable.tolist(), counts.tolist()):
+                if not count:
+                    continue
+                chosen = plan_stops(positions, detours, total_distance, usable_range, charging_time / 60, speed_kmh)
+                if chosen is not None:
+                    stations_by_range[vehicle_range] = [index.station(int(idx[c]), float(detours[c])) for c in chosen]
+
+    # 2. Sinon, arrêts placés avec marge : toutes les positions en une
+    # interpolation, une recherche par position distincte
+    fallback = [(r, u) for r, u, count in zip(ranges, usable.tolist(), counts.tolist())
+                if count and r not in stations_by_range]
+    targets = [stop_distances(total_distance, usable_range, stop_slack_km(usable_range))
+               for _, usable_range in fallback]
+    positions_by_range = {}
+    if fallback:
+        located = points_at_distances(points, profile, np.concatenate(targets)).tolist()
+        for (vehicle_range, _), t in zip(fallback, targets):
+            positions_by_range[vehicle_range] = [tuple(p) for p in located[:len(t)]]
+            located = located[len(t):]
+
+    distinct = sorted({p for positions in positions_by_range.values() for p in positions})
+    found = dict(zip(distinct, find_stations_for_stops(distinct, radius=STOP_SEARCH_RADIUS_KM)))
+
+    # Bornes à portée de chaque arrêt, selon la marge de son autonomie
+    reach_by_range = {}
+    for (vehicle_range, usable_range), t in zip(fallback, targets):
+        window = stop_slack_km(usable_range) / 2
+        reach_by_range[vehicle_range] = [
+            stations_in_reach(found[position], points, profile, float(target), window)
+            for position, target in zip(positions_by_range[vehicle_range], t)
+        ]
+
+    # 3. Arrêts de chaque autonomie, puis une route finale par suite distincte
+    stops_by_range = {}
+    for vehicle_range in ranges:
+        if vehicle_range in stations_by_range:
+            stations = stations_by_range[vehicle_range]
+            stops_by_range[vehicle_range] = [
+                stop_entry(i, (station["lat"], station["lon"]), [station], charging_time)
+                for i, station in enumerate(stations, start=1)
+            ]
+        else:
+            stops_by_range[vehicle_range] = [
+                stop_entry(i, position, stations, charging_time)
+                for i, (position, stations) in enumerate(
+                    zip(positions_by_range.get(vehicle_range, []), reach_by_range.get(vehicle_range, [])), start=1)
+            ]
+
+    routes = {}
+    with span("final_route"):
+        for stops in stops_by_range.values():
+            waypoints = (start_coords, *((stop["lat"], stop["lon"]) for stop in stops), end_coords)
+            if waypoints in routes:
+                continue
+            if not stops and initial_route:
+                routes[waypoints] = as_final_route(initial_route)
+            else:
+                routes[waypoints] = router(list(waypoints))
+    logger.debug("🛣️ %d routes finales pour %d autonomies", len(routes), len(ranges))
+
+    trips = {}
+    for vehicle_range, stops in stops_by_range.items():
+        waypoints = (start_coords, *((stop["lat"], stop["lon"]) for stop in stops), end_coords)
+        trips[vehicle_range] = trip_result(routes[waypoints], total_distance, stops, vehicle_range, charging_time)
+
+    return [dict(trips[vehicle_range], stops=[dict(stop) for stop in trips[vehicle_range]["stops"]])
+            for vehicle_range in vehicle_ranges]
+
 # ---------------------------------------------------------
 # 🔥 Carte Folium
 # ---------------------------------------------------------
 def create_map(start_coords, end_coords, stops, start_city, end_city, route_coords):
+    import folium
+
     center_lat = (start_coords[0] + end_coords[0]) / 2
     center_lon = (start_coords[1] + end_coords[1]) / 2
 
@@ -500,6 +1069,133 @@ def create_map(start_coords, end_coords, stops, start_city, end_city, route_coor
     return m._repr_html_()
 
 
+# ---------------------------------------------------------
+# 🔥 Géométrie légère (alternative à la carte Folium)
+# ---------------------------------------------------------
+DEFAULT_TOLERANCE_M = float(os.getenv("ROUTE_SIMPLIFY_TOLERANCE_M", "25"))
+
+
+def route_geometry(route_coords, fmt="polyline", tolerance_m=DEFAULT_TOLERANCE_M):
+    """Route simplifiée (Douglas–Peucker) en encoded polyline ou en GeoJSON LineString"""
+    if not route_coords:
+        return None
+
+    points = simplify(route_array(route_coords), tolerance_m)
+    geometry = {"format": fmt, "points": len(points), "tolerance_m": tolerance_m}
+    if fmt == "geojson":
+        geometry["geojson"] = {
+            "type": "LineString",
+            "coordinates": [[round(lon, 5), round(lat, 5)] for lat, lon in points.tolist()]
+        }
+    else:
+        geometry["polyline"] = encode_polyline(points)
+    return geometry
+
+
+def parse_geometry_options(values):
+    """(format, tolérance en m) depuis les paramètres geometry / tolerance"""
+    fmt = values.get("geometry") or "polyline"
+    if fmt not in ("polyline", "geojson"):
+        raise PlanInputError("geometry doit valoir 'polyline' ou 'geojson'")
+    try:
+        tolerance_m = float(values.get("tolerance") or DEFAULT_TOLERANCE_M)
+    except (TypeError, ValueError):
+        raise PlanInputError("tolerance invalide")
+    return fmt, max(0.0, tolerance_m)
+
+
+# ---------------------------------------------------------
+# 🔥 Compression gzip des réponses
+# ---------------------------------------------------------
+GZIP_MIN_SIZE = 1024
+GZIP_MIMETYPES = {"application/json", "text/html", "text/css", "application/javascript", "text/xml"}
+
+
+@app.after_request
+def gzip_response(response):
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200 or response.status_code >= 300
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in GZIP_MIMETYPES
+        or "gzip" not in request.headers.get("Accept-Encoding", "").lower()
+    ):
+        return response
+
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=5))
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers["Content-Length"] = len(response.get_data())
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+# ---------------------------------------------------------
+# 🔥 Métriques HTTP + état des caches et des services amont
+# ---------------------------------------------------------
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    # Un flux (NDJSON, SSE) n'a que son premier octet de prêt ici
+    if not response.is_streamed and hasattr(g, "request_started"):
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=endpoint)
+    return response
+
+
+def _cache_events():
+    values = {}
+    for name, cache in (("geocode", geocode_cache), ("route", route_cache), ("probe", probe_cache)):
+        for event, value in cache.stats().items():
+            if event.endswith("hits") or event == "misses":
+                values[(name, event)] = value
+    return values
+
+
+def _corridor_lookups():
+    table = load_corridor_table()
+    if table is None:
+        return {}
+    stats = table.stats()
+    return {(result,): stats[result] for result in ("hits", "misses", "stale")}
+
+
+metrics.gauge("ev_cache_events_total", "Succès et échecs des caches", _cache_events,
+              labels=("cache", "event"), kind="counter")
+metrics.gauge("ev_cache_memory_entries", "Entrées gardées en mémoire par cache",
+              lambda: {("geocode",): geocode_cache.stats()["memory_entries"],
+                       ("route",): route_cache.stats()["memory_entries"],
+                       ("probe",): probe_cache.stats()["memory_entries"]},
+              labels=("cache",))
+metrics.gauge("ev_singleflight_calls_total", "Appels reçus par groupe de regroupement",
+              lambda: {(name, kind): value for name, s in singleflight.stats().items()
+                       for kind, value in (("leader", s["calls"] - s["collapsed"]), ("collapsed", s["collapsed"]))},
+              labels=("group", "kind"), kind="counter")
+metrics.gauge("ev_quota_queue_depth", "Appels prioritaires en attente d'un jeton",
+              lambda: {(name,): s["queue_depth"] for name, s in quota.stats().items()},
+              labels=("service",))
+metrics.gauge("ev_quota_tokens", "Jetons disponibles par service (absent si pas de limite)",
+              lambda: {(name,): s["tokens"] for name, s in quota.stats().items()},
+              labels=("service",))
+metrics.gauge("ev_quota_shed_total", "Appels basse priorité rejetés faute de budget",
+              lambda: {(name,): s["shed"] for name, s in quota.stats().items()},
+              labels=("service",), kind="counter")
+metrics.gauge("ev_corridor_table_lookups_total", "Recherches dans la table des couloirs précalculés",
+              _corridor_lookups, labels=("result",), kind="counter")
+metrics.gauge("ev_upstream_breaker_open", "1 si le disjoncteur du service n'est pas fermé",
+              lambda: {(name,): int(state != "closed") for name, state in upstream.breaker_states().items()},
+              labels=("service",))
+
+
 # =========================================================
 #                       ROUTES
 # =========================================================
@@ -515,62 +1211,499 @@ def api_vehicles():
     return jsonify({"success": True, "vehicles": vehicles})
 
 
-@app.route('/plan', methods=['POST'])
-def plan_trip():
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/api/stats')
+def api_stats():
+    return jsonify({
+        "geocode_cache": geocode_cache.stats(),
+        "route_cache": route_cache.stats(),
+        "probe_cache": probe_cache.stats(),
+        "upstream_breakers": upstream.breaker_states(),
+        "singleflight": singleflight.stats(),
+        "upstream_quota": quota.stats(),
+        "corridor_table": load_corridor_table().stats() if load_corridor_table() else None,
+        "jobs": plan_jobs.stats()
+    })
+
+
+# ---------------------------------------------------------
+# 🔥 Préparation d'un plan (formulaire ou JSON)
+# ---------------------------------------------------------
+class PlanInputError(ValueError):
+    """Paramètres de plan invalides (réponse 400)"""
+
+
+def parse_coords(value=None, lat=None, lon=None):
+    """(lat, lon) depuis {"lat", "lon"}, [lat, lon] ou deux valeurs séparées ; None si absent"""
+    if isinstance(value, dict):
+        lat, lon = value.get("lat"), value.get("lon")
+    elif isinstance(value, (list, tuple)) and len(value) == 2:
+        lat, lon = value
+
+    if lat in (None, "") or lon in (None, ""):
+        return None
     try:
-        vehicle_id = request.form.get("vehicle")
-        start_city = request.form.get("start_city")
-        end_city = request.form.get("end_city")
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        raise PlanInputError("Coordonnées invalides")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise PlanInputError("Coordonnées invalides")
+    return (lat, lon)
+
+
+COMPARE_MAX_VEHICLES = int(os.getenv("COMPARE_MAX_VEHICLES", "10"))
+
 
-        vehicles = get_vehicles_from_chargetrip()
-        vehicle = next((v for v in vehicles if v["id"] == vehicle_id), None)
+def prepare_plan(vehicle_id, start_city, end_city, start_coords=None, end_coords=None):
+    """Véhicule + coordonnées des deux extrémités (géocodage seulement si elles manquent)"""
+    vehicle = vehicle_catalogue.get(vehicle_id)
+    if not vehicle:
+        raise PlanInputError("Véhicule introuvable")
 
+    return (vehicle, *resolve_endpoints(start_city, end_city, start_coords, end_coords))
+
+
+def prepare_comparison(vehicle_ids, start_city, end_city, start_coords=None, end_coords=None):
+    """Comme prepare_plan, pour une liste de véhicules (mode comparaison)"""
+    if not isinstance(vehicle_ids, list) or not vehicle_ids:
+        raise PlanInputError("vehicle_ids doit être une liste non vide")
+    if len(vehicle_ids) > COMPARE_MAX_VEHICLES:
+        raise PlanInputError(f"Au plus {COMPARE_MAX_VEHICLES} véhicules à comparer")
+
+    vehicles = []
+    for vehicle_id in vehicle_ids:
+        vehicle = vehicle_catalogue.get(vehicle_id)
         if not vehicle:
-            return jsonify({"error": "Véhicule introuvable"}), 400
+            raise PlanInputError(f"Véhicule introuvable : {vehicle_id}")
+        vehicles.append(vehicle)
 
-        coords_start = ors_geocode(start_city) or geocode_city(start_city)
-        coords_end = ors_geocode(end_city) or geocode_city(end_city)
+    return (vehicles, *resolve_endpoints(start_city, end_city, start_coords, end_coords))
 
-        if not coords_start or not coords_end:
-            return jsonify({"error": "Impossible de géocoder les villes"}), 400
 
-        # 🔥 Calcul avec route adaptée aux bornes + marge de sécurité
-        trip = calculate_trip_with_stops_and_route(
+def resolve_endpoints(start_city, end_city, start_coords=None, end_coords=None):
+    """Coordonnées des deux extrémités (géocodage seulement si elles manquent)"""
+    coords_start = start_coords or resolve_city(start_city)
+    coords_end = end_coords or resolve_city(end_city)
+
+    if not coords_start or not coords_end:
+        raise PlanInputError("Impossible de géocoder les villes")
+
+    return coords_start, coords_end
+
+
+def plan_result(trip, vehicle, coords_start, coords_end, start_city, end_city, geometry=None):
+    """
+    Réponse d'un plan à un véhicule (/plan, /plan/stream, /api/plan, jobs) :
+    trajet sans route_coords ; la route simplifiée n'est incluse que si
+    geometry (format, tolérance) est donné.
+    """
+    route_coords = trip.pop("route_coords")
+    result = {
+        "success": True,
+        "vehicle": vehicle,
+        "start_city": start_city,
+        "end_city": end_city,
+        "start": {"lat": coords_start[0], "lon": coords_start[1], "label": start_city},
+        "end": {"lat": coords_end[0], "lon": coords_end[1], "label": end_city},
+        "trip": trip
+    }
+    if geometry:
+        result["route"] = route_geometry(route_coords, *geometry)
+    return result
+
+
+def replay_events(trip, on_event):
+    """Événements de progression d'un plan déjà calculé (table des couloirs)"""
+    on_event("distance", {
+        "total_distance": trip["total_distance"],
+        "num_stops": trip["num_stops"],
+        "usable_range": trip["usable_range"]
+    })
+    for stop in trip["stops"]:
+        on_event("stop", stop)
+
+
+def compute_plan(vehicle, coords_start, coords_end, charging_time=30, on_event=None):
+    """
+    calculate_trip_with_stops_and_route partagé entre les requêtes identiques
+    en cours ; chaque appelant reçoit sa propre copie du résultat.
+    Les couloirs précalculés (corridor_table) sont servis sans appel amont.
+    Avec on_event (flux SSE, jobs asynchrones), l'appelant reçoit aussi la
+    progression du calcul partagé ; si on_event lève une exception, il
+    l'abandonne (le calcul s'arrête quand plus personne ne l'attend).
+    """
+    table = load_corridor_table()
+    if table is not None:
+        with span("corridor_table"):
+            trip = table.lookup(coords_start, coords_end, vehicle["range"], charging_time)
+        if trip is not None:
+            if on_event is not None:
+                replay_events(trip, on_event)
+            return trip
+
+    def compute(emit):
+        return calculate_trip_with_stops_and_route(
             coords_start,
             coords_end,
-            vehicle["range"]
+            vehicle["range"],
+            charging_time=charging_time,
+            on_event=emit
         )
 
-        # Carte avec la route complète
-        map_html = create_map(
-            coords_start, coords_end, trip["stops"],
-            start_city, end_city,
-            trip["route_coords"]
+    # Un seul groupe pour /plan, /plan/stream, /api/plan et les jobs : un
+    # appelant sans progression se joint au même calcul que les flux
+    key = (vehicle["id"], vehicle["range"], route_cache.key([coords_start, coords_end]), charging_time)
+    trip = singleflight.group("plan").do_with_progress(key, compute, on_event or (lambda name, data: None))
+    return dict(trip)
+
+
+@app.route('/plan', methods=['POST'])
+def plan_trip():
+    try:
+        vehicle_id = request.form.get("vehicle")
+        start_city = request.form.get("start_city")
+        end_city = request.form.get("end_city")
+
+        # Coordonnées déjà connues grâce à l'autocomplétion
+        vehicle, coords_start, coords_end = prepare_plan(
+            vehicle_id, start_city, end_city,
+            parse_coords(lat=request.form.get("start_lat"), lon=request.form.get("start_lon")),
+            parse_coords(lat=request.form.get("end_lat"), lon=request.form.get("end_lon"))
         )
 
-        return jsonify({
-            "success": True, 
-            "trip": trip, 
-            "map": map_html,
-            "vehicle": vehicle
-        })
+        # 🔥 Calcul avec route adaptée aux bornes + marge de sécurité
+        trip = compute_plan(vehicle, coords_start, coords_end)
+
+        # Carte Folium seulement sur demande (map=html) ; sinon la route
+        # simplifiée est renvoyée et la page dessine la carte avec Leaflet
+        if request.form.get("map") == "html":
+            with span("map_render"):
+                map_html = create_map(
+                    coords_start, coords_end, trip["stops"],
+                    start_city, end_city,
+                    trip["route_coords"]
+                )
+
+            return jsonify({
+                "success": True, 
+                "trip": trip, 
+                "map": map_html,
+                "vehicle": vehicle
+            })
+
+        geometry = parse_geometry_options(request.form)
+
+        return jsonify(plan_result(
+            trip, vehicle, coords_start, coords_end, start_city, end_city, geometry
+        ))
+
+    except PlanInputError as e:
+        return jsonify({"error": str(e)}), 400
 
     except Exception as e:
-        print("Erreur globale:", e)
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erreur globale: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
-if __name__ == "__main__":
-    print("🚗 Serveur Flask : http://localhost:5000")
-    print("🧼 SOAP endpoint : http://localhost:5000/soap")
-    print("📄 WSDL : http://localhost:5000/soap/wsdl")
+# ---------------------------------------------------------
+# 🔥 Plan en streaming (Server-Sent Events)
+# ---------------------------------------------------------
+def sse_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-    application = DispatcherMiddleware(app, {
-        "/soap": soap_wsgi_app
+
+@app.route('/plan/stream')
+def plan_trip_stream():
+    """
+    Même plan que /plan (paramètres en query string), envoyé étape par étape :
+    geocoded, distance, stop (un par arrêt, dès qu'il est résolu), puis route
+    (réponse complète de /plan) ou error. Le flux se ferme après route/error.
+    """
+    args = request.args.copy()
+
+    def run(events):
+        try:
+            geometry = parse_geometry_options(args)
+            start_city = args.get("start_city")
+            end_city = args.get("end_city")
+
+            vehicle, coords_start, coords_end = prepare_plan(
+                args.get("vehicle"), start_city, end_city,
+                parse_coords(lat=args.get("start_lat"), lon=args.get("start_lon")),
+                parse_coords(lat=args.get("end_lat"), lon=args.get("end_lon"))
+            )
+            events.put(("geocoded", {
+                "start": {"lat": coords_start[0], "lon": coords_start[1], "label": start_city},
+                "end": {"lat": coords_end[0], "lon": coords_end[1], "label": end_city},
+                "vehicle": vehicle
+            }))
+
+            trip = compute_plan(
+                vehicle, coords_start, coords_end,
+                on_event=lambda name, data: events.put((name, data))
+            )
+            events.put(("route", plan_result(
+                trip, vehicle, coords_start, coords_end, start_city, end_city, geometry
+            )))
+
+        except PlanInputError as e:
+            events.put(("error", {"error": str(e), "status": 400}))
+
+        except Exception as e:
+            logger.exception("Erreur /plan/stream: %s", e)
+            events.put(("error", {"error": str(e), "status": 500}))
+
+        finally:
+            events.put(None)
+
+    def generate():
+        events = queue.Queue()
+        # Le calcul continue dans son thread même si le client se déconnecte
+        # (les caches profitent quand même du résultat)
+        threading.Thread(target=run, args=(events,), daemon=True).start()
+
+        # Premier octet tout de suite : le navigateur sait que le calcul a démarré
+        yield ": plan\n\n"
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            yield sse_event(*event)
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
     })
 
+
+@app.route('/api/plan', methods=['POST'])
+def api_plan():
+    """
+    Planification en JSON. Chaque extrémité est donnée par un nom de ville
+    et/ou des coordonnées : "start": {"lat": .., "lon": ..} ou start_lat/start_lon.
+    Avec "vehicle_ids" (liste) au lieu de "vehicle_id" : comparaison des
+    véhicules sur le même trajet, un résultat par véhicule dans "comparisons".
+    """
+    data = request.get_json(silent=True) or {}
+
+    try:
+        start_city = data.get("start_city", "")
+        end_city = data.get("end_city", "")
+        start_coords = parse_coords(data.get("start"), data.get("start_lat"), data.get("start_lon"))
+        end_coords = parse_coords(data.get("end"), data.get("end_lat"), data.get("end_lon"))
+
+        try:
+            charging_time = int(data.get("charging_time", 30))
+        except (TypeError, ValueError):
+            raise PlanInputError("charging_time invalide")
+
+        geometry = parse_geometry_options(data) if data.get("geometry") else None
+
+        if "vehicle_ids" in data:
+            vehicles, coords_start, coords_end = prepare_comparison(
+                data["vehicle_ids"], start_city, end_city, start_coords, end_coords
+            )
+            trips = compare_trips(coords_start, coords_end, [v["range"] for v in vehicles], charging_time)
+
+            comparisons = []
+            geometries = {}  # les véhicules qui partagent une route partagent sa géométrie
+            for vehicle, trip in zip(vehicles, trips):
+                route_coords = trip.pop("route_coords")
+                comparison = {"vehicle": vehicle, "trip": trip}
+                if geometry:
+                    if id(route_coords) not in geometries:
+                        geometries[id(route_coords)] = route_geometry(route_coords, *geometry)
+                    comparison["route"] = geometries[id(route_coords)]
+                comparisons.append(comparison)
+
+            return jsonify({
+                "success": True,
+                "start_city": start_city,
+                "end_city": end_city,
+                "start": {"lat": coords_start[0], "lon": coords_start[1]},
+                "end": {"lat": coords_end[0], "lon": coords_end[1]},
+                "comparisons": comparisons
+            })
+
+        vehicle, coords_start, coords_end = prepare_plan(
+            data.get("vehicle_id"), start_city, end_city, start_coords, end_coords
+        )
+
+        trip = compute_plan(vehicle, coords_start, coords_end, charging_time)
+        return jsonify(plan_result(trip, vehicle, coords_start, coords_end, start_city, end_city, geometry))
+
+    except PlanInputError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    except Exception as e:
+        logger.exception("Erreur /api/plan: %s", e)
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route('/api/plan/batch', methods=['POST'])
+def api_plan_batch():
+    """
+    Planification de nombreux trajets en une requête, sans carte.
+    Corps : {"trips": [{"vehicle_id", "start_city"/"start", "end_city"/"end"}, ...]}
+    Réponse : NDJSON, une ligne par trajet dès qu'il est calculé.
+    """
+    from batch_planner import plan_batch
+
+    data = request.get_json(silent=True) or {}
+    trips = data.get("trips")
+    if not isinstance(trips, list) or not trips:
+        return jsonify({"success": False, "error": "Liste 'trips' manquante"}), 400
+
+    def generate():
+        for result in plan_batch(trips):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+# ---------------------------------------------------------
+# 🔥 Plans asynchrones : file de jobs partagée (SQLite)
+# ---------------------------------------------------------
+def run_plan_job(params, checkpoint):
+    """
+    Exécute un job de /api/jobs : même calcul et même réponse que /api/plan.
+    checkpoint() est appelé entre les étapes (géocodage, distance, chaque
+    arrêt) : il interrompt le plan annulé ou hors délai.
+    """
+    vehicle, coords_start, coords_end = prepare_plan(
+        params["vehicle_id"], params["start_city"], params["end_city"], params["start"], params["end"]
+    )
+    checkpoint()
+
+    trip = compute_plan(vehicle, coords_start, coords_end, params["charging_time"],
+                        on_event=lambda name, data: checkpoint())
+    return plan_result(trip, vehicle, coords_start, coords_end,
+                       params["start_city"], params["end_city"], params["geometry"])
+
+
+plan_jobs = JobQueue(
+    os.getenv("JOBS_DB_PATH", "data/jobs.sqlite3"),
+    run_plan_job,
+    workers=int(os.getenv("JOBS_WORKERS", "2")),
+    deadline_s=float(os.getenv("JOBS_DEADLINE_S", "120")),
+    max_queued=int(os.getenv("JOBS_MAX_QUEUED", "100")),
+    retention_s=float(os.getenv("JOBS_RETENTION_S", "86400"))
+)
+
+metrics.gauge("ev_jobs_queue_depth", "Plans asynchrones en attente d'un worker (toute la file partagée)",
+              lambda: plan_jobs.stats()["queue_depth"])
+metrics.gauge("ev_jobs", "Plans asynchrones gardés dans la file, par statut",
+              lambda: {(status,): n for status, n in plan_jobs.stats()["by_status"].items()},
+              labels=("status",))
+metrics.gauge("ev_jobs_busy_workers", "Threads de ce processus occupés par un plan asynchrone",
+              lambda: plan_jobs.stats()["busy_workers"])
+
+
+@app.route('/api/jobs', methods=['POST'])
+def api_jobs_submit():
+    """
+    Mise en file d'un plan : même corps que /api/plan (un seul véhicule),
+    plus "deadline_s" optionnel. Répond 202 tout de suite avec l'id du job,
+    à suivre sur GET /api/jobs/<id>.
+    """
+    data = request.get_json(silent=True) or {}
+
+    try:
+        params = {
+            "vehicle_id": data.get("vehicle_id"),
+            "start_city": data.get("start_city", ""),
+            "end_city": data.get("end_city", ""),
+            "start": parse_coords(data.get("start"), data.get("start_lat"), data.get("start_lon")),
+            "end": parse_coords(data.get("end"), data.get("end_lat"), data.get("end_lon")),
+            "geometry": parse_geometry_options(data) if data.get("geometry") else None
+        }
+        try:
+            params["charging_time"] = int(data.get("charging_time", 30))
+        except (TypeError, ValueError):
+            raise PlanInputError("charging_time invalide")
+
+        deadline_s = data.get("deadline_s")
+        if deadline_s is not None:
+            try:
+                deadline_s = float(deadline_s)
+            except (TypeError, ValueError):
+                deadline_s = None
+            # Un job à deadline nulle ou négative expirerait dès sa mise en file
+            if deadline_s is None or not 0 < deadline_s < float("inf"):
+                raise PlanInputError("deadline_s doit être un nombre de secondes positif")
+
+        # Vérifications sans appel amont ; le géocodage se fait dans le job
+        if not vehicle_catalogue.get(params["vehicle_id"]):
+            raise PlanInputError("Véhicule introuvable")
+        if not (params["start"] or params["start_city"]) or not (params["end"] or params["end_city"]):
+            raise PlanInputError("Départ et arrivée requis")
+
+        job_id = plan_jobs.submit(params, deadline_s=deadline_s)
+
+    except PlanInputError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    except QueueFull as e:
+        logger.warning("File de jobs pleine: %s", e)
+        return jsonify({"success": False, "error": "File de plans pleine, réessayez plus tard"}), 503
+
+    return jsonify({"success": True, "job_id": job_id, "status": "queued"}), 202, {"Location": f"/api/jobs/{job_id}"}
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def api_job(job_id):
+    """État d'un job (et son résultat une fois "done") ; DELETE l'annule"""
+    plan_jobs.start()
+    job = plan_jobs.cancel(job_id) if request.method == "DELETE" else plan_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job introuvable"}), 404
+    return jsonify({"success": True, "job": job})
+
+
+# ---------------------------------------------------------
+# 🔥 Démarrage : état partagé préchargé avant le fork des workers
+# ---------------------------------------------------------
+def warm_caches():
+    """
+    Charge une fois le snapshot du catalogue véhicules, les index IRVE et
+    communes, la table des couloirs et les entrées récentes du cache de
+    géocodage. Appelé dans le master gunicorn (--preload, voir gunicorn.conf.py) :
+    les workers forkés partagent ces données en copy-on-write au lieu de les
+    recharger chacun. N'appelle aucun service amont (pas de session HTTP ni
+    de budget SQLite ouverts dans le master), ne lance aucun thread et ferme
+    la connexion SQLite du cache de géocodage.
+    """
+    started = time.perf_counter()
+    with span("warm_caches"):
+        vehicles = vehicle_catalogue.preload()
+        stations = local_station_index()
+        communes = load_commune_index()
+        corridors = load_corridor_table()
+        geocoded = geocode_cache.warm()
+
+    logger.info(
+        "🔥 Caches préchargés en %.0f ms : %d véhicules, %d bornes, %d communes, %d couloirs, %d villes géocodées",
+        1000 * (time.perf_counter() - started),
+        len(vehicles or []), len(stations) if stations else 0, len(communes) if communes else 0,
+        len(corridors) if corridors else 0, geocoded
+    )
+
+
+# Point d'entrée WSGI (gunicorn app:application) : Flask + SOAP sur /soap
+application = DispatcherMiddleware(app, {
+    "/soap": soap_application
+})
+
+
+if __name__ == "__main__":
+    logger.info("🚗 Serveur Flask : http://localhost:5000")
+    logger.info("🧼 SOAP endpoint : http://localhost:5000/soap")
+    logger.info("📄 WSDL : http://localhost:5000/soap/wsdl")
+
     from werkzeug.serving import run_simple
     run_simple("0.0.0.0", 5000, application, use_reloader=True)
 
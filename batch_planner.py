@@ -0,0 +1,219 @@
+# batch_planner.py
+
+"""
+Planification par lots (jobs what-if nocturnes, intégrations tierces).
+
+Pour tout le lot :
+  1. chaque ville distincte n'est géocodée qu'une fois ;
+  2. les distances des paires départ/arrivée viennent d'appels ORS /matrix
+     qui ne demandent que les destinations de chaque source ; un trajet qui
+     ne demande aucun arrêt est résolu avec ces seules valeurs, sans calcul
+     de route. Chaque trajet part dès que l'appel qui le couvre a répondu ;
+  3. les autres trajets passent par calculate_trip_with_stops_and_route :
+     les routes identiques en cours sont regroupées (singleflight) et les
+     routes déjà calculées viennent du cache borné route_cache, sans garder
+     toutes les géométries du lot en mémoire.
+
+Si le client coupe le flux NDJSON, les trajets pas encore commencés sont
+annulés (les calculs en cours se terminent en arrière-plan).
+
+Usage en ligne de commande :
+    python batch_planner.py trips.json > results.ndjson
+"""
+
+import json
+import os
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import app as planner
+from geocode_cache import normalize_city_name
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))
+
+
+class _OnceMap:
+    """Résultats partagés par clé : les appels concurrents d'une même clé attendent le premier."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def get(self, key, compute):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[key] = future
+
+        if owner:
+            try:
+                future.set_result(compute())
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+
+def _endpoint(trip, prefix):
+    """(nom de ville, coordonnées éventuelles) d'une extrémité du trajet"""
+    city = trip.get(f"{prefix}_city", "")
+    coords = planner.parse_coords(trip.get(prefix), trip.get(f"{prefix}_lat"), trip.get(f"{prefix}_lon"))
+    return city, coords
+
+
+def _expand(trips):
+    """Un trajet avec "vehicle_ids" devient un trajet par véhicule"""
+    for trip in trips:
+        vehicle_ids = trip.get("vehicle_ids")
+        if isinstance(vehicle_ids, list):
+            for vehicle_id in vehicle_ids:
+                yield dict(trip, vehicle_id=vehicle_id)
+        else:
+            yield trip
+
+
+def _trip_without_stops(distance_km, duration_h, vehicle_range):
+    """Résultat au format calculate_trip_with_stops_and_route, depuis la matrice ORS"""
+    return {
+        "total_distance": round(distance_km, 2),
+        "num_stops": 0,
+        "stops": [],
+        "driving_time": round(duration_h, 2),
+        "charging_time": 0,
+        "total_time": round(duration_h, 2),
+        "usable_range": round(planner.usable_range_km(vehicle_range), 1),
+        "safety_margin_km": round(vehicle_range * planner.BATTERY_SAFETY_MARGIN, 1)
+    }
+
+
+def plan_batch(trips, workers=None):
+    """
+    Planifie une liste de trajets et produit un dict par trajet, dans l'ordre
+    où ils se terminent (chaque résultat porte l'index du trajet d'origine).
+    """
+    trips = list(_expand(trips))
+    workers = workers or BATCH_WORKERS
+
+    # Coordonnées des villes du lot (quelques octets par ville distincte)
+    geocoded = _OnceMap()
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+    try:
+        # 1. Géocodage des villes distinctes (en parallèle)
+        resolved = []
+        errors = {}
+        for index, trip in enumerate(trips):
+            try:
+                resolved.append((index, trip, _endpoint(trip, "start"), _endpoint(trip, "end")))
+            except planner.PlanInputError as e:
+                errors[index] = str(e)
+
+        names = {
+            city for _, _, start, end in resolved for city, coords in (start, end)
+            if not coords and city
+        }
+        list(pool.map(lambda city: geocoded.get(normalize_city_name(city),
+                                                lambda: planner.resolve_city(city)), names))
+
+        def coords_of(endpoint):
+            city, coords = endpoint
+            if coords:
+                return coords
+            if not city:
+                return None
+            return geocoded.get(normalize_city_name(city), lambda: planner.resolve_city(city))
+
+        # 2. Paires départ/arrivée à demander à la matrice ORS
+        pairs = {}
+        for index, trip, start, end in resolved:
+            pairs[index] = (coords_of(start), coords_of(end))
+
+        waiting = {}  # paire -> index des trajets qui attendent sa distance
+        for index, pair in pairs.items():
+            if pair[0] and pair[1]:
+                waiting.setdefault(pair, []).append(index)
+
+        # 3. Calcul de chaque trajet
+        def run(index, trip, summary):
+            start_city, _ = _endpoint(trip, "start")
+            end_city, _ = _endpoint(trip, "end")
+            result = {
+                "index": index,
+                "vehicle_id": trip.get("vehicle_id"),
+                "start_city": start_city,
+                "end_city": end_city
+            }
+
+            try:
+                vehicle = planner.vehicle_catalogue.get(trip.get("vehicle_id"))
+                if not vehicle:
+                    raise planner.PlanInputError("Véhicule introuvable")
+
+                coords_start, coords_end = pairs[index]
+                if not coords_start or not coords_end:
+                    raise planner.PlanInputError("Impossible de géocoder les villes")
+
+                charging_time = int(trip.get("charging_time", 30))
+                usable_range = planner.usable_range_km(vehicle["range"])
+
+                if summary and planner.stops_needed(summary[0], usable_range) == 0:
+                    trip_result = _trip_without_stops(summary[0], summary[1], vehicle["range"])
+                else:
+                    trip_result = planner.calculate_trip_with_stops_and_route(
+                        coords_start, coords_end, vehicle["range"], charging_time=charging_time
+                    )
+                    trip_result.pop("route_coords", None)
+
+                result.update(success=True, trip=trip_result)
+
+            except Exception as e:
+                result.update(success=False, error=str(e))
+
+            return result
+
+        for index, message in errors.items():
+            yield {"index": index, "vehicle_id": trips[index].get("vehicle_id"), "success": False, "error": message}
+
+        # Trajets sans paire complète : tout de suite (ils finissent en erreur)
+        pending = {pool.submit(run, index, trip, None)
+                   for index, trip, _, _ in resolved if pairs[index] not in waiting}
+
+        # Appels /matrix en parallèle ; chacun lance ses trajets dès sa réponse
+        matrix_calls = {
+            pool.submit(planner.ors_matrix, sources, destinations): (sources, destinations)
+            for sources, destinations in planner.matrix_requests(waiting)
+        }
+        pending |= set(matrix_calls)
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future not in matrix_calls:
+                    yield future.result()
+                    continue
+                sources, destinations = matrix_calls.pop(future)
+                summaries = future.result()
+                for pair in ((source, destination) for source in sources for destination in destinations):
+                    for index in waiting.pop(pair, []):
+                        pending.add(pool.submit(run, index, trips[index], summaries.get(pair)))
+    finally:
+        # Fin normale, ou générateur fermé (client déconnecté) : on n'attend
+        # pas les trajets restants, ceux pas encore commencés sont annulés
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage : python batch_planner.py trips.json > results.ndjson", file=sys.stderr)
+        sys.exit(1)
+
+    with open(sys.argv[1], encoding="utf-8") as f:
+        data = json.load(f)
+    trips = data["trips"] if isinstance(data, dict) else data
+
+    # Les logs du calcul partent sur stderr, stdout ne contient que le NDJSON
+    for result in plan_batch(trips):
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
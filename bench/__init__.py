@@ -0,0 +1,3 @@
+# bench/__init__.py
+
+"""Benchmark hors ligne avec des services amont simulés (voir bench/run.py)."""
@@ -0,0 +1,125 @@
+# bench/cold_start.py
+
+"""
+Budget de démarrage à froid d'un worker, mesuré hors ligne (services amont
+remplacés par bench/stubs.py).
+
+Dans un processus Python neuf, comme un worker gunicorn sans --preload :
+- durée de `import app` ;
+- modules lourds qui ne doivent PAS être chargés à l'import (folium, geopy,
+  spyne : chargés à la première requête qui en a besoin) ;
+- durée de app.warm_caches() (ce que fait le master gunicorn avant le fork) ;
+- durée de la première requête /plan.
+
+Code de sortie 1 si un budget est dépassé ou si un module lourd est importé
+trop tôt : à lancer en CI pour empêcher les régressions de démarrage.
+
+Usage :
+    python -m bench.cold_start --import-budget-ms 700 --first-request-budget-ms 3000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from bench.stubs import StubServers
+
+LAZY_MODULES = ("folium", "geopy", "spyne", "soap_service")
+
+PROBE = r"""
+import json, sys, time
+
+started = time.perf_counter()
+import app
+import_s = time.perf_counter() - started
+early = [m for m in {lazy!r} if m in sys.modules]
+
+started = time.perf_counter()
+app.warm_caches()
+warm_s = time.perf_counter() - started
+
+client = app.app.test_client()
+started = time.perf_counter()
+response = client.post("/plan", data={{"vehicle": {vehicle!r}, "start_city": "Paris", "end_city": "Lyon"}})
+first_s = time.perf_counter() - started
+
+print(json.dumps({{
+    "import_ms": round(1000 * import_s, 1),
+    "warm_caches_ms": round(1000 * warm_s, 1),
+    "first_request_ms": round(1000 * first_s, 1),
+    "first_request_status": response.status_code,
+    "early_imports": early
+}}))
+"""
+
+
+def probe(stubs, vehicle):
+    env = dict(os.environ)
+    env.update(stubs.env())
+    env.setdefault("ORS_API_KEY", "bench")
+    env.setdefault("CHARGETRIP_CLIENT_ID", "bench")
+    env.setdefault("CHARGETRIP_APP_ID", "bench")
+    env.setdefault("ROUTE_CACHE_PATH", "")
+    env.setdefault("GEOCODE_CACHE_PATH", "")
+    env.setdefault("VEHICLES_SNAPSHOT_PATH", "")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    for service in StubServers.SERVICES:
+        env.setdefault(f"QUOTA_{service.upper()}_PER_MINUTE", "0")
+
+    code = PROBE.format(lazy=LAZY_MODULES, vehicle=vehicle)
+    output = subprocess.run(
+        [sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Budget de démarrage à froid d'un worker")
+    parser.add_argument("--runs", type=int, default=3, help="processus neufs mesurés (on garde le meilleur)")
+    parser.add_argument("--import-budget-ms", type=float, default=700)
+    parser.add_argument("--warm-budget-ms", type=float, default=2000)
+    parser.add_argument("--first-request-budget-ms", type=float, default=3000)
+    parser.add_argument("--vehicle", default="v-tesla-m3-lr")
+    parser.add_argument("--json", help="écrit aussi les mesures dans ce fichier JSON")
+    args = parser.parse_args(argv)
+
+    with StubServers() as stubs:
+        runs = [probe(stubs, args.vehicle) for _ in range(max(1, args.runs))]
+
+    best = {key: min(run[key] for run in runs) for key in ("import_ms", "warm_caches_ms", "first_request_ms")}
+    early = sorted({m for run in runs for m in run["early_imports"]})
+    statuses = sorted({run["first_request_status"] for run in runs})
+
+    checks = [
+        ("import app", best["import_ms"], args.import_budget_ms),
+        ("warm_caches", best["warm_caches_ms"], args.warm_budget_ms),
+        ("1re requête /plan", best["first_request_ms"], args.first_request_budget_ms),
+    ]
+    failed = False
+    for label, value, budget in checks:
+        ok = value <= budget
+        failed |= not ok
+        print(f"{'✅' if ok else '❌'} {label:<18} {value:>8.1f} ms  (budget {budget:.0f} ms)")
+
+    if early:
+        failed = True
+        print(f"❌ modules chargés dès l'import : {', '.join(early)}")
+    else:
+        print(f"✅ chargés à la demande : {', '.join(LAZY_MODULES)}")
+
+    if statuses != [200]:
+        failed = True
+        print(f"❌ 1re requête /plan : HTTP {statuses}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "best": best, "runs": runs, "early_imports": early},
+                      f, ensure_ascii=False, indent=2)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
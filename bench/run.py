@@ -0,0 +1,228 @@
+# bench/run.py
+
+"""
+Benchmark hors ligne de l'application : ORS, IRVE et Chargetrip sont
+remplacés par les serveurs locaux de bench/stubs.py, aucune clé API ni
+accès réseau n'est nécessaire.
+
+Chaque scénario (/plan, /api/geocode, /api/vehicles, /soap) est lancé à son
+tour sous la concurrence demandée. Pour chacun : débit, latences p50/p95/p99,
+appels amont par requête et répartition entre le temps passé dans les
+services amont (latence simulée comprise) et notre propre temps.
+
+Usage :
+    python -m bench.run --requests 200 --concurrency 8 --latency ors=120,irve=60,chargetrip=150
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from bench.stubs import FIXTURES, StubServers
+
+SCENARIOS = ("plan", "geocode", "vehicles", "soap")
+
+SOAP_ENVELOPE = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ev="ev.trip.calculator">
+  <soapenv:Body>
+    <ev:calculate_trip_time>
+      <ev:distance>{distance}</ev:distance>
+      <ev:vehicle_range>{vehicle_range}</ev:vehicle_range>
+      <ev:charging_time_minutes>30</ev:charging_time_minutes>
+    </ev:calculate_trip_time>
+  </soapenv:Body>
+</soapenv:Envelope>"""
+
+
+def parse_latency(value):
+    """'ors=120,irve=60' -> {"ors": 120.0, "irve": 60.0}"""
+    latency = {}
+    for part in filter(None, (value or "").split(",")):
+        service, _, ms = part.partition("=")
+        latency[service.strip()] = float(ms)
+    return latency
+
+
+# ---------------------------------------------------------
+# 🔥 Requêtes de chaque scénario
+# ---------------------------------------------------------
+def build_requests(scenario, count, rng):
+    """Liste de (méthode, chemin, kwargs requests), tirée d'avance pour être reproductible"""
+    cities = [c["name"] for c in json.loads((FIXTURES / "cities.json").read_text(encoding="utf-8"))]
+    vehicle_ids = [v["id"] for v in json.loads(
+        (FIXTURES / "chargetrip_vehicles.json").read_text(encoding="utf-8")
+    )["data"]["vehicleList"]]
+
+    calls = []
+    for _ in range(count):
+        if scenario == "plan":
+            start_city, end_city = rng.sample(cities, 2)
+            form = {"vehicle": rng.choice(vehicle_ids), "start_city": start_city, "end_city": end_city}
+            calls.append(("POST", "/plan", {"data": form}))
+        elif scenario == "geocode":
+            city = rng.choice(cities)
+            prefix = city[:rng.randint(3, max(3, min(len(city), 6)))]
+            calls.append(("GET", "/api/geocode", {"params": {"q": prefix}}))
+        elif scenario == "vehicles":
+            calls.append(("GET", "/api/vehicles", {}))
+        elif scenario == "soap":
+            body = SOAP_ENVELOPE.format(distance=rng.randint(50, 1200), vehicle_range=rng.randint(200, 600))
+            calls.append(("POST", "/soap", {"data": body, "headers": {"Content-Type": "text/xml"}}))
+    return calls
+
+
+def run_scenario(base_url, calls, concurrency):
+    """Latences (s) et nombre d'erreurs, plus la durée totale du scénario"""
+    local = threading.local()
+
+    def one(call):
+        method, path, kwargs = call
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = local.session.request(method, base_url + path, timeout=120, **kwargs)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, calls))
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array([latency for latency, _ in results])
+    errors = sum(1 for _, ok in results if not ok)
+    return latencies, errors, elapsed
+
+
+def summarize(scenario, latencies, errors, elapsed, upstream_stats):
+    count = len(latencies)
+    upstream_calls = sum(s["calls"] for s in upstream_stats.values())
+    upstream_s = sum(s["busy_s"] for s in upstream_stats.values())
+    mean_ms = 1000 * float(latencies.mean()) if count else 0.0
+    upstream_ms = 1000 * upstream_s / count if count else 0.0
+    p50, p95, p99 = (1000 * np.percentile(latencies, [50, 95, 99])).tolist() if count else (0.0, 0.0, 0.0)
+
+    return {
+        "scenario": scenario,
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(p50, 1),
+        "p95_ms": round(p95, 1),
+        "p99_ms": round(p99, 1),
+        "mean_ms": round(mean_ms, 1),
+        "upstream_calls_per_request": round(upstream_calls / count, 2) if count else 0.0,
+        # Temps cumulé des appels amont : les appels parallèles d'une même
+        # requête (recherches de bornes) se chevauchent, la part "own" est
+        # alors une borne basse
+        "upstream_ms_per_request": round(upstream_ms, 1),
+        "own_ms_per_request": round(max(mean_ms - upstream_ms, 0.0), 1),
+        "upstream_by_service": {
+            service: {"calls": s["calls"], "ms": round(1000 * s["busy_s"], 1)}
+            for service, s in upstream_stats.items() if s["calls"]
+        }
+    }
+
+
+def print_report(rows, out):
+    header = (
+        f"{'scénario':<10} {'req':>5} {'err':>4} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8}"
+        f" {'amont/req':>10} {'amont ms':>9} {'nous ms':>8}"
+    )
+    print(header, file=out)
+    print("-" * len(header), file=out)
+    for r in rows:
+        print(
+            f"{r['scenario']:<10} {r['requests']:>5} {r['errors']:>4} {r['throughput_rps']:>7}"
+            f" {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8}"
+            f" {r['upstream_calls_per_request']:>10} {r['upstream_ms_per_request']:>9} {r['own_ms_per_request']:>8}",
+            file=out
+        )
+
+
+# ---------------------------------------------------------
+# 🔥 Point d'entrée
+# ---------------------------------------------------------
+def configure_env(stubs, args):
+    """Pointe l'application vers les stubs, sans cache disque ni quota (à faire avant `import app`)"""
+    os.environ.update(stubs.env())
+    os.environ.setdefault("ORS_API_KEY", "bench")
+    os.environ.setdefault("CHARGETRIP_CLIENT_ID", "bench")
+    os.environ.setdefault("CHARGETRIP_APP_ID", "bench")
+    os.environ["IRVE_SOURCE"] = args.irve
+    os.environ["COMMUNES_PATH"] = args.communes
+    os.environ.setdefault("ROUTE_CACHE_PATH", "")
+    os.environ.setdefault("GEOCODE_CACHE_PATH", "")
+    os.environ.setdefault("VEHICLES_SNAPSHOT_PATH", "")
+    # Les logs de l'application ne doivent pas se mêler au rapport
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    for service in StubServers.SERVICES:
+        os.environ.setdefault(f"QUOTA_{service.upper()}_PER_MINUTE", "0")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne avec services amont simulés")
+    parser.add_argument("--requests", type=int, default=200, help="requêtes par scénario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", default="ors=120,irve=60,chargetrip=150",
+                        help="latence simulée par service, en ms")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--irve", choices=("remote", "local"), default="remote",
+                        help="bornes via le stub IRVE (remote) ou l'index local")
+    parser.add_argument("--communes", default="",
+                        help="fichier des communes pour /api/geocode (vide = autocomplétion ORS)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="écrit aussi les résultats dans ce fichier JSON")
+    args = parser.parse_args(argv)
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"scénarios inconnus : {', '.join(sorted(unknown))}")
+
+    report = sys.stdout
+    stubs = StubServers(parse_latency(args.latency)).start()
+    configure_env(stubs, args)
+
+    import app as planner
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, planner.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    rng = random.Random(args.seed)
+    rows = []
+    try:
+        for scenario in scenarios:
+            calls = build_requests(scenario, args.requests, rng)
+            stubs.reset_stats()
+            latencies, errors, elapsed = run_scenario(base_url, calls, args.concurrency)
+            rows.append(summarize(scenario, latencies, errors, elapsed, stubs.snapshot()))
+    finally:
+        server.shutdown()
+        stubs.stop()
+
+    print(f"concurrence {args.concurrency}, latence amont {args.latency}, bornes {args.irve}", file=report)
+    print_report(rows, report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+# bench/stubs.py
+
+"""
+Serveurs HTTP locaux qui remplacent ORS, l'API IRVE et Chargetrip pendant
+les benchmarks, avec une latence configurable par service.
+
+- ORS : /geocode/search et /geocode/autocomplete depuis fixtures/cities.json,
+  /v2/directions/driving-car/geojson et /v2/matrix/driving-car calculés
+  (géométrie dense interpolée entre les waypoints, comme une vraie route),
+  /v2/directions/driving-car/json en encoded polyline (simplifiée sur
+  demande : geometry_simplify) ;
+- IRVE : /records avec la clause where=distance(...) de l'application, sur
+  un jeu de bornes généré une fois (graine fixe) ;
+- Chargetrip : /graphql, pagination de fixtures/chargetrip_vehicles.json.
+
+Chaque service compte ses appels et le temps passé à y répondre (latence
+simulée comprise) : c'est la part "amont" du temps de réponse mesuré.
+"""
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from polyline import encode as encode_polyline, simplify
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+# Géométrie des routes simulées : un point tous les ROUTE_STEP_KM
+ROUTE_STEP_KM = 0.15
+ROAD_FACTOR = 1.25
+ROAD_SPEED_KMH = 95.0
+# Tolérance de la géométrie simplifiée (geometry_simplify)
+SIMPLIFY_TOLERANCE_M = 50.0
+
+# Bornes simulées sur la France métropolitaine
+STATION_COUNT = 20000
+FRANCE_BBOX = (42.3, 51.1, -4.8, 8.2)
+
+WHERE_RE = re.compile(r"POINT\(([-\d.]+) ([-\d.]+)\)'\s*,\s*([\d.]+)km")
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _key(text):
+    return text.split(",")[0].strip().lower()
+
+
+class StubData:
+    """Données servies par les trois services (chargées une seule fois)."""
+
+    def __init__(self, seed=42):
+        self.cities = json.loads((FIXTURES / "cities.json").read_text(encoding="utf-8"))
+        self.cities_by_name = {_key(c["name"]): c for c in self.cities}
+        self.vehicles = json.loads(
+            (FIXTURES / "chargetrip_vehicles.json").read_text(encoding="utf-8")
+        )["data"]["vehicleList"]
+
+        rng = np.random.default_rng(seed)
+        lat_min, lat_max, lon_min, lon_max = FRANCE_BBOX
+        self.station_lats = rng.uniform(lat_min, lat_max, STATION_COUNT)
+        self.station_lons = rng.uniform(lon_min, lon_max, STATION_COUNT)
+        self.station_powers = rng.choice([7, 22, 50, 150, 350], STATION_COUNT)
+
+    # ---------------------------------------------------------
+    # 🔥 ORS
+    # ---------------------------------------------------------
+    @staticmethod
+    def _feature(city):
+        return {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [city["lon"], city["lat"]]},
+            "properties": {
+                "name": city["name"],
+                "locality": city["name"],
+                "county": city["county"],
+                "region": city["region"]
+            }
+        }
+
+    def geocode(self, text):
+        city = self.cities_by_name.get(_key(text))
+        return {"type": "FeatureCollection", "features": [self._feature(city)] if city else []}
+
+    def autocomplete(self, text):
+        prefix = _key(text)
+        features = [self._feature(c) for c in self.cities if c["name"].lower().startswith(prefix)]
+        return {"type": "FeatureCollection", "features": features}
+
+    def directions_json(self, body):
+        """Réponse au format JSON d'ORS : résumé + géométrie en encoded polyline"""
+        feature = self.directions(body["coordinates"])["features"][0]
+        points = np.asarray(feature["geometry"]["coordinates"], dtype=np.float64)[:, ::-1]
+        if body.get("geometry_simplify"):
+            points = simplify(points, SIMPLIFY_TOLERANCE_M)
+        return {"routes": [{"summary": feature["properties"]["summary"], "geometry": encode_polyline(points)}]}
+
+    def directions(self, coordinates):
+        """Route [lon, lat] dense entre les waypoints, distance routière = ROAD_FACTOR x vol d'oiseau"""
+        coords = [coordinates[0]]
+        crow_km = 0.0
+        for (lon1, lat1), (lon2, lat2) in zip(coordinates, coordinates[1:]):
+            leg_km = float(_haversine_km(lat1, lon1, lat2, lon2))
+            crow_km += leg_km
+            n = max(2, int(leg_km / ROUTE_STEP_KM))
+            t = np.linspace(0.0, 1.0, n)[1:]
+            coords.extend(np.column_stack((lon1 + (lon2 - lon1) * t, lat1 + (lat2 - lat1) * t)).round(6).tolist())
+
+        distance_m = crow_km * ROAD_FACTOR * 1000
+        return {
+            "type": "FeatureCollection",
+            "features": [{
+                "type": "Feature",
+                "geometry": {"type": "LineString", "coordinates": coords},
+                "properties": {
+                    "summary": {"distance": distance_m, "duration": distance_m / 1000 / ROAD_SPEED_KMH * 3600}
+                }
+            }]
+        }
+
+    def matrix(self, body):
+        locations = np.asarray(body["locations"], dtype=np.float64)
+        src = locations[body["sources"]]
+        dst = locations[body["destinations"]]
+        km = _haversine_km(src[:, None, 1], src[:, None, 0], dst[None, :, 1], dst[None, :, 0]) * ROAD_FACTOR
+        return {"distances": km.round(2).tolist(), "durations": (km / ROAD_SPEED_KMH * 3600).round(1).tolist()}
+
+    # ---------------------------------------------------------
+    # 🔥 IRVE
+    # ---------------------------------------------------------
+    def irve_records(self, where, limit):
+        match = WHERE_RE.search(where or "")
+        if not match:
+            return {"total_count": 0, "results": []}
+        lon, lat, radius = map(float, match.groups())
+
+        dist = _haversine_km(lat, lon, self.station_lats, self.station_lons)
+        inside = np.flatnonzero(dist <= radius)
+        # Comme l'API : pas de tri par distance, juste les `limit` premières
+        results = [{
+            "n_enseigne": f"Borne bench {i}",
+            "n_operateur": "Bench",
+            "ad_station": f"{i} route de test",
+            "geo_point_borne": {"lat": float(self.station_lats[i]), "lon": float(self.station_lons[i])},
+            "puiss_max": int(self.station_powers[i])
+        } for i in inside[:limit].tolist()]
+        return {"total_count": len(inside), "results": results}
+
+    # ---------------------------------------------------------
+    # 🔥 Chargetrip
+    # ---------------------------------------------------------
+    def vehicle_list(self, variables):
+        page = int(variables.get("page") or 0)
+        size = int(variables.get("size") or 10)
+        return {"data": {"vehicleList": self.vehicles[page * size:(page + 1) * size]}}
+
+
+class ServiceStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.busy_s = 0.0
+
+    def record(self, elapsed):
+        with self._lock:
+            self.calls += 1
+            self.busy_s += elapsed
+
+    def snapshot(self):
+        with self._lock:
+            return {"calls": self.calls, "busy_s": self.busy_s}
+
+
+def _make_handler(service, data, stats, latency_s):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # En-têtes et corps partent en deux écritures : sans ça, Nagle + ACK
+        # retardé ajoutent ~40 ms à chaque appel
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _handle(self, method):
+            started = time.perf_counter()
+            try:
+                if latency_s:
+                    time.sleep(latency_s)
+                url = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                body = self._read_json() if method == "POST" else {}
+                payload = self._route(method, url.path, query, body)
+                if payload is None:
+                    self._reply({"error": f"{method} {url.path} non simulé"}, status=404)
+                else:
+                    self._reply(payload)
+            finally:
+                stats.record(time.perf_counter() - started)
+
+        def _route(self, method, path, query, body):
+            if service == "ors":
+                if method == "GET" and path.endswith("/geocode/search"):
+                    return data.geocode(query.get("text", ""))
+                if method == "GET" and path.endswith("/geocode/autocomplete"):
+                    return data.autocomplete(query.get("text", ""))
+                if method == "POST" and "/directions/" in path and path.endswith("/json"):
+                    return data.directions_json(body)
+                if method == "POST" and "/directions/" in path:
+                    return data.directions(body["coordinates"])
+                if method == "POST" and "/matrix/" in path:
+                    return data.matrix(body)
+            elif service == "irve" and method == "GET":
+                return data.irve_records(query.get("where"), int(query.get("limit") or 10))
+            elif service == "chargetrip" and method == "POST":
+                return data.vehicle_list(body.get("variables") or {})
+            return None
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+    return Handler
+
+
+class StubServers:
+    """
+    Les trois services sur des ports locaux libres.
+    latency_ms : {"ors": 120, "irve": 60, "chargetrip": 150}
+    """
+
+    SERVICES = ("ors", "irve", "chargetrip")
+
+    def __init__(self, latency_ms=None, host="127.0.0.1"):
+        latency_ms = latency_ms or {}
+        self.data = StubData()
+        self.stats = {service: ServiceStats() for service in self.SERVICES}
+        self._servers = {}
+        for service in self.SERVICES:
+            handler = _make_handler(service, self.data, self.stats[service], latency_ms.get(service, 0) / 1000)
+            server = ThreadingHTTPServer((host, 0), handler)
+            server.daemon_threads = True
+            self._servers[service] = server
+
+    def url(self, service):
+        host, port = self._servers[service].server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """Variables d'environnement qui pointent l'application vers les stubs"""
+        return {
+            "ORS_BASE_URL": self.url("ors"),
+            "IRVE_API_URL": self.url("irve") + "/records",
+            "CHARGETRIP_URL": self.url("chargetrip") + "/graphql",
+        }
+
+    def start(self):
+        for server in self._servers.values():
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in self._servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def reset_stats(self):
+        for stats in self.stats.values():
+            stats.reset()
+
+    def snapshot(self):
+        return {service: stats.snapshot() for service, stats in self.stats.items()}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
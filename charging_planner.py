@@ -0,0 +1,84 @@
+# charging_planner.py
+
+"""
+Choix optimal des arrêts de recharge parmi les bornes d'un couloir.
+
+Les bornes candidates sont projetées sur la route (position en km depuis
+le départ + détour en km). On cherche le plus court chemin départ -> arrivée
+dans le graphe d'atteignabilité : une arête i -> j existe si la distance
+parcourue entre les deux, détours compris, tient dans l'autonomie utilisable
+(marge de sécurité déjà déduite). Le coût d'un arrêt est le temps de
+recharge plus le temps du détour aller-retour ; le temps de conduite sur la
+route elle-même est identique pour tous les plans.
+"""
+
+import numpy as np
+
+# Une seule borne gardée par tronçon de route (la plus proche de la route)
+DEFAULT_BUCKET_KM = 2.0
+
+
+def prune_candidates(positions, detours, powers=None, bucket_km=DEFAULT_BUCKET_KM):
+    """
+    Indices des candidats à garder : par tronçon de bucket_km, la borne au plus
+    petit détour (puis à la plus forte puissance). Les autres sont dominées.
+    """
+    if not len(positions):
+        return np.empty(0, dtype=np.int64)
+
+    buckets = np.floor(positions / bucket_km).astype(np.int64)
+    power_key = -np.nan_to_num(powers, nan=0.0) if powers is not None else np.zeros(len(positions))
+    order = np.lexsort((power_key, detours, buckets))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = buckets[order][1:] != buckets[order][:-1]
+    keep = order[first]
+    return keep[np.argsort(positions[keep], kind="stable")]
+
+
+def plan_stops(positions, detours, total_km, usable_range, charging_time_h, speed_kmh):
+    """
+    Arrêts minimisant le temps total (recharge + détours).
+    positions/detours : tableaux triés par position croissante.
+    Retourne la liste des indices des bornes choisies (ordre de passage),
+    ou None si aucune suite de bornes ne permet d'atteindre l'arrivée.
+    """
+    if total_km <= usable_range:
+        return []
+
+    n = len(positions)
+    if not n:
+        return None
+
+    # Nœuds : 0 = départ, 1..n = bornes, n + 1 = arrivée
+    pos = np.concatenate(([0.0], positions, [total_km]))
+    det = np.concatenate(([0.0], detours, [0.0]))
+    stop_cost = np.concatenate(([0.0], charging_time_h + 2 * detours / speed_kmh, [0.0]))
+
+    cost = np.full(n + 2, np.inf)
+    cost[0] = 0.0
+    prev = np.full(n + 2, -1, dtype=np.int64)
+
+    # Premier nœud encore atteignable pour chaque nœud (fenêtre glissante)
+    lows = np.searchsorted(pos, pos - usable_range, side="left")
+
+    for j in range(1, n + 2):
+        lo = lows[j]
+        if lo >= j:
+            continue
+        window = slice(lo, j)
+        reachable = (pos[j] - pos[window] + det[window] + det[j]) <= usable_range
+        candidates = np.where(reachable, cost[window], np.inf)
+        best = int(np.argmin(candidates))
+        if np.isfinite(candidates[best]):
+            cost[j] = candidates[best] + stop_cost[j]
+            prev[j] = lo + best
+
+    if not np.isfinite(cost[n + 1]):
+        return None
+
+    chosen = []
+    node = prev[n + 1]
+    while node > 0:
+        chosen.append(int(node) - 1)
+        node = prev[node]
+    return chosen[::-1]
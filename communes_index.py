@@ -0,0 +1,160 @@
+# communes_index.py
+
+"""
+Index de préfixes des communes françaises pour l'autocomplétion.
+
+Les noms normalisés (sans accents, minuscules) sont triés une fois au
+chargement ; une recherche de préfixe est une double recherche
+dichotomique (bisect) suivie d'un classement par population.
+"""
+
+import csv
+import heapq
+import json
+import logging
+import os
+import threading
+from bisect import bisect_left
+
+from geocode_cache import normalize_city_name
+
+logger = logging.getLogger(__name__)
+
+NAME_KEYS = ("nom_standard", "nom_commune_complet", "nom_commune", "nom", "name")
+DEPARTMENT_KEYS = ("dep_nom", "nom_departement", "departement", "county")
+REGION_KEYS = ("reg_nom", "nom_region", "region")
+LAT_KEYS = ("latitude_centre", "latitude_mairie", "latitude", "lat")
+LON_KEYS = ("longitude_centre", "longitude_mairie", "longitude", "lon")
+POPULATION_KEYS = ("population", "pop", "population_totale")
+
+# Au-delà de ce nombre de communes ("sai", "saint"...), le classement d'un
+# préfixe est gardé en mémoire ; ces préfixes sont peu nombreux
+LARGE_RANGE = 256
+
+
+def _first(record, keys):
+    for key in keys:
+        value = record.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _iter_records(path):
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        yield from (data.get("results", []) if isinstance(data, dict) else data)
+        return
+
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        delimiter = ";" if sample.count(";") > sample.count(",") else ","
+        yield from csv.DictReader(f, delimiter=delimiter)
+
+
+class CommuneIndex:
+    """Communes triées par nom normalisé, pour des recherches de préfixe en O(log n)."""
+
+    def __init__(self, communes):
+        # communes : liste de dicts {city, department, region, lat, lon, population}
+        communes = sorted(communes, key=lambda c: (normalize_city_name(c["city"]), -c["population"]))
+        self._keys = [normalize_city_name(c["city"]) for c in communes]
+        self._communes = communes
+        self._large_cache = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._communes)
+
+    @classmethod
+    def from_file(cls, path):
+        communes = []
+        for record in _iter_records(path):
+            name = _first(record, NAME_KEYS)
+            lat = _first(record, LAT_KEYS)
+            lon = _first(record, LON_KEYS)
+            if not name or lat is None or lon is None:
+                continue
+            try:
+                population = int(float(_first(record, POPULATION_KEYS) or 0))
+                communes.append({
+                    "city": " ".join(str(name).split()),
+                    "department": _first(record, DEPARTMENT_KEYS) or "",
+                    "region": _first(record, REGION_KEYS) or "",
+                    "lat": float(lat),
+                    "lon": float(lon),
+                    "population": population
+                })
+            except (TypeError, ValueError):
+                continue
+        return cls(communes)
+
+    def search(self, query, limit=5):
+        """Communes dont le nom commence par query, les plus peuplées d'abord."""
+        prefix = normalize_city_name(query)
+        if not prefix:
+            return []
+
+        lo = bisect_left(self._keys, prefix)
+        hi = bisect_left(self._keys, prefix + "\uffff", lo)
+        if lo == hi:
+            return []
+        if hi - lo <= LARGE_RANGE:
+            return self._rank(lo, hi, limit)
+
+        with self._lock:
+            cached = self._large_cache.get((lo, hi, limit))
+        if cached is None:
+            cached = self._rank(lo, hi, limit)
+            with self._lock:
+                self._large_cache[(lo, hi, limit)] = cached
+        return cached
+
+    def _rank(self, lo, hi, limit):
+        results = []
+        seen = set()
+        ranked = heapq.nlargest(limit * 4, range(lo, hi), key=lambda i: self._communes[i]["population"])
+        for i in ranked:
+            commune = self._communes[i]
+            label = commune["city"]
+            if commune["department"]:
+                label += ", " + commune["department"]
+            elif commune["region"]:
+                label += ", " + commune["region"]
+
+            # Déduplication (même commune listée deux fois)
+            if label.lower() in seen:
+                continue
+            seen.add(label.lower())
+
+            results.append({
+                "label": label,
+                "city": commune["city"],
+                "lat": commune["lat"],
+                "lon": commune["lon"]
+            })
+            if len(results) >= limit:
+                break
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def load_commune_index(path=None):
+    """Index partagé par le processus ; None si le fichier des communes est absent."""
+    global _index
+    with _index_lock:
+        if _index is not None:
+            return _index or None
+        path = path or os.getenv("COMMUNES_PATH", "data/communes.csv")
+        if os.path.exists(path):
+            _index = CommuneIndex.from_file(path)
+            logger.info("✅ Index communes chargé : %d communes (%s)", len(_index), path)
+        else:
+            logger.warning("⚠️ Fichier des communes introuvable : %s", path)
+            _index = False
+        return _index or None
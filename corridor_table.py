@@ -0,0 +1,414 @@
+# corridor_table.py
+
+"""
+Table précalculée des plans pour les couloirs les plus demandés.
+
+La plupart des plans relient les mêmes grandes villes. Pour chaque paire de
+villes populaire, la commande de construction calcule hors ligne :
+  - la route directe (distance, vitesse moyenne) ;
+  - les bornes candidates du couloir (position et détour en km) ;
+  - un plan par nombre d'arrêts (arrêts + route finale qui passe par les
+    bornes), calculé avec calculate_trip_with_stops_and_route pour la plus
+    petite autonomie qui donne ce nombre d'arrêts, de --min-range jusqu'à
+    l'autonomie qui n'en demande plus aucun.
+
+À la requête, /plan cherche la paire dont les deux extrémités sont à moins
+de CORRIDOR_MATCH_KM des coordonnées demandées : le géocodage ORS utilisé à
+la construction et les coordonnées de l'autocomplétion (index des communes)
+ne tombent pas au même point pour une même ville. Il calcule ensuite le plan
+optimal pour l'autonomie exacte (plan_stops sur les candidats stockés) et
+sert le plan stocké qui choisit les mêmes bornes, sinon celui qui a le même
+nombre d'arrêts et dont toutes les étapes tiennent dans l'autonomie, sans
+aucun appel amont. Sinon (ou paire inconnue) le plan est calculé en direct.
+Le fichier est rechargé à la volée quand il est reconstruit.
+
+Format du fichier : voir mmap_store (en-tête, répertoire JSON, tableaux
+alignés lus via mmap sans copie). Les données sont les géométries en int32
+quantifiées à 1e-5° (comme route_cache) et les candidats en float32.
+
+Construction :
+    python corridor_table.py build pairs.txt --out data/corridors.bin --min-range 150
+pairs.txt : une paire par ligne, "Paris;Lyon".
+"""
+
+import argparse
+import logging
+import math
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from charging_planner import plan_stops
+from mmap_store import DataWriter, open_file, write_file
+from route_cache import GEOMETRY_SCALE
+from station_index import haversine_km
+from trip_model import BATTERY_SAFETY_MARGIN, usable_range_km
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"EVCORR1\n"
+VERSION = 2
+
+# Distance maximale entre une extrémité demandée et celle d'une paire stockée
+DEFAULT_MATCH_KM = 3.0
+
+# Recherche des autonomies où le nombre d'arrêts change : grille de SCAN_STEP_KM
+# puis dichotomie jusqu'à SCAN_PRECISION_KM
+SCAN_STEP_KM = 25.0
+SCAN_PRECISION_KM = 0.25
+
+# Intervalle entre deux vérifications de la date de modification du fichier
+RELOAD_CHECK_S = float(os.getenv("CORRIDOR_RELOAD_CHECK_S", "30"))
+
+
+def read_pairs(path):
+    """Lignes "Départ;Arrivée" (lignes vides et # ignorées)"""
+    pairs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            start, sep, end = line.partition(";")
+            if not sep or not start.strip() or not end.strip():
+                raise ValueError(f"Paire invalide : {line!r}")
+            pairs.append((start.strip(), end.strip()))
+    return pairs
+
+
+class CorridorTable:
+    """Plans précalculés par paire de villes et nombre d'arrêts."""
+
+    def __init__(self, directory, buffer, source=None, match_km=DEFAULT_MATCH_KM):
+        self.directory = directory
+        self.source = source
+        self.match_km = match_km
+        self._buffer = buffer
+        self._data_offset = directory["data_offset"]
+        self._pairs = directory["pairs"]
+        # Extrémités de toutes les paires : (lat, lon) départ puis arrivée
+        self._endpoints = np.array([[*p["start"], *p["end"]] for p in self._pairs], dtype=np.float64).reshape(-1, 4)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def __len__(self):
+        return len(self._pairs)
+
+    @classmethod
+    def from_file(cls, path, match_km=DEFAULT_MATCH_KM):
+        buffer, directory = open_file(path, MAGIC, VERSION, "une table de couloirs")
+        return cls(directory, buffer, source=path, match_km=match_km)
+
+    def _array(self, ref, dtype, width):
+        offset, count = ref
+        return np.frombuffer(self._buffer, dtype=dtype, count=count * width,
+                             offset=self._data_offset + offset).reshape(count, width)
+
+    def find_pair(self, start, end):
+        """Paire dont les deux extrémités sont à moins de match_km de start et end (la plus proche), ou None"""
+        if not self._pairs:
+            return None
+        ends = self._endpoints
+        start_km = haversine_km(float(start[0]), float(start[1]), ends[:, 0], ends[:, 1])
+        end_km = haversine_km(float(end[0]), float(end[1]), ends[:, 2], ends[:, 3])
+        gap = np.where((start_km <= self.match_km) & (end_km <= self.match_km), start_km + end_km, np.inf)
+        best = int(np.argmin(gap))
+        return self._pairs[best] if np.isfinite(gap[best]) else None
+
+    def _count(self, event):
+        with self._lock:
+            setattr(self, event, getattr(self, event) + 1)
+
+    def lookup(self, start, end, vehicle_range, charging_time=30):
+        """
+        Plan au format calculate_trip_with_stops_and_route, ou None si la paire
+        manque ou si aucun plan stocké ne convient à l'autonomie exacte.
+        """
+        pair = self.find_pair(start, end)
+        if pair is None:
+            self._count("misses")
+            return None
+
+        # Plan optimal pour l'autonomie exacte, sur les candidats du couloir
+        usable_range = usable_range_km(vehicle_range)
+        candidates = self._array(pair["candidates"], np.float32, 2).astype(np.float64)
+        chosen = plan_stops(candidates[:, 0], candidates[:, 1], pair["distance_km"], usable_range,
+                            charging_time / 60, pair["speed_kmh"])
+        plan = None
+        if chosen is not None:
+            # Mêmes bornes, sinon même nombre d'arrêts avec des étapes qui tiennent dans l'autonomie
+            usable = [p for p in pair["plans"]
+                      if p["num_stops"] == len(chosen) and p["max_leg_km"] <= usable_range + 1e-6]
+            same = [p for p in usable if p["candidates"] == chosen]
+            plan = (same or usable or [None])[0]
+        if plan is None:
+            self._count("stale")
+            return None
+
+        self._count("hits")
+        route = self._array(pair["routes"][plan["route"]], np.int32, 2) / GEOMETRY_SCALE
+        charging_total = plan["num_stops"] * (charging_time / 60)
+        return {
+            "total_distance": plan["total_distance"],
+            "num_stops": plan["num_stops"],
+            "stops": [dict(stop, charging_time=charging_time) for stop in plan["stops"]],
+            "driving_time": plan["driving_time"],
+            "charging_time": round(charging_total, 2),
+            "total_time": round(plan["driving_time"] + charging_total, 2),
+            "route_coords": [tuple(c) for c in route.tolist()],
+            "usable_range": round(usable_range, 1),
+            "safety_margin_km": round(vehicle_range * BATTERY_SAFETY_MARGIN, 1)
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pairs": len(self._pairs),
+                "plans": sum(len(pair["plans"]) for pair in self._pairs),
+                "built_at": self.directory.get("built_at"),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale
+            }
+
+
+_table = None  # CorridorTable, False (absente ou illisible), None (pas encore chargée)
+_table_mtime = None
+_checked_at = 0.0
+_table_lock = threading.Lock()
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _read_table(path):
+    if _mtime(path) is None:
+        logger.info("Table des couloirs absente : %s", path)
+        return False
+    try:
+        table = CorridorTable.from_file(path, float(os.getenv("CORRIDOR_MATCH_KM", DEFAULT_MATCH_KM)))
+    except (OSError, ValueError) as e:
+        logger.warning("⚠️ Table des couloirs illisible (%s) : %s", path, e)
+        return False
+    logger.info("✅ Table des couloirs chargée : %d paires (%s)", len(table), path)
+    return table
+
+
+def load_corridor_table(path=None):
+    """
+    Table partagée par le processus ; None si le fichier est absent ou illisible.
+    Si le fichier est reconstruit, la nouvelle table est chargée à la volée
+    (comme l'index IRVE) ; les compteurs sont conservés.
+    """
+    global _table, _table_mtime, _checked_at
+    path = path or os.getenv("CORRIDOR_TABLE_PATH", "data/corridors.bin")
+    with _table_lock:
+        if _table is None:
+            _table_mtime = _mtime(path)
+            _checked_at = time.monotonic()
+            _table = _read_table(path)
+            return _table or None
+
+        now = time.monotonic()
+        if now - _checked_at < RELOAD_CHECK_S:
+            return _table or None
+        _checked_at = now
+        mtime = _mtime(path)
+        if mtime == _table_mtime:
+            return _table or None
+        current = _table
+
+    # Lecture hors du verrou : les requêtes concurrentes continuent avec la table courante
+    table = _read_table(path)
+    if table and current:
+        with current._lock:
+            table.hits, table.misses, table.stale = current.hits, current.misses, current.stale
+
+    with _table_lock:
+        _table, _table_mtime = table, mtime
+    return table or None
+
+
+# ---------------------------------------------------------
+# 🔥 Construction hors ligne
+# ---------------------------------------------------------
+def _add(data, array):
+    """Ajoute un tableau 2D aux données ; retourne sa référence [offset, nombre de lignes]."""
+    return [data.add(array), len(array)]
+
+
+def _max_leg_km(positions, detours, total_km, chosen):
+    """Plus longue étape (détours compris) d'une suite de bornes"""
+    pos = np.concatenate(([0.0], positions[chosen], [total_km]))
+    det = np.concatenate(([0.0], detours[chosen], [0.0]))
+    return float(np.max(pos[1:] - pos[:-1] + det[1:] + det[:-1]))
+
+
+def plans_by_stop_count(choose, low, high, step=SCAN_STEP_KM, precision=SCAN_PRECISION_KM):
+    """
+    {nombre d'arrêts: (plus petite autonomie, bornes choisies)} pour les
+    autonomies de low à high. choose(range_km) retourne les bornes choisies
+    (None si aucune suite ne couvre le trajet). Grille de `step` km, puis
+    dichotomie jusqu'à `precision` km là où le nombre d'arrêts change.
+    """
+    found = {}
+
+    def record(range_km, chosen):
+        if chosen is not None and (len(chosen) not in found or range_km < found[len(chosen)][0]):
+            found[len(chosen)] = (range_km, chosen)
+
+    def count(chosen):
+        return None if chosen is None else len(chosen)
+
+    grid = [float(r) for r in np.arange(low, high, step)] + [float(high)]
+    previous_km, previous = grid[0], choose(grid[0])
+    record(previous_km, previous)
+    for range_km in grid[1:]:
+        current = choose(range_km)
+        record(range_km, current)
+        lo, lo_chosen, hi = previous_km, previous, range_km
+        while count(lo_chosen) != count(current) and hi - lo > precision:
+            mid = (lo + hi) / 2
+            chosen = choose(mid)
+            record(mid, chosen)
+            if count(chosen) == count(current):
+                hi = mid
+            else:
+                lo, lo_chosen = mid, chosen
+        previous_km, previous = range_km, current
+    return found
+
+
+def build_pair(planner, start_city, end_city, min_range, data, charging_time=30):
+    """Entrée du répertoire pour une paire, ou None si elle ne peut pas être routée."""
+    coords_start = planner.resolve_city(start_city)
+    coords_end = planner.resolve_city(end_city)
+    if not coords_start or not coords_end:
+        logger.warning("⚠️ %s -> %s : géocodage impossible", start_city, end_city)
+        return None
+
+    initial_route = planner.ors_route_probe([coords_start, coords_end])
+    if not initial_route:
+        logger.warning("⚠️ %s -> %s : pas de route ORS", start_city, end_city)
+        return None
+
+    points, profile, total_distance, speed_kmh = planner.route_profile_of(initial_route, coords_start, coords_end)
+    _, positions, detours = planner.corridor_candidates(points, profile)
+
+    # Même critère qu'à la requête : le plan optimal de chaque autonomie, jusqu'à
+    # celle qui n'a plus besoin d'arrêt (usable_range_km(range) >= distance)
+    def choose(range_km):
+        return plan_stops(positions, detours, total_distance, usable_range_km(range_km),
+                          charging_time / 60, speed_kmh)
+
+    no_stop_range = total_distance / (1 - BATTERY_SAFETY_MARGIN)
+    found = plans_by_stop_count(choose, min(min_range, no_stop_range), no_stop_range + SCAN_PRECISION_KM)
+
+    plans = []
+    routes = {}
+    for num_stops, (range_km, _) in sorted(found.items()):
+        # Arrondi au-dessus : le nombre d'arrêts ne change pas
+        range_km = math.ceil(range_km * 100) / 100
+        chosen = choose(range_km)
+        if chosen is None or len(chosen) != num_stops:
+            continue
+        trip = planner.calculate_trip_with_stops_and_route(
+            coords_start, coords_end, range_km, charging_time=charging_time
+        )
+        if not trip["route_coords"]:
+            logger.warning("⚠️ %s -> %s (%s km) : pas de route finale", start_city, end_city, range_km)
+            continue
+
+        # Les plans qui choisissent les mêmes bornes partagent leur géométrie
+        waypoints = tuple((stop["lat"], stop["lon"]) for stop in trip["stops"])
+        if waypoints not in routes:
+            geometry = np.round(np.asarray(trip["route_coords"]) * GEOMETRY_SCALE).astype("<i4")
+            routes[waypoints] = (len(routes), _add(data, geometry))
+
+        plans.append({
+            "range_km": range_km,
+            "num_stops": num_stops,
+            "candidates": chosen,
+            "max_leg_km": round(_max_leg_km(positions, detours, total_distance, chosen), 3),
+            "stops": [{k: v for k, v in stop.items() if k != "charging_time"} for stop in trip["stops"]],
+            "total_distance": trip["total_distance"],
+            "driving_time": trip["driving_time"],
+            "route": routes[waypoints][0]
+        })
+
+    if not plans:
+        return None
+
+    candidates = np.column_stack((positions, detours)).astype("<f4")
+    return {
+        "start_city": start_city,
+        "end_city": end_city,
+        "start": list(coords_start),
+        "end": list(coords_end),
+        "distance_km": total_distance,
+        "speed_kmh": speed_kmh,
+        "candidates": _add(data, candidates.reshape(-1, 2)),
+        "routes": [ref for _, ref in sorted(routes.values())],
+        "plans": plans
+    }
+
+
+def build(pairs, min_range, out, charging_time=30):
+    import app as planner
+
+    if planner.local_station_index() is None:
+        # Les candidats du couloir viennent de l'index IRVE local
+        raise SystemExit("La construction demande l'index IRVE local (IRVE_SOURCE=local, IRVE_SNAPSHOT_PATH)")
+
+    started = time.perf_counter()
+    data = DataWriter()
+    entries = []
+    for i, (start_city, end_city) in enumerate(pairs, start=1):
+        entry = build_pair(planner, start_city, end_city, min_range, data, charging_time)
+        if entry:
+            entries.append(entry)
+        logger.info("%d/%d %s -> %s %s", i, len(pairs), start_city, end_city,
+                    f"✅ {len(entry['plans'])} plans" if entry else "❌")
+
+    directory = {
+        "version": VERSION,
+        "built_at": int(time.time()),
+        "min_range_km": min_range,
+        "charging_time": charging_time,
+        "pairs": entries
+    }
+    write_file(out, MAGIC, directory, data)
+    logger.info("✅ %d/%d paires écrites dans %s (%.1f Mo, %.0f s)", len(entries), len(pairs), out,
+                os.path.getsize(out) / 1e6, time.perf_counter() - started)
+    return len(entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Table précalculée des plans par couloir")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_cmd = commands.add_parser("build", help="construit la table depuis une liste de paires")
+    build_cmd.add_argument("pairs", help='fichier texte, une paire "Départ;Arrivée" par ligne')
+    build_cmd.add_argument("--out", default=os.getenv("CORRIDOR_TABLE_PATH", "data/corridors.bin"))
+    build_cmd.add_argument("--min-range", type=float, default=150.0,
+                           help="plus petite autonomie couverte, en km (jusqu'à celle qui ne demande aucun arrêt)")
+    build_cmd.add_argument("--charging-time", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        built = build(read_pairs(args.pairs), args.min_range, args.out, args.charging_time)
+        return 0 if built else 1
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
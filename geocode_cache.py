@@ -0,0 +1,211 @@
+# geocode_cache.py
+
+"""
+Cache de géocodage à deux niveaux : LRU en mémoire + SQLite sur disque.
+
+La clé est le nom de ville normalisé (minuscules, sans accents ni espaces
+superflus). Les échecs de géocodage sont aussi mis en cache, avec un TTL
+court, pour ne pas relancer ORS/Nominatim à chaque faute de frappe.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_city_name(name):
+    """'  Saint-Étienne ' -> 'saint etienne'"""
+    text = unicodedata.normalize("NFKD", name or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = text.replace("-", " ").replace("'", " ").replace("’", " ")
+    return " ".join(text.lower().split())
+
+
+class GeocodeCache:
+    """Résultats (lat, lon) ou None, indexés par nom de ville normalisé."""
+
+    def __init__(self, path=None, max_entries=2048, ttl_s=30 * 86400, negative_ttl_s=600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.negative_ttl_s = negative_ttl_s
+
+        self._memory = OrderedDict()  # clé -> (coords ou None, expires_at)
+        self._lock = threading.Lock()     # LRU en mémoire et compteurs
+        self._db_lock = threading.Lock()  # connexion SQLite (jamais prise avec _lock)
+        self._db = None
+        self._db_pid = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Une lecture disque en cours dans le parent n'existe pas dans le
+        # worker forké : les verrous repartent à zéro (la connexion est par processus)
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+
+    # ---------------------------------------------------------
+    # 🔥 API
+    # ---------------------------------------------------------
+    def get_or_compute(self, city_name, compute):
+        """Coordonnées en cache, sinon compute() puis mise en cache (y compris un échec)."""
+        key = normalize_city_name(city_name)
+        if not key:
+            return None
+
+        found, coords = self._lookup(key)
+        if found:
+            return coords
+
+        coords = compute()
+        self.put(key, coords)
+        return coords
+
+    def put(self, key, coords):
+        ttl = self.ttl_s if coords else self.negative_ttl_s
+        expires_at = time.time() + ttl
+        coords = tuple(coords) if coords else None
+        with self._lock:
+            self._remember(key, coords, expires_at)
+        self._db_write(key, coords, expires_at)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory)
+            }
+
+    def warm(self):
+        """
+        Charge en mémoire les entrées valides les plus récentes du disque
+        (au plus max_entries), puis ferme la connexion SQLite pour qu'elle
+        ne soit pas partagée avec des workers forkés. Retourne le nombre d'entrées.
+        """
+        if not self.path:
+            return 0
+        try:
+            with self._db_lock:
+                rows = self._connection().execute(
+                    "SELECT key, lat, lon, expires_at FROM geocode WHERE expires_at > ? "
+                    "ORDER BY expires_at DESC LIMIT ?",
+                    (time.time(), self.max_entries)
+                ).fetchall()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Erreur cache géocodage (préchargement): %s", e)
+            return 0
+        finally:
+            self.close()
+
+        with self._lock:
+            # Les plus récentes en dernier : ce sont elles que le LRU garde
+            for key, lat, lon, expires_at in reversed(rows):
+                self._remember(key, (lat, lon) if lat is not None else None, expires_at)
+        return len(rows)
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None and self._db_pid == os.getpid():
+                self._db.close()
+            self._db = None
+            self._db_pid = None
+
+    # ---------------------------------------------------------
+    # 🔥 Niveaux mémoire et disque
+    # ---------------------------------------------------------
+    def _lookup(self, key):
+        """(trouvé, coords) ; la lecture SQLite se fait hors de _lock"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[1] > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                if entry[0] is None:
+                    self.negative_hits += 1
+                return True, entry[0]
+
+        entry = self._db_read(key)
+        with self._lock:
+            if entry and entry[1] > now:
+                # Un put() concurrent a pu ranger un résultat plus récent entre-temps
+                current = self._memory.get(key)
+                if current is None or current[1] < entry[1]:
+                    self._remember(key, entry[0], entry[1])
+                self.hits += 1
+                self.disk_hits += 1
+                if entry[0] is None:
+                    self.negative_hits += 1
+                return True, entry[0]
+
+            self.misses += 1
+            return False, None
+
+    def _remember(self, key, coords, expires_at):
+        """Appelé avec _lock"""
+        self._memory[key] = (coords, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _connection(self):
+        """Appelé avec _db_lock"""
+        if not self.path:
+            return None
+        # Une connexion par processus (les workers gunicorn sont forkés)
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                "key TEXT PRIMARY KEY, lat REAL, lon REAL, expires_at REAL NOT NULL)"
+            )
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _db_read(self, key):
+        if not self.path:
+            return None
+        try:
+            with self._db_lock:
+                row = self._connection().execute(
+                    "SELECT lat, lon, expires_at FROM geocode WHERE key = ?", (key,)
+                ).fetchone()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Erreur cache géocodage (lecture): %s", e)
+            return None
+        if not row:
+            return None
+        lat, lon, expires_at = row
+        return ((lat, lon) if lat is not None else None), expires_at
+
+    def _db_write(self, key, coords, expires_at):
+        if not self.path:
+            return
+        lat, lon = coords if coords else (None, None)
+        try:
+            with self._db_lock:
+                db = self._connection()
+                with db:
+                    db.execute(
+                        "INSERT OR REPLACE INTO geocode (key, lat, lon, expires_at) VALUES (?, ?, ?, ?)",
+                        (key, lat, lon, expires_at)
+                    )
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Erreur cache géocodage (écriture): %s", e)
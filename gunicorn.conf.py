@@ -0,0 +1,37 @@
+# gunicorn.conf.py
+
+"""
+Configuration gunicorn : l'application est chargée une seule fois dans le
+master (preload), ses caches y sont préchargés, puis les workers sont forkés
+et partagent cet état en copy-on-write.
+"""
+
+import gc
+import os
+
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+# Les plans longs passent par /api/jobs : une requête synchrone plus longue
+# que ça est bloquée, le worker est redémarré
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+
+preload_app = True
+
+
+def when_ready(server):
+    # Appelé dans le master, après le chargement de app.py et avant le fork
+    import app
+
+    app.warm_caches()
+
+    # Les objets déjà créés ne sont plus parcourus par le GC : il ne touche
+    # plus leurs pages mémoire, qui restent partagées entre les workers
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # Dans chaque worker après le fork : threads de la file de plans
+    # asynchrones (les threads du master ne survivraient pas au fork)
+    import app
+
+    app.plan_jobs.start()
@@ -0,0 +1,398 @@
+# irve_sync.py
+
+"""
+Synchronisation du jeu de données IRVE vers un fichier en colonnes, lu via mmap.
+
+Le jeu national compte des centaines de milliers de points de charge : en
+dicts Python (un par borne), il coûterait des centaines de Mo à chaque worker.
+Le fichier synchronisé ne contient que des colonnes :
+  - lat, lon, puissance : float32 ;
+  - nom (enseigne/opérateur) et adresse : codes uint32 vers des tables de
+    chaînes internées (chaque chaîne distincte n'est stockée qu'une fois) ;
+  - identifiant du point de charge (id_pdc_itinerance), pour les mises à jour.
+Les workers mappent ce fichier sans le copier ; les chaînes ne sont décodées
+que pour les bornes renvoyées.
+
+Deux sources, toujours lues en flux :
+  - l'API records bornes-irve (par défaut) : seules les lignes modifiées
+    depuis la dernière synchro (date_maj >= curseur) sont demandées ;
+  - un export téléchargé (CSV ou NDJSON, un enregistrement par ligne) :
+    c'est la liste complète, les bornes absentes de l'export sont retirées.
+    Un document JSON ne se lit pas en flux : il est refusé.
+Si aucune borne n'a changé, seules les métadonnées (curseur, signature de
+l'export) sont mises à jour, sans toucher aux colonnes ni à la date de
+modification du fichier. Sinon, le nouveau fichier remplace l'ancien
+d'un coup (os.replace) : les workers le rechargent à la volée (load_station_index
+surveille sa date de modification), sans redémarrage.
+
+Usage :
+    python irve_sync.py                       # incrémental via l'API
+    python irve_sync.py --source export.csv   # depuis un export complet
+    python irve_sync.py --full                # tout redemander à l'API
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import time
+from array import array
+
+import numpy as np
+
+from mmap_store import DataWriter, has_magic, open_file, rewrite_directory, write_file
+from station_index import STREAMED_JSON_SUFFIXES, _first, iter_irve_records, parse_irve_record
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"EVIRVE1\n"
+VERSION = 1
+
+DEFAULT_OUT = "data/irve.bin"
+IRVE_API_URL = os.getenv(
+    "IRVE_API_URL",
+    "https://opendata.reseaux-energies.fr/api/explore/v2.1/catalog/datasets/bornes-irve/records"
+)
+API_PAGE_SIZE = 100
+# L'API records refuse offset + limit au-delà de 10 000 : on repart alors du dernier date_maj vu
+API_MAX_OFFSET = 10000
+
+NUMERIC_COLUMNS = {"lat": "<f4", "lon": "<f4", "power": "<f4", "name": "<u4", "address": "<u4"}
+STRING_TABLES = ("name", "address", "id")
+
+
+def station_id(record, parsed):
+    """Identifiant stable d'un point de charge (à défaut : position + nom)"""
+    value = _first(record, "id_pdc_itinerance", "id_pdc", "id_pdc_local")
+    if value is not None:
+        return str(value)
+    lat, lon, name = parsed[:3]
+    return f"{lat:.6f},{lon:.6f},{name}"
+
+
+# ---------------------------------------------------------
+# 🔥 Lecture du fichier en colonnes (mmap)
+# ---------------------------------------------------------
+class StringTable:
+    """Chaînes distinctes stockées bout à bout (UTF-8) ; décodées à la demande."""
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, code):
+        start, end = int(self._offsets[code]), int(self._offsets[code + 1])
+        return self._blob[start:end].tobytes().decode("utf-8")
+
+
+class StringColumn:
+    """Colonne de chaînes internées : un code par ligne vers une StringTable."""
+
+    def __init__(self, codes, table):
+        self.codes = codes
+        self.table = table
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.table[int(self.codes[i])]
+
+
+class ColumnarStore:
+    """Fichier synchronisé ouvert en lecture seule ; les colonnes sont des vues sur le mmap."""
+
+    def __init__(self, path):
+        self.path = path
+        self._buffer, self.meta = open_file(path, MAGIC, VERSION, "un fichier IRVE synchronisé")
+
+        columns = self.meta["columns"]
+        self.lats = self._array(columns["lat"])
+        self.lons = self._array(columns["lon"])
+        self.powers = self._array(columns["power"])
+        tables = {
+            name: StringTable(self._array(ref["offsets"]), self._array(ref["blob"]))
+            for name, ref in self.meta["strings"].items()
+        }
+        self.names = StringColumn(self._array(columns["name"]), tables["name"])
+        self.addresses = StringColumn(self._array(columns["address"]), tables["address"])
+        self.ids = tables["id"]
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def _array(self, ref):
+        offset, dtype, count = ref
+        return np.frombuffer(self._buffer, dtype=dtype, count=count, offset=self.meta["data_offset"] + offset)
+
+
+def is_columnar(path):
+    return has_magic(path, MAGIC)
+
+
+# ---------------------------------------------------------
+# 🔥 Construction : mises à jour ligne par ligne, colonnes compactes
+# ---------------------------------------------------------
+class _Interner:
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def add(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _float32(value):
+    return float(np.float32(value))
+
+
+class StoreBuilder:
+    """
+    Contenu du prochain fichier : les lignes de l'ancien, puis les mises à jour
+    appliquées une par une (upsert). Seules les colonnes sont gardées en mémoire,
+    jamais les enregistrements bruts.
+    """
+
+    def __init__(self):
+        self.rows = {}  # identifiant -> ligne
+        self.ids = []
+        self.lats = array("f")
+        self.lons = array("f")
+        self.powers = array("f")
+        self.name_codes = array("I")
+        self.address_codes = array("I")
+        self.names = _Interner()
+        self.addresses = _Interner()
+        self.alive = bytearray()
+        self.seen = bytearray()
+        self.added = self.updated = self.removed = 0
+
+    @classmethod
+    def from_store(cls, store):
+        builder = cls()
+        count = len(store)
+        names = np.array([builder.names.add(store.names.table[c]) for c in range(len(store.names.table))],
+                         dtype=np.uint32)
+        addresses = np.array([builder.addresses.add(store.addresses.table[c])
+                              for c in range(len(store.addresses.table))], dtype=np.uint32)
+
+        builder.ids = [store.ids[i] for i in range(count)]
+        builder.rows = {station: i for i, station in enumerate(builder.ids)}
+        builder.lats.frombytes(np.ascontiguousarray(store.lats, dtype=np.float32).tobytes())
+        builder.lons.frombytes(np.ascontiguousarray(store.lons, dtype=np.float32).tobytes())
+        builder.powers.frombytes(np.ascontiguousarray(store.powers, dtype=np.float32).tobytes())
+        if count:
+            builder.name_codes.frombytes(names[store.names.codes].astype(np.uint32).tobytes())
+            builder.address_codes.frombytes(addresses[store.addresses.codes].astype(np.uint32).tobytes())
+        builder.alive = bytearray(b"\1" * count)
+        builder.seen = bytearray(count)
+        return builder
+
+    def upsert(self, station, lat, lon, name, address, power):
+        values = (_float32(lat), _float32(lon), _float32(power),
+                  self.names.add(name), self.addresses.add(address))
+        row = self.rows.get(station)
+        if row is None:
+            self.rows[station] = len(self.ids)
+            self.ids.append(station)
+            self.lats.append(values[0])
+            self.lons.append(values[1])
+            self.powers.append(values[2])
+            self.name_codes.append(values[3])
+            self.address_codes.append(values[4])
+            self.alive.append(1)
+            self.seen.append(1)
+            self.added += 1
+            return
+
+        self.seen[row] = 1
+        current = (self.lats[row], self.lons[row], self.powers[row], self.name_codes[row], self.address_codes[row])
+        same_power = current[2] == values[2] or (math.isnan(current[2]) and math.isnan(values[2]))
+        if current[:2] == values[:2] and same_power and current[3:] == values[3:]:
+            return
+
+        self.lats[row], self.lons[row], self.powers[row] = values[:3]
+        self.name_codes[row], self.address_codes[row] = values[3:]
+        self.updated += 1
+
+    def remove_unseen(self):
+        """Export complet : les bornes qui n'y figurent plus sont retirées"""
+        for row, seen in enumerate(self.seen):
+            if not seen and self.alive[row]:
+                self.alive[row] = 0
+                self.removed += 1
+
+    @property
+    def changed(self):
+        return bool(self.added or self.updated or self.removed)
+
+    def write(self, path, meta):
+        """Écrit les lignes vivantes (tables de chaînes compactées) puis remplace path d'un coup."""
+        keep = np.flatnonzero(np.frombuffer(bytes(self.alive), dtype=np.uint8))
+        arrays = {}
+        columns = {
+            "lat": np.frombuffer(self.lats, dtype=np.float32)[keep],
+            "lon": np.frombuffer(self.lons, dtype=np.float32)[keep],
+            "power": np.frombuffer(self.powers, dtype=np.float32)[keep]
+        }
+        for column, interner, codes in (("name", self.names, self.name_codes),
+                                        ("address", self.addresses, self.address_codes)):
+            codes = np.frombuffer(codes, dtype=np.uint32)[keep]
+            used, remapped = np.unique(codes, return_inverse=True)
+            columns[column] = remapped.astype(np.uint32)
+            arrays[column] = [interner.values[c] for c in used.tolist()]
+        arrays["id"] = [self.ids[i] for i in keep.tolist()]
+
+        data = DataWriter()
+
+        def add(array, dtype):
+            return [data.add(array, dtype), dtype, len(array)]
+
+        directory = dict(meta, version=VERSION, count=len(keep), columns={}, strings={})
+        for column, dtype in NUMERIC_COLUMNS.items():
+            directory["columns"][column] = add(columns[column], dtype)
+        for table in STRING_TABLES:
+            encoded = [value.encode("utf-8") for value in arrays[table]]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+            np.cumsum(np.array([len(e) for e in encoded], dtype=np.uint64), out=offsets[1:])
+            directory["strings"][table] = {
+                "offsets": add(offsets, "<u8"),
+                "blob": add(np.frombuffer(b"".join(encoded), dtype=np.uint8), "|u1")
+            }
+
+        write_file(path, MAGIC, directory, data)
+        return len(keep)
+
+
+# ---------------------------------------------------------
+# 🔥 Sources en flux
+# ---------------------------------------------------------
+def iter_api_records(url=IRVE_API_URL, since=None, page_size=API_PAGE_SIZE):
+    """
+    Enregistrements de l'API records triés par date_maj, page par page, à
+    partir de since (inclus). Au-delà de API_MAX_OFFSET, la requête repart
+    du dernier date_maj reçu : les quelques lignes revues sont sans effet.
+    """
+    import upstream
+
+    cursor = since
+    offset = 0
+    while True:
+        params = {"limit": page_size, "offset": offset, "order_by": "date_maj"}
+        if cursor:
+            params["where"] = f"date_maj >= date'{cursor}'"
+        r = upstream.get("irve", url, params=params)
+        if r.status_code != 200:
+            raise RuntimeError(f"API IRVE ({r.status_code}) : {r.text[:200]}")
+
+        results = r.json().get("results", [])
+        yield from results
+        if len(results) < page_size:
+            return
+
+        offset += len(results)
+        if offset + page_size > API_MAX_OFFSET:
+            last = results[-1].get("date_maj")
+            if not last or last == cursor:
+                raise RuntimeError(
+                    f"Plus de {API_MAX_OFFSET} bornes modifiées le {cursor} : synchroniser depuis un export (--source)"
+                )
+            cursor, offset = last, 0
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def sync(out=DEFAULT_OUT, source=None, full=False, api_url=IRVE_API_URL):
+    """
+    Met à jour out depuis l'API (incrémental) ou depuis un export complet.
+    Retourne les compteurs de la synchro.
+    """
+    if os.path.exists(out) and not is_columnar(out):
+        raise ValueError(f"{out} existe et n'est pas un fichier synchronisé : choisir un autre --out")
+    if source and source.lower().endswith((".json", ".geojson")):
+        # json.load garderait tout l'export en mémoire
+        raise ValueError(f"{source} : export JSON non lu en flux, utiliser l'export CSV ou NDJSON "
+                         f"({', '.join(STREAMED_JSON_SUFFIXES)})")
+
+    started = time.perf_counter()
+    previous = ColumnarStore(out) if os.path.exists(out) and is_columnar(out) else None
+    meta = dict(previous.meta) if previous else {}
+
+    if source and previous and meta.get("source_signature") == _file_signature(source):
+        logger.info("Export inchangé depuis la dernière synchro : %s", source)
+        return {"count": len(previous), "added": 0, "updated": 0, "removed": 0, "written": False}
+
+    complete = bool(source) or full or previous is None
+    builder = StoreBuilder.from_store(previous) if previous else StoreBuilder()
+    if source:
+        records = iter_irve_records(source)
+    else:
+        records = iter_api_records(api_url, since=None if complete else meta.get("cursor"))
+
+    cursor = None if complete else meta.get("cursor")
+    for record in records:
+        parsed = parse_irve_record(record)
+        if not parsed:
+            continue
+        builder.upsert(station_id(record, parsed), *parsed)
+        updated_at = record.get("date_maj")
+        if updated_at and (cursor is None or str(updated_at) > cursor):
+            cursor = str(updated_at)
+
+    if complete:
+        builder.remove_unseen()
+
+    result = {"added": builder.added, "updated": builder.updated, "removed": builder.removed}
+    meta.update(
+        synced_at=int(time.time()),
+        cursor=cursor,
+        source=source or api_url,
+        source_signature=_file_signature(source) if source else None
+    )
+
+    if not builder.changed and previous:
+        # Curseur et signature de l'export enregistrés quand même : la
+        # prochaine synchro ne relira pas un export déjà vu
+        rewrite_directory(out, MAGIC, VERSION, "un fichier IRVE synchronisé", meta)
+        result.update(count=len(previous), written=False)
+        logger.info("Aucun changement IRVE (%.1f s)", time.perf_counter() - started)
+        return result
+
+    for key in ("columns", "strings", "count", "data_offset", "version"):
+        meta.pop(key, None)
+    count = builder.write(out, meta)
+    result.update(count=count, written=True)
+    logger.info("✅ %s : %d bornes (+%d, ~%d, -%d) en %.1f s", out, count, builder.added, builder.updated,
+                builder.removed, time.perf_counter() - started)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synchronisation IRVE vers un fichier en colonnes (mmap)")
+    parser.add_argument("--out", default=os.getenv("IRVE_SNAPSHOT_PATH") or DEFAULT_OUT)
+    parser.add_argument("--source", help="export IRVE téléchargé (CSV ou NDJSON) au lieu de l'API")
+    parser.add_argument("--full", action="store_true", help="tout redemander à l'API (retire les bornes disparues)")
+    parser.add_argument("--api-url", default=IRVE_API_URL)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    result = sync(args.out, source=args.source, full=args.full, api_url=args.api_url)
+    print(json.dumps(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+# jobs.py
+
+"""
+File de plans asynchrones, partagée par les workers gunicorn via SQLite.
+
+Une requête POST /api/jobs enregistre le plan et rend la main tout de suite ;
+un pool borné de threads (JOBS_WORKERS par processus) prend les jobs en
+attente dans l'ordre d'arrivée. La prise d'un job est atomique (transaction
+IMMEDIATE) : deux workers, même dans deux processus, ne prennent jamais le
+même. Un worker gunicorn n'est donc plus bloqué par un plan lent.
+
+Cycle de vie : queued -> running -> done | failed | cancelled | expired.
+- deadline : chaque job a une échéance (JOBS_DEADLINE_S) ; passée, il est
+  abandonné au prochain point de contrôle, ou à sa prise s'il attend encore ;
+- annulation : un job en attente est annulé tout de suite, un job en cours
+  s'arrête au prochain point de contrôle (checkpoint, appelé par le runner
+  entre deux étapes du calcul).
+Les jobs terminés sont purgés après JOBS_RETENTION_S.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+EXPIRED = "expired"
+STATUSES = (QUEUED, RUNNING, DONE, FAILED, CANCELLED, EXPIRED)
+FINISHED = (DONE, FAILED, CANCELLED, EXPIRED)
+
+# Un job "running" dont le processus a disparu est expiré après sa deadline + cette marge
+STALE_GRACE_S = 60
+
+
+class QueueFull(Exception):
+    """Trop de jobs en attente : la demande est refusée (réponse 503)."""
+
+
+class JobAborted(Exception):
+    """Levée par checkpoint() quand le job est annulé ou a dépassé sa deadline."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class JobQueue:
+    """
+    Jobs {id, status, payload, result, error} dans SQLite.
+    runner(payload, checkpoint) calcule le résultat (dict JSON) ; il appelle
+    checkpoint() entre ses étapes pour que l'annulation et la deadline soient prises en compte.
+    """
+
+    def __init__(self, path, runner, workers=2, deadline_s=120, max_queued=100,
+                 retention_s=86400, poll_s=1.0):
+        self.path = path
+        self.runner = runner
+        self.workers = workers
+        self.deadline_s = deadline_s
+        self.max_queued = max_queued
+        self.retention_s = retention_s
+        self.poll_s = poll_s
+
+        self._lock = threading.Lock()  # pool de threads et compteur _busy
+        self._wakeup = threading.Condition()
+        self._local = threading.local()  # une connexion SQLite par thread
+        self._threads_pid = None
+        self._busy = 0
+
+    # ---------------------------------------------------------
+    # 🔥 API
+    # ---------------------------------------------------------
+    def submit(self, payload, deadline_s=None):
+        """Enregistre un job et retourne son identifiant ; lève QueueFull si la file est pleine."""
+        self.start()
+        now = time.time()
+        deadline_s = min(deadline_s or self.deadline_s, self.deadline_s)
+        job_id = uuid.uuid4().hex
+
+        db = self._connection()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            (queued,) = db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()
+            if queued >= self.max_queued:
+                raise QueueFull(f"{queued} jobs en attente")
+            db.execute(
+                "INSERT INTO jobs (id, status, payload, created_at, deadline_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(payload, ensure_ascii=False), now, now + deadline_s)
+            )
+
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        """Job au format JSON de l'API, ou None s'il n'existe pas (ou plus)."""
+        row = self._connection().execute(
+            "SELECT id, status, result, error, created_at, started_at, finished_at, deadline_at "
+            "FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+
+        job_id, status, result, error, created_at, started_at, finished_at, deadline_at = row
+        job = {
+            "id": job_id,
+            "status": status,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "deadline_at": deadline_at
+        }
+        if result is not None:
+            job["result"] = json.loads(result)
+        if error is not None:
+            job["error"] = error
+        return job
+
+    def cancel(self, job_id):
+        """Annule un job en attente, ou demande l'arrêt d'un job en cours. Retourne le job."""
+        db = self._connection()
+        with db:
+            # Une seule transaction : le job ne peut pas être pris entre les deux mises à jour
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), "Annulé", job_id, QUEUED)
+            )
+            db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?", (job_id, RUNNING))
+        return self.get(job_id)
+
+    def stats(self):
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        with self._lock:
+            busy = self._busy
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(rows)
+        return {
+            "queue_depth": counts[QUEUED],
+            "by_status": counts,
+            "workers": self.workers,
+            "busy_workers": busy
+        }
+
+    # ---------------------------------------------------------
+    # 🔥 Pool de threads (un par processus, démarré à la demande)
+    # ---------------------------------------------------------
+    def start(self):
+        """Démarre le pool de ce processus (les threads ne survivent pas au fork des workers)."""
+        with self._lock:
+            if self._threads_pid == os.getpid() or self.workers <= 0:
+                return
+            self._threads_pid = os.getpid()
+            self._busy = 0
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"jobs-{i}", daemon=True).start()
+
+    def _work(self):
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logger.warning("Erreur file de jobs (prise): %s", e)
+                job = None
+
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_s)
+                continue
+
+            with self._lock:
+                self._busy += 1
+            try:
+                self._run(*job)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+    def _claim(self):
+        """Prend le plus ancien job en attente (atomique entre processus) ; None si la file est vide."""
+        now = time.time()
+        db = self._connection()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            # Jobs restés en attente après leur deadline, ou orphelins d'un processus disparu
+            db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ? "
+                "WHERE (status = ? AND deadline_at < ?) OR (status = ? AND deadline_at < ?)",
+                (EXPIRED, now, "Deadline dépassée", QUEUED, now, RUNNING, now - STALE_GRACE_S)
+            )
+            row = db.execute(
+                "SELECT id, payload, deadline_at FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                (QUEUED,)
+            ).fetchone()
+            if row:
+                db.execute("UPDATE jobs SET status = ?, started_at = ? WHERE id = ?", (RUNNING, now, row[0]))
+            elif self.retention_s:
+                db.execute(
+                    f"DELETE FROM jobs WHERE status IN ({','.join('?' * len(FINISHED))}) AND finished_at < ?",
+                    (*FINISHED, now - self.retention_s)
+                )
+        if not row:
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    def _run(self, job_id, payload, deadline_at):
+        def checkpoint():
+            if time.time() > deadline_at:
+                raise JobAborted(EXPIRED, "Deadline dépassée")
+            row = self._connection().execute(
+                "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if not row or row[0]:
+                raise JobAborted(CANCELLED, "Annulé")
+
+        started = time.perf_counter()
+        try:
+            checkpoint()
+            result = self.runner(payload, checkpoint)
+            self._finish(job_id, DONE, result=result)
+        except JobAborted as e:
+            self._finish(job_id, e.status, error=str(e))
+        except Exception as e:
+            logger.exception("Job %s en échec: %s", job_id, e)
+            self._finish(job_id, FAILED, error=str(e))
+        logger.info("Job %s terminé en %.1f s", job_id, time.perf_counter() - started)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        db = self._connection()
+        with db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, time.time(), job_id, RUNNING)
+            )
+
+    # ---------------------------------------------------------
+    # 🔥 SQLite
+    # ---------------------------------------------------------
+    def _connection(self):
+        # Une connexion par thread et par processus (les workers gunicorn sont
+        # forkés) : en WAL, une lecture (GET, stats) n'attend pas la prise d'un
+        # job en cours dans un autre thread. Transactions explicites (BEGIN
+        # IMMEDIATE) pour les prises et les annulations de jobs.
+        local = self._local
+        if getattr(local, "db", None) is None or local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, result TEXT, error TEXT, "
+                "cancel_requested INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, started_at REAL, "
+                "finished_at REAL, deadline_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            local.db = db
+            local.pid = os.getpid()
+        return local.db
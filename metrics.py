@@ -0,0 +1,203 @@
+# metrics.py
+
+"""
+Métriques du processus au format texte Prometheus (GET /metrics).
+
+- compteurs et histogrammes à labels, sans dépendance externe ;
+- span(stage) : chronomètre une étape du calcul d'un plan (géocodage, route
+  initiale, recherche de bornes, route finale, carte, SOAP...) dans
+  ev_stage_duration_seconds ;
+- gauges lues au moment de l'export (caches, regroupement, quotas...).
+
+Avec plusieurs workers gunicorn, chaque worker expose ses propres valeurs.
+"""
+
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics = []
+_gauges = []
+_lock = threading.Lock()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _lock:
+            _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}
+        self._lock = threading.Lock()
+        with _lock:
+            _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            return series[2] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = _format_labels(self.labels, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def gauge(name, help_text, read, labels=(), kind="gauge"):
+    """
+    Valeur calculée à l'export : read() retourne un nombre, ou un dict
+    {(valeurs des labels...): nombre} si des labels sont déclarés.
+    kind="counter" pour un total cumulé tenu ailleurs (stats d'un cache...).
+    """
+    with _lock:
+        _gauges.append((name, help_text, tuple(labels), read, kind))
+
+
+def _render_gauge(name, help_text, labels, read, kind):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    try:
+        values = read()
+    except Exception as e:
+        logger.warning("Gauge %s illisible : %s", name, e)
+        return []
+    if not labels:
+        values = {(): values}
+    for key, value in sorted(values.items()):
+        if value is None:
+            continue
+        lines.append(f"{name}{_format_labels(labels, key)} {_format_value(value)}")
+    return lines
+
+
+def render():
+    """Toutes les métriques du processus au format texte Prometheus 0.0.4"""
+    with _lock:
+        metrics = list(_metrics)
+        gauges = list(_gauges)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for spec in gauges:
+        lines.extend(_render_gauge(*spec))
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------
+# 🔥 Métriques communes
+# ---------------------------------------------------------
+STAGE_SECONDS = Histogram(
+    "ev_stage_duration_seconds",
+    "Durée de chaque étape du calcul d'un plan",
+    labels=("stage",)
+)
+UPSTREAM_REQUESTS = Counter(
+    "ev_upstream_requests_total",
+    "Appels aux services amont, par service et statut (code HTTP, error, timeout, breaker_open, quota)",
+    labels=("service", "status")
+)
+QUOTA_WAIT_SECONDS = Histogram(
+    "ev_quota_wait_seconds",
+    "Attente d'un jeton de quota par les appels prioritaires, par service",
+    labels=("service",)
+)
+UPSTREAM_SECONDS = Histogram(
+    "ev_upstream_request_duration_seconds",
+    "Durée des appels aux services amont (une tentative), par service et statut",
+    labels=("service", "status")
+)
+HTTP_REQUESTS = Counter(
+    "ev_http_requests_total",
+    "Requêtes HTTP traitées, par endpoint et code de réponse",
+    labels=("endpoint", "status")
+)
+HTTP_SECONDS = Histogram(
+    "ev_http_request_duration_seconds",
+    "Durée de traitement des requêtes HTTP (hors flux streamés), par endpoint",
+    labels=("endpoint",)
+)
+
+
+@contextmanager
+def span(stage):
+    """Chronomètre une étape : with span("final_route"): ..."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        logger.debug("⏱️ %s : %.1f ms", stage, 1000 * elapsed)
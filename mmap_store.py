@@ -0,0 +1,112 @@
+# mmap_store.py
+
+"""
+Format commun des fichiers binaires lus via mmap (table des couloirs,
+fichier IRVE synchronisé).
+
+Format (little-endian) :
+    MAGIC (8 octets) | taille du répertoire (uint64) | répertoire JSON | données
+Le répertoire contient data_offset (début des données, aligné sur ALIGN
+octets) ; les données sont des tableaux numpy concaténés, chacun aligné sur
+ALIGN octets pour être relu sans copie (np.frombuffer).
+"""
+
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+HEADER = struct.Struct("<8sQ")
+ALIGN = 8
+COPY_CHUNK = 1 << 20
+
+
+class DataWriter:
+    """Tableaux concaténés, chacun aligné sur ALIGN octets."""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def add(self, array, dtype=None):
+        """Ajoute un tableau ; retourne son décalage depuis le début des données."""
+        raw = np.ascontiguousarray(array, dtype=dtype).tobytes()
+        offset = self.size
+        padding = -len(raw) % ALIGN
+        self.chunks.append(raw + b"\0" * padding)
+        self.size += len(raw) + padding
+        return offset
+
+
+def write_file(path, magic, directory, data, mtime_ns=None):
+    """
+    Écriture atomique : les workers ne voient jamais un fichier à moitié écrit.
+    data : DataWriter, ou itérable de blocs d'octets déjà alignés.
+    mtime_ns : date de modification à donner au fichier (sinon maintenant).
+    """
+    # Le décalage des données dépend de la taille du répertoire qui le contient
+    data_offset = 0
+    while True:
+        encoded = json.dumps(dict(directory, data_offset=data_offset), ensure_ascii=False).encode("utf-8")
+        start = HEADER.size + len(encoded)
+        start += -start % ALIGN
+        if start == data_offset:
+            break
+        data_offset = start
+    encoded += b" " * (data_offset - HEADER.size - len(encoded))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(magic, len(encoded)))
+        f.write(encoded)
+        for chunk in data.chunks if isinstance(data, DataWriter) else data:
+            f.write(chunk)
+    if mtime_ns is not None:
+        os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+    os.replace(tmp_path, path)
+
+
+def rewrite_directory(path, magic, version, kind, directory):
+    """
+    Remplace le répertoire de path ; les données sont recopiées telles quelles
+    (par blocs, sans tout charger). La date de modification est gardée : les
+    workers qui surveillent le fichier n'ont rien à recharger.
+    """
+    buffer, previous = open_file(path, magic, version, kind)
+    try:
+        start = previous["data_offset"]
+        blocks = (buffer[i:i + COPY_CHUNK] for i in range(start, len(buffer), COPY_CHUNK))
+        write_file(path, magic, directory, blocks, mtime_ns=os.stat(path).st_mtime_ns)
+    finally:
+        buffer.close()
+
+
+def open_file(path, magic, version, kind):
+    """(mmap en lecture seule, répertoire) ; ValueError si path n'est pas un fichier `kind` de cette version."""
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        found, size = HEADER.unpack_from(buffer, 0)
+        if found != magic:
+            raise ValueError(f"{path} n'est pas {kind}")
+        directory = json.loads(buffer[HEADER.size:HEADER.size + size].decode("utf-8"))
+        if directory.get("version") != version:
+            raise ValueError(f"{path} : version {directory.get('version')} non supportée")
+    except struct.error:
+        buffer.close()
+        raise ValueError(f"{path} n'est pas {kind}")
+    except ValueError:
+        buffer.close()
+        raise
+    return buffer, directory
+
+
+def has_magic(path, magic):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(magic)) == magic
+    except OSError:
+        return False
@@ -0,0 +1,87 @@
+# polyline.py
+
+"""
+Géométrie légère pour les réponses JSON : simplification Douglas–Peucker
+et encodage "encoded polyline" (format Google, précision 1e-5).
+"""
+
+import math
+
+import numpy as np
+
+
+def simplify(points, tolerance_m):
+    """
+    Douglas–Peucker itératif sur un tableau (n, 2) de (lat, lon).
+    tolerance_m : écart maximal toléré (mètres) entre la route et sa version simplifiée.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    n = len(points)
+    if n <= 2 or tolerance_m <= 0:
+        return points
+
+    # Projection plane locale en mètres (suffisante à l'échelle d'un segment)
+    lat0 = math.radians(float(points[:, 0].mean()))
+    xy = np.column_stack((points[:, 1] * 111320.0 * math.cos(lat0), points[:, 0] * 110570.0))
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        a, b = xy[first], xy[last]
+        seg = b - a
+        inner = xy[first + 1:last]
+        length2 = float(seg @ seg)
+        if length2 == 0.0:
+            dist = np.hypot(*(inner - a).T)
+        else:
+            # Distance de chaque point au segment [a, b]
+            t = np.clip(((inner - a) @ seg) / length2, 0.0, 1.0)
+            proj = a + t[:, None] * seg
+            dist = np.hypot(*(inner - proj).T)
+
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance_m:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+
+    return points[keep]
+
+
+def encode(points, precision=5):
+    """[(lat, lon), ...] -> chaîne encoded polyline"""
+    factor = 10 ** precision
+    q = np.round(np.asarray(points, dtype=np.float64).reshape(-1, 2) * factor).astype(np.int64)
+    deltas = np.diff(q, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+
+    out = []
+    for value in deltas.tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            out.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        out.append(chr(value + 63))
+    return "".join(out)
+
+
+def decode(encoded, precision=5):
+    """Chaîne encoded polyline -> tableau (n, 2) de (lat, lon)"""
+    values = []
+    value = shift = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        value |= (byte & 0x1F) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+
+    deltas = np.asarray(values, dtype=np.int64).reshape(-1, 2)
+    return np.cumsum(deltas, axis=0) / (10 ** precision)
@@ -0,0 +1,311 @@
+# quota.py
+
+"""
+Budget d'appels par service amont (seau à jetons), partagé par tous les
+workers gunicorn de la machine.
+
+Chaque service (ORS, IRVE, Chargetrip) a un débit (jetons par minute) et une
+rafale maximale, réglés sur les limites du fournisseur :
+    QUOTA_ORS_PER_MINUTE=40  QUOTA_ORS_BURST=10  (0 = pas de limite)
+
+Deux classes de priorité :
+- HIGH (calculs de plan) : attend un jeton, jusqu'à QUOTA_MAX_WAIT_S ;
+- LOW (autocomplétion) : jamais mise en attente. Elle ne prend un jeton que
+  si aucun appel HIGH n'attend et s'il reste plus que la réserve gardée pour
+  les plans (QUOTA_LOW_RESERVE, fraction de la rafale) ; sinon elle est
+  rejetée tout de suite (QuotaExceeded) et l'appelant passe à son fallback.
+
+Le niveau des seaux est gardé dans SQLite (QUOTA_DB_PATH) : les workers
+prennent leurs jetons dans le même budget, le débit sortant reste celui du
+fournisseur quel que soit WEB_CONCURRENCY. QUOTA_DB_PATH vide : un seau par
+processus. La file d'attente et les priorités restent propres à chaque worker.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from metrics import QUOTA_WAIT_SECONDS
+
+HIGH = "high"
+LOW = "low"
+
+DEFAULTS = {
+    "ors": {"per_minute": 40, "burst": 10},
+    "irve": {"per_minute": 300, "burst": 30},
+    "chargetrip": {"per_minute": 60, "burst": 10},
+}
+FALLBACK_DEFAULTS = {"per_minute": 0, "burst": 0}
+
+MAX_WAIT_S = float(os.getenv("QUOTA_MAX_WAIT_S", "5"))
+LOW_RESERVE = float(os.getenv("QUOTA_LOW_RESERVE", "0.3"))
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExceeded(Exception):
+    """Plus de budget pour cet appel (rejeté ou attente trop longue)."""
+
+
+@lru_cache(maxsize=None)
+def quota_config(service):
+    config = dict(DEFAULTS.get(service, FALLBACK_DEFAULTS))
+    prefix = f"QUOTA_{service.upper()}_"
+    for key in ("per_minute", "burst"):
+        value = os.getenv(prefix + key.upper())
+        if value:
+            config[key] = float(value)
+    return config
+
+
+class SharedLevels:
+    """
+    Niveau de chaque seau (jetons, date du dernier remplissage) dans SQLite,
+    lu et modifié dans une transaction IMMEDIATE : atomique entre processus.
+    """
+
+    BUSY_TIMEOUT_MS = 5000
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()  # connexion SQLite du processus
+        self._db = None
+        self._db_pid = None
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Une transaction en cours dans le parent n'existe pas dans le worker
+        # forké : le verrou repart à zéro (la connexion est par processus)
+        self._lock = threading.Lock()
+
+    def take(self, service, rate, burst, floor, wait=True):
+        """
+        Remplit le seau puis prend un jeton s'il en reste plus que floor + 1.
+        Retourne (pris, jetons). wait=False : si la base est occupée (autre
+        thread ou autre worker), retourne (False, None) sans attendre.
+        """
+        return self._update(service, rate, burst, lambda tokens: tokens - 1 if tokens - 1 >= floor else None,
+                            wait=wait)
+
+    def drain(self, service, rate, burst):
+        self._update(service, rate, burst, lambda tokens: 0.0)
+
+    def level(self, service, rate, burst):
+        return self._update(service, rate, burst, lambda tokens: None)[1]
+
+    def _update(self, service, rate, burst, change, wait=True):
+        if not self._lock.acquire(blocking=wait):
+            return False, None
+        try:
+            db = self._connection()
+            if not wait:
+                db.execute("PRAGMA busy_timeout = 0")
+            try:
+                now = time.time()
+                with db:
+                    db.execute("BEGIN IMMEDIATE")
+                    row = db.execute("SELECT tokens, updated FROM buckets WHERE service = ?", (service,)).fetchone()
+                    tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+                    changed = change(tokens)
+                    if changed is not None:
+                        tokens = changed
+                    db.execute("INSERT OR REPLACE INTO buckets (service, tokens, updated) VALUES (?, ?, ?)",
+                               (service, tokens, now))
+            except sqlite3.OperationalError:
+                if wait:
+                    raise
+                return False, None  # base verrouillée par un autre worker
+            finally:
+                if not wait:
+                    db.execute(f"PRAGMA busy_timeout = {self.BUSY_TIMEOUT_MS}")
+        finally:
+            self._lock.release()
+        return changed is not None, tokens
+
+    def _connection(self):
+        # Une connexion par processus (les workers gunicorn sont forkés)
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=self.BUSY_TIMEOUT_MS / 1000,
+                                       isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (service TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._db_pid = os.getpid()
+        return self._db
+
+
+class TokenBucket:
+    """
+    Seau de `burst` jetons rempli à `per_minute` jetons par minute.
+    shared : SharedLevels pour partager le niveau entre processus, sinon il reste en mémoire.
+    """
+
+    def __init__(self, per_minute, burst, max_wait_s=MAX_WAIT_S, low_reserve=LOW_RESERVE, name="", shared=None):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = max(float(burst), 1.0)
+        self.max_wait_s = max_wait_s
+        self.low_reserve = low_reserve * self.burst
+        self.shared = shared
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+
+        # Compteurs exposés dans /api/stats
+        self.waiting = 0
+        self.max_waiting = 0
+        self.granted = {HIGH: 0, LOW: 0}
+        self.shed = 0
+        self.timeouts = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+
+    @property
+    def unlimited(self):
+        return self.rate <= 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self, floor, wait=True):
+        """
+        Prend un jeton s'il en reste plus que floor + 1. Retourne (pris, jetons).
+        Appelé sans _cond : la transaction SQLite du budget partagé ne bloque
+        pas les autres appelants du processus (la file d'attente, elle, reste sous _cond).
+        """
+        if self.shared is not None:
+            try:
+                return self.shared.take(self.name, self.rate, self.burst, floor, wait=wait)
+            except sqlite3.Error as e:
+                # Budget partagé illisible : on continue avec le seau du processus
+                logger.warning("Budget partagé %s illisible : %s", self.name, e)
+        with self._cond:
+            self._refill()
+            if self._tokens - 1 < floor:
+                return False, self._tokens
+            self._tokens -= 1
+            return True, self._tokens
+
+    def acquire(self, priority=HIGH):
+        """Prend un jeton ; lève QuotaExceeded si l'appel est rejeté ou attend trop."""
+        if self.unlimited:
+            return
+
+        if priority == LOW:
+            # Jamais en attente, ni derrière la file HIGH ni derrière le verrou SQLite
+            with self._cond:
+                busy = self.waiting > 0
+            if busy or not self._take(self.low_reserve, wait=False)[0]:
+                with self._cond:
+                    self.shed += 1
+                raise QuotaExceeded("budget épuisé, appel basse priorité rejeté")
+            with self._cond:
+                self.granted[LOW] += 1
+            return
+
+        started = time.monotonic()
+        deadline = started + self.max_wait_s
+        with self._cond:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            while True:
+                taken, tokens = self._take(0.0)
+                if taken:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._cond:
+                        self.timeouts += 1
+                    raise QuotaExceeded(f"pas de budget après {self.max_wait_s}s d'attente")
+                # Avec un budget partagé, un autre worker peut prendre le jeton attendu : on réessaie
+                with self._cond:
+                    self._cond.wait(min(remaining, max(1 - tokens, 0.01) / self.rate))
+        finally:
+            with self._cond:
+                self.waiting -= 1
+                self._cond.notify()
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self.granted[HIGH] += 1
+            self.wait_total_s += waited
+            self.wait_max_s = max(self.wait_max_s, waited)
+        QUOTA_WAIT_SECONDS.observe(waited, service=self.name)
+
+    def drain(self):
+        """Le fournisseur a répondu 429 : plus aucun jeton jusqu'au prochain remplissage."""
+        with self._cond:
+            self._refill()
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+        if self.shared is not None:
+            try:
+                self.shared.drain(self.name, self.rate, self.burst)
+            except sqlite3.Error as e:
+                logger.warning("Budget partagé %s illisible : %s", self.name, e)
+
+    def stats(self):
+        tokens = None
+        if not self.unlimited:
+            try:
+                tokens = self.shared.level(self.name, self.rate, self.burst) if self.shared is not None else None
+            except sqlite3.Error:
+                tokens = None
+        with self._cond:
+            if not self.unlimited and tokens is None:
+                self._refill()
+                tokens = self._tokens
+            granted_high = self.granted[HIGH]
+            return {
+                "per_minute": round(self.rate * 60, 1),
+                "tokens": None if tokens is None else round(tokens, 2),
+                "shared": self.shared is not None,
+                "queue_depth": self.waiting,
+                "max_queue_depth": self.max_waiting,
+                "granted": dict(self.granted),
+                "shed": self.shed,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(1000 * self.wait_total_s / granted_high, 1) if granted_high else 0.0,
+                "max_wait_ms": round(1000 * self.wait_max_s, 1)
+            }
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_shared = None
+
+
+def shared_levels():
+    """Niveaux partagés entre processus (QUOTA_DB_PATH), ou None pour un budget par processus."""
+    global _shared
+    path = os.getenv("QUOTA_DB_PATH", "data/quota.sqlite3")
+    if not path:
+        return None
+    if _shared is None:
+        _shared = SharedLevels(path)
+    return _shared
+
+
+def bucket(service):
+    with _buckets_lock:
+        if service not in _buckets:
+            config = quota_config(service)
+            _buckets[service] = TokenBucket(config["per_minute"], config["burst"], name=service,
+                                            shared=shared_levels() if config["per_minute"] > 0 else None)
+        return _buckets[service]
+
+
+def stats():
+    with _buckets_lock:
+        services = list(_buckets)
+    return {service: bucket(service).stats() for service in services}
@@ -0,0 +1,221 @@
+# route_cache.py
+
+"""
+Cache persistant des routes ORS.
+
+La clé est la liste des waypoints arrondis à `precision` décimales
+(4 décimales ≈ 11 m). Les routes récentes restent dans un LRU en mémoire ;
+toutes sont stockées dans SQLite avec une géométrie compacte : coordonnées
+quantifiées à 1e-5°, codées en deltas int32 puis compressées (zlib).
+Le disque est purgé par âge (max_age_s) et par taille (max_disk_entries).
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+GEOMETRY_SCALE = 1e5
+
+
+def encode_geometry(coords):
+    """[(lat, lon), ...] -> bytes (deltas int32 compressés)"""
+    q = np.round(np.asarray(coords, dtype=np.float64).reshape(-1, 2) * GEOMETRY_SCALE).astype(np.int32)
+    deltas = np.diff(q, axis=0, prepend=np.zeros((1, 2), dtype=np.int32))
+    return zlib.compress(deltas.tobytes(), 6)
+
+
+def decode_geometry(blob):
+    """bytes -> [(lat, lon), ...]"""
+    deltas = np.frombuffer(zlib.decompress(blob), dtype=np.int32).reshape(-1, 2)
+    coords = np.cumsum(deltas, axis=0, dtype=np.int64) / GEOMETRY_SCALE
+    return [tuple(c) for c in coords.tolist()]
+
+
+class RouteCache:
+    """Routes {"coords", "distance_km", "duration_h"} indexées par waypoints arrondis."""
+
+    def __init__(self, path=None, precision=4, max_memory_entries=256,
+                 max_disk_entries=20000, max_age_s=7 * 86400):
+        self.path = path
+        self.precision = precision
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.max_age_s = max_age_s
+
+        self._memory = OrderedDict()  # clé -> (route, created_at)
+        self._lock = threading.Lock()     # LRU en mémoire et compteurs
+        self._db_lock = threading.Lock()  # connexion SQLite (jamais prise avec _lock)
+        self._db = None
+        self._db_pid = None
+        self._writes = 0
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _after_fork(self):
+        # Une lecture disque en cours dans le parent n'existe pas dans le
+        # worker forké : les verrous repartent à zéro (la connexion est par processus)
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+
+    def key(self, waypoints):
+        return ";".join(f"{lat:.{self.precision}f},{lon:.{self.precision}f}" for lat, lon in waypoints)
+
+    # ---------------------------------------------------------
+    # 🔥 API
+    # ---------------------------------------------------------
+    def get_or_compute(self, waypoints, compute):
+        """Route en cache, sinon compute() ; un échec (None) n'est pas mis en cache."""
+        key = self.key(waypoints)
+        route = self.get(key)
+        if route is not None:
+            return route
+
+        route = compute()
+        if route:
+            self.put(key, route)
+        return route
+
+    def get(self, key):
+        route, tier = self._lookup(key)
+        with self._lock:
+            if route is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.disk_hits += tier == "disk"
+            return route
+
+    def peek(self, key):
+        """Comme get(), sans compter de succès ni d'échec (recherche secondaire, ex. avant une sonde)."""
+        return self._lookup(key)[0]
+
+    def _lookup(self, key):
+        """(route, "memory" | "disk") ou (None, None) ; la lecture SQLite se fait hors de _lock"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[1] < self.max_age_s:
+                self._memory.move_to_end(key)
+                return entry[0], "memory"
+
+        row = self._db_read(key)
+        if row and now - row[1] < self.max_age_s:
+            with self._lock:
+                # Un put() concurrent a pu ranger une route plus récente entre-temps
+                entry = self._memory.get(key)
+                if entry is None or entry[1] < row[1]:
+                    self._remember(key, row[0], row[1])
+            return row[0], "disk"
+        return None, None
+
+    def put(self, key, route):
+        now = time.time()
+        with self._lock:
+            self._remember(key, route, now)
+        self._db_write(key, route, now)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory)
+            }
+
+    # ---------------------------------------------------------
+    # 🔥 Niveaux mémoire et disque
+    # ---------------------------------------------------------
+    def _remember(self, key, route, created_at):
+        """Appelé avec _lock"""
+        self._memory[key] = (route, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _connection(self):
+        """Appelé avec _db_lock"""
+        if not self.path:
+            return None
+        # Une connexion par processus (les workers gunicorn sont forkés)
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS routes ("
+                "key TEXT PRIMARY KEY, distance_km REAL NOT NULL, duration_h REAL NOT NULL, "
+                "geometry BLOB NOT NULL, created_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS routes_used_at ON routes (used_at)")
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _db_read(self, key):
+        if not self.path:
+            return None
+        try:
+            with self._db_lock:
+                db = self._connection()
+                row = db.execute(
+                    "SELECT distance_km, duration_h, geometry, created_at FROM routes WHERE key = ?", (key,)
+                ).fetchone()
+                if not row:
+                    return None
+                with db:
+                    db.execute("UPDATE routes SET used_at = ? WHERE key = ?", (time.time(), key))
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Erreur cache routes (lecture): %s", e)
+            return None
+
+        distance_km, duration_h, geometry, created_at = row
+        route = {
+            "coords": decode_geometry(geometry),
+            "distance_km": distance_km,
+            "duration_h": duration_h
+        }
+        return route, created_at
+
+    def _db_write(self, key, route, now):
+        if not self.path:
+            return
+        geometry = encode_geometry(route["coords"])
+        try:
+            with self._db_lock:
+                db = self._connection()
+                with db:
+                    db.execute(
+                        "INSERT OR REPLACE INTO routes "
+                        "(key, distance_km, duration_h, geometry, created_at, used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, route["distance_km"], route["duration_h"], geometry, now, now)
+                    )
+                self._writes += 1
+                if self._writes % 100 == 1:
+                    self._evict(db, now)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Erreur cache routes (écriture): %s", e)
+
+    def _evict(self, db, now):
+        """Purge par âge puis par taille (les routes les moins récemment utilisées partent d'abord) ; appelé avec _db_lock."""
+        with db:
+            db.execute("DELETE FROM routes WHERE created_at < ?", (now - self.max_age_s,))
+            db.execute(
+                "DELETE FROM routes WHERE key IN ("
+                "SELECT key FROM routes ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,)
+            )
@@ -0,0 +1,86 @@
+# route_profile.py
+
+"""
+Profil de distance cumulée le long d'une route, calculé en une passe NumPy.
+
+Le profil sert à placer les arrêts de recharge à une distance réelle
+parcourue (et non à un ratio du nombre de points de la polyligne, qui
+dépend de la densité des points en ville).
+"""
+
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def route_array(coords):
+    """[(lat, lon), ...] -> tableau (n, 2) float64"""
+    return np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+
+
+def cumulative_distance_km(points):
+    """Distance haversine cumulée (km) à chaque sommet ; profile[0] == 0."""
+    if len(points) < 2:
+        return np.zeros(len(points))
+
+    lat = np.radians(points[:, 0])
+    lon = np.radians(points[:, 1])
+    dlat = np.diff(lat)
+    dlon = np.diff(lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    segments = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    profile = np.empty(len(points))
+    profile[0] = 0.0
+    np.cumsum(segments, out=profile[1:])
+    return profile
+
+
+def stop_distances(total_km, usable_range, slack_km=0.0):
+    """
+    Distances (km depuis le départ) des arrêts, tous les usable_range - slack_km
+    km. slack_km (au plus la moitié de l'autonomie) laisse la place de décaler
+    l'arrêt vers une borne proche sans allonger une étape au-delà de l'autonomie.
+    """
+    if usable_range <= 0 or total_km <= usable_range:
+        return np.empty(0)
+    step = usable_range - min(max(slack_km, 0.0), usable_range / 2)
+    count = math.ceil(total_km / step) - 1
+    return step * np.arange(1, count + 1, dtype=np.float64)
+
+
+def route_position(points, profile, lat, lon):
+    """
+    (position_km, detour_km) d'un point hors de la route : distance parcourue
+    au sommet le plus proche et distance à vol d'oiseau jusqu'à ce sommet.
+    """
+    lat1 = math.radians(lat)
+    lat2 = np.radians(points[:, 0])
+    dlat = lat2 - lat1
+    dlon = np.radians(points[:, 1]) - math.radians(lon)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    offsets = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    i = int(np.argmin(offsets))
+    return float(profile[i]), float(offsets[i])
+
+
+def points_at_distances(points, profile, distances):
+    """
+    Positions (lat, lon) aux distances demandées le long de la route :
+    searchsorted sur le profil puis interpolation linéaire dans le segment.
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    if not len(distances):
+        return np.empty((0, 2))
+    if len(points) < 2:
+        return np.repeat(points[:1], len(distances), axis=0)
+
+    distances = np.clip(distances, 0.0, profile[-1])
+    i = np.searchsorted(profile, distances, side="right") - 1
+    i = np.clip(i, 0, len(points) - 2)
+
+    seg = profile[i + 1] - profile[i]
+    t = np.divide(distances - profile[i], seg, out=np.zeros_like(distances), where=seg > 0)
+    return points[i] + (points[i + 1] - points[i]) * t[:, None]
@@ -0,0 +1,168 @@
+# singleflight.py
+
+"""
+Regroupement des appels identiques en cours ("single-flight").
+
+Quand plusieurs requêtes demandent en même temps la même chose (même paire
+de villes, même préfixe d'autocomplétion...), seul le premier appel part
+vers le service amont ; les suivants attendent son résultat (ou son
+exception) au lieu de relancer le même calcul. Rien n'est gardé une fois
+l'appel terminé : la mise en cache reste le rôle des caches dédiés.
+
+Chaque groupe compte les appels reçus et ceux qui ont été regroupés
+(exposés dans /api/stats).
+
+do_with_progress() regroupe aussi les calculs qui publient leur progression
+(plans en streaming, jobs) : chaque appelant reçoit tous les événements du
+calcul partagé, y compris ceux émis avant son arrivée.
+"""
+
+import queue
+import threading
+from concurrent.futures import Future
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+class CallAbandoned(Exception):
+    """Tous les appelants d'un calcul partagé l'ont quitté : il est interrompu."""
+
+
+class _Progress:
+    """Calcul partagé avec progression : historique des événements et une file par appelant."""
+
+    def __init__(self):
+        self.future = Future()
+        self._lock = threading.Lock()
+        self._history = []
+        self._subscribers = []
+        self._done = False
+        self._abandoned = False
+
+    def subscribe(self):
+        events = queue.SimpleQueue()
+        with self._lock:
+            for event in self._history:
+                events.put(event)
+            if self._done:
+                events.put(None)
+            else:
+                self._subscribers.append(events)
+        return events
+
+    def leave(self, events):
+        with self._lock:
+            if events in self._subscribers:
+                self._subscribers.remove(events)
+            self._abandoned = True
+
+    def emit(self, name, data):
+        with self._lock:
+            if self._abandoned and not self._subscribers:
+                raise CallAbandoned("plus aucun appelant")
+            self._history.append((name, data))
+            for events in self._subscribers:
+                events.put((name, data))
+
+    def finish(self):
+        with self._lock:
+            self._done = True
+            for events in self._subscribers:
+                events.put(None)
+            self._subscribers = []
+
+
+class SingleFlight:
+    """Un appel en cours par clé ; les appels concurrents de la même clé partagent son résultat."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.collapsed = 0
+
+    def do(self, key, compute):
+        with self._lock:
+            self.calls += 1
+            future = self._calls.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.collapsed += 1
+
+        if owner:
+            try:
+                future.set_result(compute())
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+        return future.result()
+
+    def do_with_progress(self, key, compute, on_event):
+        """
+        Comme do(), pour compute(emit) qui publie sa progression : le calcul
+        tourne dans son propre thread et chaque appelant reçoit tous ses
+        événements, dans son thread, via on_event(nom, données). Si on_event
+        lève une exception, seul cet appelant abandonne ; le calcul n'est
+        interrompu que quand tous ses appelants l'ont quitté.
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            owner = call is None
+            if owner:
+                call = self._calls[key] = _Progress()
+            else:
+                self.collapsed += 1
+            events = call.subscribe()
+
+        if owner:
+            def run():
+                try:
+                    call.future.set_result(compute(call.emit))
+                except BaseException as e:
+                    call.future.set_exception(e)
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call.finish()
+
+            threading.Thread(target=run, name=f"singleflight-{self.name}", daemon=True).start()
+
+        while True:
+            event = events.get()
+            if event is None:
+                return call.future.result()
+            try:
+                on_event(*event)
+            except BaseException:
+                call.leave(events)
+                raise
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "collapsed": self.collapsed,
+                "in_flight": len(self._calls)
+            }
+
+
+def group(name):
+    """Groupe nommé, partagé par tout le processus"""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name)
+        return _groups[name]
+
+
+def stats():
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {flight.name: flight.stats() for flight in groups}
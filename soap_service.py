@@ -1,9 +1,32 @@
 # soap_service.py
 
-from spyne import Application, rpc, ServiceBase, Integer, Float, Unicode
+from spyne import Application, rpc, ServiceBase, Integer, Float, Unicode, Array, ComplexModel
+from spyne.error import Fault
 from spyne.protocol.soap import Soap11
 from spyne.server.wsgi import WsgiApplication
 import json
+import numpy as np
+from metrics import span
+from trip_model import FALLBACK_SPEED_KMH, stops_needed, usable_range_km
+
+
+# Résultat typé d'un calcul (une ligne du lot)
+class TripTimeResult(ComplexModel):
+    __namespace__ = "ev.trip.calculator"
+
+    distance_km = Float
+    vehicle_range_km = Float
+    usable_range_km = Float
+    num_charging_stops = Integer
+    driving_time_hours = Float
+    charging_time_hours = Float
+    total_time_hours = Float
+    error = Unicode
+
+
+def _as_array(values):
+    return np.array([np.nan if v is None else v for v in (values or [])], dtype=np.float64)
+
 
 # Service SOAP pour le calcul du temps de trajet d'un véhicule électrique
 class TripCalculatorService(ServiceBase):
@@ -14,9 +37,9 @@ class TripCalculatorService(ServiceBase):
         if distance <= 0 or vehicle_range <= 0 or charging_time_minutes <= 0:
             return json.dumps({"error": "Les paramètres doivent être positifs"})
 
-        usable_range = vehicle_range * 0.8
-        num_stops = max(0, int(distance / usable_range))
-        driving_time_hours = distance / 90.0
+        usable_range = usable_range_km(vehicle_range)
+        num_stops = stops_needed(distance, usable_range)
+        driving_time_hours = distance / FALLBACK_SPEED_KMH
         total_charging_hours = (num_stops * charging_time_minutes) / 60.0
         total_time_hours = driving_time_hours + total_charging_hours
 
@@ -30,6 +53,52 @@ class TripCalculatorService(ServiceBase):
             "total_time_hours": round(total_time_hours, 2)
         })
 
+    @rpc(Array(Float), Array(Float), Array(Integer), _returns=Array(TripTimeResult))
+    def calculate_trip_times(ctx, distances, vehicle_ranges, charging_times_minutes):
+        """Même calcul que calculate_trip_time sur des tableaux, en une seule passe NumPy."""
+        distance = _as_array(distances)
+        vehicle_range = _as_array(vehicle_ranges)
+        charging_minutes = _as_array(charging_times_minutes)
+
+        if not (len(distance) == len(vehicle_range) == len(charging_minutes)):
+            raise Fault("Client.InvalidInput", "Les trois tableaux doivent avoir la même taille")
+
+        valid = (distance > 0) & (vehicle_range > 0) & (charging_minutes > 0)
+        safe_range = np.where(valid, vehicle_range, 1.0)
+
+        usable_range = usable_range_km(safe_range)
+        num_stops = stops_needed(np.where(valid, distance, 0.0), usable_range)
+        driving_time_hours = distance / FALLBACK_SPEED_KMH
+        total_charging_hours = num_stops * charging_minutes / 60.0
+        total_time_hours = driving_time_hours + total_charging_hours
+
+        columns = zip(
+            valid.tolist(),
+            np.round(distance, 2).tolist(),
+            np.round(vehicle_range, 2).tolist(),
+            np.round(usable_range, 2).tolist(),
+            num_stops.tolist(),
+            np.round(driving_time_hours, 2).tolist(),
+            np.round(total_charging_hours, 2).tolist(),
+            np.round(total_time_hours, 2).tolist()
+        )
+
+        results = []
+        for ok, dist, rng, usable, stops, driving, charging, total in columns:
+            if not ok:
+                results.append(TripTimeResult(error="Les paramètres doivent être positifs"))
+                continue
+            results.append(TripTimeResult(
+                distance_km=dist,
+                vehicle_range_km=rng,
+                usable_range_km=usable,
+                num_charging_stops=stops,
+                driving_time_hours=driving,
+                charging_time_hours=charging,
+                total_time_hours=total
+            ))
+        return results
+
 soap_app = Application(
     [TripCalculatorService],
     tns="ev.trip.calculator",
@@ -37,4 +106,10 @@ soap_app = Application(
     out_protocol=Soap11()
 )
 
-soap_wsgi_app = WsgiApplication(soap_app)
+_spyne_wsgi_app = WsgiApplication(soap_app)
+
+
+def soap_wsgi_app(environ, start_response):
+    """Application WSGI du service SOAP, chronométrée dans l'étape "soap" (/metrics)"""
+    with span("soap"):
+        return _spyne_wsgi_app(environ, start_response)
@@ -1,19 +1,15 @@
 #!/bin/bash
 
-# 1. Installation des dépendances (au cas où le build ne l'a pas fait)
-echo "Installing requirements..."
-python -m pip install --upgrade pip
-python -m pip install -r requirements.txt
+# 1. Les dépendances sont installées au build (requirements.txt), pas à chaque
+# démarrage : un pip install ici retardait chaque redémarrage de plusieurs
+# dizaines de secondes.
 
-# 2. Lancer le serveur SOAP (Port 8001) en arrière-plan (&)
-# On redirige les logs vers un fichier pour éviter de bloquer
-python soap_service.py > soap.log 2>&1 &
-
-echo "Démarrage du SOAP server... attente de 5s"
-sleep 5
+# 2. Le service SOAP est servi par la même application (/soap) : plus de
+# second processus ni d'attente.
 
 # 3. Lancer l'application Flask (Port 8000) au PREMIER PLAN
 # C'est ce processus que Azure va écouter.
-# Ne mettez PAS de '&' à la fin de cette ligne.
+# gunicorn.conf.py : l'application et ses caches sont chargés une fois dans le
+# master (preload) puis partagés par les workers forkés.
 echo "Starting Gunicorn (Flask + SOAP)..."
-gunicorn --bind=0.0.0.0:8000 app:application --timeout 600
+exec gunicorn --bind=0.0.0.0:8000 --config gunicorn.conf.py app:application
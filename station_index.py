@@ -0,0 +1,425 @@
+# station_index.py
+
+"""
+Index spatial local des bornes IRVE.
+
+Les bornes sont chargées une seule fois depuis un export du jeu de données
+IRVE (CSV ou JSON) puis rangées dans une grille régulière en degrés.
+Une requête "k bornes les plus proches dans un rayon R" ne parcourt que
+les cellules qui recouvrent le cercle de recherche.
+"""
+
+import csv
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from route_profile import points_at_distances
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Taille d'une cellule de la grille (en degrés). 0.25° ≈ 28 km en latitude.
+DEFAULT_CELL_DEG = 0.25
+
+# Bornes traitées par bloc lors de la projection sur une route (borne la mémoire)
+CORRIDOR_CHUNK = 1024
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distance haversine (km) entre un point et des tableaux de points."""
+    lat1 = math.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - math.radians(lon)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _pairwise_haversine_km(lats1, lons1, lats2, lons2):
+    """Distance haversine (km) élément par élément entre deux séries de points."""
+    lat1, lat2 = np.radians(lats1), np.radians(lats2)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons2) - np.radians(lons1)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _column(values):
+    values = np.asarray(values)
+    return values if values.dtype == np.float32 else values.astype(np.float64)
+
+
+def _fine_keys(cx, cy):
+    """Clé entière unique d'une cellule (cx, cy) de la grille fine d'un couloir."""
+    return (np.asarray(cx, dtype=np.int64) << 32) + np.asarray(cy, dtype=np.int64)
+
+
+# ---------------------------------------------------------
+# 🔥 Lecture d'un export IRVE (schéma bornes-irve ou consolidé)
+# ---------------------------------------------------------
+def _first(record, *keys):
+    for key in keys:
+        value = record.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _parse_coords(record):
+    """Extraire (lat, lon) d'un enregistrement IRVE, quel que soit le format."""
+    geo = record.get("geo_point_borne")
+    if isinstance(geo, dict) and "lat" in geo and "lon" in geo:
+        return float(geo["lat"]), float(geo["lon"])
+    if isinstance(geo, str) and "," in geo:
+        # Export CSV opendatasoft : "lat, lon"
+        lat, lon = geo.split(",", 1)
+        return float(lat), float(lon)
+
+    lat = _first(record, "consolidated_latitude", "latitude", "lat", "ylatitude")
+    lon = _first(record, "consolidated_longitude", "longitude", "lon", "xlongitude")
+    if lat is not None and lon is not None:
+        return float(lat), float(lon)
+
+    xy = record.get("coordonneesXY")
+    if isinstance(xy, str) and "," in xy:
+        # Schéma consolidé : "[lon, lat]"
+        lon, lat = xy.strip("[] ").split(",", 1)
+        return float(lat), float(lon)
+
+    return None
+
+
+def parse_irve_record(record):
+    """Convertir un enregistrement IRVE en tuple (lat, lon, nom, adresse, puissance)."""
+    try:
+        coords = _parse_coords(record)
+    except (TypeError, ValueError):
+        return None
+    if not coords:
+        return None
+
+    lat, lon = coords
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+
+    name = _first(record, "n_enseigne", "nom_enseigne", "n_operateur", "nom_operateur") or "Borne inconnue"
+    address = _first(record, "ad_station", "adresse_station") or "Adresse inconnue"
+    power = _first(record, "puiss_max", "puissance_nominale")
+    try:
+        power = float(power) if power is not None else float("nan")
+    except (TypeError, ValueError):
+        power = float("nan")
+
+    return lat, lon, name, address, power
+
+
+STREAMED_JSON_SUFFIXES = (".ndjson", ".jsonl", ".geojsonl")
+
+
+def _flat_record(record):
+    """Une Feature GeoJSON devient ses propriétés + lat/lon ; un enregistrement plat est rendu tel quel."""
+    if "properties" in record and "geometry" in record:
+        props = dict(record["properties"] or {})
+        lon, lat = record["geometry"]["coordinates"][:2]
+        props.setdefault("lat", lat)
+        props.setdefault("lon", lon)
+        return props
+    return record
+
+
+def iter_irve_records(path):
+    """
+    Itérer sur les enregistrements bruts d'un export IRVE : CSV et JSON
+    par ligne (NDJSON, un enregistrement ou une Feature par ligne) sont lus en
+    flux ; un document JSON ou GeoJSON est chargé d'un bloc.
+    """
+    lower = path.lower()
+    if lower.endswith(STREAMED_JSON_SUFFIXES):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield _flat_record(json.loads(line))
+        return
+
+    if lower.endswith((".json", ".geojson")):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            # Réponse de l'API records ({"results": [...]}) ou GeoJSON
+            data = data.get("results") or data.get("features") or []
+        for record in data:
+            yield _flat_record(record)
+        return
+
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        delimiter = ";" if sample.count(";") > sample.count(",") else ","
+        yield from csv.DictReader(f, delimiter=delimiter)
+
+
+# ---------------------------------------------------------
+# 🔥 Index en grille
+# ---------------------------------------------------------
+class StationIndex:
+    """Bornes IRVE rangées dans une grille lat/lon pour les requêtes de proximité."""
+
+    def __init__(self, lats, lons, names, addresses, powers, cell_deg=DEFAULT_CELL_DEG):
+        # Colonnes float32 d'un fichier synchronisé : gardées telles quelles (vues mmap, sans copie)
+        self.lats = _column(lats)
+        self.lons = _column(lons)
+        self.names = names
+        self.addresses = addresses
+        self.powers = _column(powers)
+        self.cell_deg = cell_deg
+        self._cells = self._build_cells()
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _cell_of(self, lat, lon):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def _build_cells(self):
+        """Regrouper les indices des bornes par cellule (tri + découpage, sans boucle par borne)."""
+        if not len(self.lats):
+            return {}
+
+        rows = np.floor(self.lats / self.cell_deg).astype(np.int64)
+        cols = np.floor(self.lons / self.cell_deg).astype(np.int64)
+        order = np.lexsort((cols, rows))
+        rows, cols = rows[order], cols[order]
+        change = np.flatnonzero((np.diff(rows) != 0) | (np.diff(cols) != 0)) + 1
+        starts = np.concatenate(([0], change))
+        bounds = np.append(starts, len(order))
+
+        cells = {}
+        for i, (row, col) in enumerate(zip(rows[starts].tolist(), cols[starts].tolist())):
+            cells[(row, col)] = order[bounds[i]:bounds[i + 1]]
+        return cells
+
+    @classmethod
+    def from_records(cls, records, cell_deg=DEFAULT_CELL_DEG):
+        lats, lons, names, addresses, powers = [], [], [], [], []
+        for record in records:
+            parsed = parse_irve_record(record)
+            if not parsed:
+                continue
+            lat, lon, name, address, power = parsed
+            lats.append(lat)
+            lons.append(lon)
+            names.append(name)
+            addresses.append(address)
+            powers.append(power)
+        return cls(lats, lons, names, addresses, powers, cell_deg=cell_deg)
+
+    @classmethod
+    def from_columnar(cls, path, cell_deg=DEFAULT_CELL_DEG):
+        """Charger le fichier en colonnes écrit par irve_sync.py (mmap, chaînes décodées à la demande)."""
+        from irve_sync import ColumnarStore
+
+        store = ColumnarStore(path)
+        return cls(store.lats, store.lons, store.names, store.addresses, store.powers, cell_deg=cell_deg)
+
+    @classmethod
+    def from_file(cls, path, cell_deg=DEFAULT_CELL_DEG):
+        """Charger un export IRVE (CSV ou JSON) téléchargé depuis data.gouv / opendatasoft, ou un fichier synchronisé."""
+        from irve_sync import is_columnar
+
+        if is_columnar(path):
+            return cls.from_columnar(path, cell_deg=cell_deg)
+        return cls.from_records(iter_irve_records(path), cell_deg=cell_deg)
+
+    def candidates(self, lat, lon, radius_km):
+        """Indices des bornes situées dans les cellules qui recouvrent le cercle de recherche."""
+        dlat = radius_km / 111.0
+        cos_lat = max(math.cos(math.radians(lat)), 0.01)
+        dlon = radius_km / (111.0 * cos_lat)
+
+        row_min, col_min = self._cell_of(lat - dlat, lon - dlon)
+        row_max, col_max = self._cell_of(lat + dlat, lon + dlon)
+
+        chunks = []
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                cell = self._cells.get((row, col))
+                if cell is not None:
+                    chunks.append(cell)
+
+        if not chunks:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+
+    def corridor(self, points, profile, buffer_km=5.0, sample_km=2.0):
+        """
+        Toutes les bornes à moins de buffer_km de la route, en une seule requête.
+        points/profile : polyligne (n, 2) et sa distance cumulée (route_profile).
+        Retourne (indices, position_km, detour_km) triés par position le long de
+        la route ; detour_km est la distance de la borne à la route.
+        """
+        empty = (np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+        if not len(self.lats) or not len(points):
+            return empty
+
+        # Échantillons réguliers le long de la route
+        step = max(0.1, min(sample_km, buffer_km / 2))
+        at = np.append(np.arange(0.0, profile[-1], step), profile[-1])
+        samples = points_at_distances(points, profile, at)
+
+        # Cellules de la grille qui recouvrent le couloir
+        sample_cells = np.unique(np.floor(samples / self.cell_deg).astype(np.int64), axis=0)
+        cos_lat = max(math.cos(math.radians(float(np.abs(samples[:, 0]).max()))), 0.01)
+        ring_r = int(math.ceil(buffer_km / 111.0 / self.cell_deg))
+        ring_c = int(math.ceil(buffer_km / (111.0 * cos_lat) / self.cell_deg))
+        dr, dc = np.meshgrid(np.arange(-ring_r, ring_r + 1), np.arange(-ring_c, ring_c + 1), indexing="ij")
+        rows = (sample_cells[:, :1] + dr.ravel()).ravel()
+        cols = (sample_cells[:, 1:] + dc.ravel()).ravel()
+
+        chunks = [self._cells[cell] for cell in set(zip(rows.tolist(), cols.tolist())) if cell in self._cells]
+        if not chunks:
+            return empty
+        idx = np.concatenate(chunks)
+
+        # Projection plane locale (km), puis filtre grossier sur une grille fine
+        # de pas buffer_km : on ne garde que les bornes voisines d'un échantillon
+        lat0 = math.radians(float(samples[:, 0].mean()))
+        kx, ky = 111.32 * math.cos(lat0), 110.57
+        sx = (samples[:, 1] * kx).astype(np.float32)
+        sy = (samples[:, 0] * ky).astype(np.float32)
+        bx = (self.lons[idx] * kx).astype(np.float32)
+        by = (self.lats[idx] * ky).astype(np.float32)
+
+        fine = max(buffer_km, step)
+        sample_keys = _fine_keys(np.floor(sx / fine), np.floor(sy / fine))
+        near_keys = np.unique(np.concatenate([sample_keys + _fine_keys(dx, dy)
+                                              for dx in (-1, 0, 1) for dy in (-1, 0, 1)]))
+        near = np.isin(_fine_keys(np.floor(bx / fine), np.floor(by / fine)), near_keys)
+        idx, bx, by = idx[near], bx[near], by[near]
+        if not len(idx):
+            return empty
+
+        # Échantillon le plus proche de chaque borne restante
+
+        nearest = np.empty(len(idx), dtype=np.int64)
+        for start in range(0, len(idx), CORRIDOR_CHUNK):
+            stop = start + CORRIDOR_CHUNK
+            d2 = (bx[start:stop, None] - sx[None, :]) ** 2 + (by[start:stop, None] - sy[None, :]) ** 2
+            nearest[start:stop] = np.argmin(d2, axis=1)
+
+        detour = _pairwise_haversine_km(self.lats[idx], self.lons[idx], samples[nearest, 0], samples[nearest, 1])
+        inside = detour <= buffer_km
+        idx, position, detour = idx[inside], at[nearest[inside]], detour[inside]
+
+        order = np.argsort(position, kind="stable")
+        return idx[order], position[order], detour[order]
+
+    def nearest(self, lat, lon, radius_km=50, k=10):
+        """
+        Les k bornes les plus proches dans un rayon de radius_km.
+        Retourne une liste de (indice, distance_km) triée par distance.
+        """
+        idx = self.candidates(lat, lon, radius_km)
+        if not len(idx):
+            return []
+
+        dist = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+        inside = dist <= radius_km
+        idx, dist = idx[inside], dist[inside]
+
+        if len(idx) > k:
+            part = np.argpartition(dist, k - 1)[:k]
+            idx, dist = idx[part], dist[part]
+
+        order = np.argsort(dist, kind="stable")
+        return [(int(idx[i]), float(dist[i])) for i in order]
+
+    def station(self, i, distance):
+        """Borne au format renvoyé par get_charging_stations."""
+        power = self.powers[i]
+        return {
+            "name": self.names[i],
+            "address": self.addresses[i],
+            "lat": round(float(self.lats[i]), 6),
+            "lon": round(float(self.lons[i]), 6),
+            "distance": distance,
+            "power": f"{power:g} kW" if not math.isnan(power) else "N/A kW",
+            "found": True
+        }
+
+    def search(self, lat, lon, radius_km=50, k=10):
+        """Bornes les plus proches, au format de get_charging_stations."""
+        return [self.station(i, d) for i, d in self.nearest(lat, lon, radius_km, k)]
+
+
+# Intervalle entre deux vérifications de la date de modification du snapshot
+RELOAD_CHECK_S = float(os.getenv("IRVE_RELOAD_CHECK_S", "30"))
+
+_index = None
+_index_mtime = None
+_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def snapshot_path():
+    """IRVE_SNAPSHOT_PATH, sinon le fichier synchronisé (data/irve.bin) s'il existe, sinon data/irve.csv"""
+    return os.getenv("IRVE_SNAPSHOT_PATH") or ("data/irve.bin" if os.path.exists("data/irve.bin") else "data/irve.csv")
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _read_index(path):
+    if _mtime(path) is None:
+        logger.warning("⚠️ Snapshot IRVE introuvable : %s (bornes via l'API IRVE ; python irve_sync.py pour le créer)", path)
+        return StationIndex([], [], [], [], [])
+    index = StationIndex.from_file(path)
+    logger.info("✅ Index IRVE chargé : %d bornes (%s)", len(index), path)
+    return index
+
+
+def load_station_index(path=None):
+    """
+    Index partagé par le processus, chargé au premier appel. Si le snapshot est
+    remplacé (irve_sync.py), le nouvel index est chargé à la volée ; les autres
+    requêtes gardent l'ancien en attendant.
+    """
+    global _index, _index_mtime, _checked_at
+    path = path or snapshot_path()
+    with _index_lock:
+        if _index is None:
+            _index_mtime = _mtime(path)
+            _checked_at = time.monotonic()
+            _index = _read_index(path)
+            return _index
+
+        now = time.monotonic()
+        if now - _checked_at < RELOAD_CHECK_S:
+            return _index
+        _checked_at = now
+        mtime = _mtime(path)
+        if mtime == _index_mtime or mtime is None:
+            return _index
+        current = _index
+
+    # Rechargement hors du verrou : les requêtes concurrentes continuent avec l'index courant
+    try:
+        index = _read_index(path)
+    except (OSError, ValueError) as e:
+        logger.error("❌ Rechargement de l'index IRVE impossible : %s", e)
+        return current
+
+    with _index_lock:
+        _index, _index_mtime = index, mtime
+    return index
@@ -0,0 +1,59 @@
+# tests/test_caches.py
+
+import threading
+import time
+
+from geocode_cache import GeocodeCache
+from route_cache import RouteCache
+
+ROUTE = {"coords": [(48.8566, 2.3522), (45.764, 4.8357)], "distance_km": 465.2, "duration_h": 5.17}
+
+
+def _while_disk_busy(cache, check):
+    """Exécute check() pendant qu'un autre thread garde la connexion SQLite"""
+    release = threading.Event()
+    holding = threading.Event()
+
+    def hold():
+        with cache._db_lock:
+            holding.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    holding.wait(5)
+    try:
+        started = time.perf_counter()
+        check()
+        return time.perf_counter() - started
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_route_memory_hit_does_not_wait_for_disk(tmp_path):
+    """Un succès en mémoire ne passe pas derrière une lecture SQLite en cours"""
+    cache = RouteCache(str(tmp_path / "routes.sqlite3"))
+    cache.put("a", ROUTE)
+
+    elapsed = _while_disk_busy(cache, lambda: cache.get("a"))
+    assert elapsed < 0.5
+    assert cache.stats()["hits"] == 1
+
+    # Relu depuis le disque par une autre instance (autre worker)
+    other = RouteCache(cache.path)
+    assert other.get("a")["distance_km"] == 465.2
+    assert other.get("b") is None
+    assert other.stats()["disk_hits"] == 1 and other.stats()["misses"] == 1
+
+
+def test_geocode_memory_hit_does_not_wait_for_disk(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "geocode.sqlite3"))
+    cache.put("paris", (48.8566, 2.3522))
+
+    elapsed = _while_disk_busy(cache, lambda: cache.get_or_compute("Paris", lambda: None))
+    assert elapsed < 0.5
+
+    other = GeocodeCache(cache.path)
+    assert other.get_or_compute("Paris", lambda: None) == (48.8566, 2.3522)
+    assert other.stats()["disk_hits"] == 1
@@ -0,0 +1,74 @@
+# tests/test_charging_planner.py
+
+import itertools
+import random
+
+import numpy as np
+
+from charging_planner import plan_stops, prune_candidates
+
+CHARGING_H = 0.5
+SPEED_KMH = 90.0
+
+
+def _legs(positions, detours, total_km, chosen):
+    """Distance de chaque étape, détours aller et retour compris"""
+    pos = [0.0] + [positions[i] for i in chosen] + [total_km]
+    det = [0.0] + [detours[i] for i in chosen] + [0.0]
+    return [pos[k + 1] - pos[k] + det[k] + det[k + 1] for k in range(len(pos) - 1)]
+
+
+def _cost(detours, chosen):
+    return sum(CHARGING_H + 2 * detours[i] / SPEED_KMH for i in chosen)
+
+
+def test_no_stop_when_in_range_and_none_when_unreachable():
+    positions, detours = np.array([100.0, 400.0]), np.array([1.0, 1.0])
+    assert plan_stops(positions, detours, 250, 270, CHARGING_H, SPEED_KMH) == []
+    assert plan_stops(np.empty(0), np.empty(0), 500, 270, CHARGING_H, SPEED_KMH) is None
+    # Trou de 300 km entre les deux bornes
+    assert plan_stops(positions, detours, 500, 270, CHARGING_H, SPEED_KMH) is None
+
+
+def test_detour_counts_against_usable_range():
+    """Une borne à 190 km mais à 15 km de la route ne tient pas dans 200 km"""
+    positions, detours = np.array([150.0, 190.0]), np.array([1.0, 15.0])
+    chosen = plan_stops(positions, detours, 340, 200, CHARGING_H, SPEED_KMH)
+    assert chosen == [0]
+    assert max(_legs(positions, detours, 340, chosen)) <= 200
+
+
+def test_plan_is_feasible_and_optimal():
+    """Comparaison avec l'énumération de toutes les suites de bornes"""
+    rng = random.Random(7)
+    for _ in range(50):
+        n = rng.randint(1, 9)
+        total_km = rng.uniform(300, 700)
+        usable = rng.uniform(150, 300)
+        positions = np.sort(np.array([rng.uniform(0, total_km) for _ in range(n)]))
+        detours = np.array([rng.uniform(0, 20) for _ in range(n)])
+
+        best = None
+        for size in range(n + 1):
+            for combo in itertools.combinations(range(n), size):
+                if max(_legs(positions, detours, total_km, combo)) <= usable:
+                    if best is None or _cost(detours, combo) < best - 1e-9:
+                        best = _cost(detours, combo)
+
+        chosen = plan_stops(positions, detours, total_km, usable, CHARGING_H, SPEED_KMH)
+        if best is None:
+            assert chosen is None
+            continue
+        assert chosen == sorted(chosen)
+        assert max(_legs(positions, detours, total_km, chosen)) <= usable
+        assert abs(_cost(detours, chosen) - best) < 1e-9
+
+
+def test_prune_keeps_best_candidate_per_bucket():
+    positions = np.array([0.5, 1.5, 1.9, 3.0, 3.1])
+    detours = np.array([2.0, 1.0, 1.0, 4.0, 4.0])
+    powers = np.array([50.0, 22.0, 150.0, np.nan, 7.0])
+    keep = prune_candidates(positions, detours, powers, bucket_km=2.0)
+    # Tronçon [0, 2) : plus petit détour, puis plus forte puissance ; [2, 4) : NaN compte pour 0
+    assert keep.tolist() == [2, 4]
+    assert prune_candidates(np.empty(0), np.empty(0)).tolist() == []
@@ -0,0 +1,94 @@
+# tests/test_corridor_table.py
+
+import math
+import os
+
+import numpy as np
+
+import corridor_table
+from charging_planner import plan_stops
+from corridor_table import MAGIC, VERSION, CorridorTable, load_corridor_table, plans_by_stop_count
+from mmap_store import DataWriter, write_file
+from trip_model import usable_range_km
+
+START, END = (48.8566, 2.3522), (43.2965, 5.3698)
+DISTANCE_KM, SPEED_KMH = 775.0, 100.0
+
+
+def test_plans_by_stop_count_finds_thresholds():
+    """Plus petite autonomie de chaque nombre d'arrêts, à la précision de la dichotomie"""
+    def choose(range_km):
+        return list(range(math.ceil(1000 / range_km) - 1))
+
+    found = plans_by_stop_count(choose, 150, 1000, step=25, precision=0.25)
+    assert sorted(found) == list(range(7))
+    for count, (range_km, chosen) in found.items():
+        threshold = 1000 / (count + 1)
+        assert len(chosen) == count
+        assert max(150, threshold) <= range_km <= max(150, threshold) + 0.25
+
+
+def _write_table(path):
+    positions = np.arange(10.0, DISTANCE_KM, 10.0)
+    detours = np.full(len(positions), 1.0)
+    data = DataWriter()
+    candidates = [data.add(np.column_stack((positions, detours)).astype("<f4")), len(positions)]
+    route = [data.add(np.array([[4885660, 235220], [4329650, 536980]], dtype="<i4")), 2]
+
+    def choose(range_km):
+        return plan_stops(positions, detours, DISTANCE_KM, usable_range_km(range_km), 0.5, SPEED_KMH)
+
+    plans = []
+    for count, (range_km, chosen) in sorted(plans_by_stop_count(choose, 200, 900).items()):
+        pos = np.concatenate(([0.0], positions[chosen], [DISTANCE_KM]))
+        det = np.concatenate(([0.0], detours[chosen], [0.0]))
+        plans.append({
+            "range_km": range_km, "num_stops": count, "candidates": chosen,
+            "max_leg_km": float(np.max(pos[1:] - pos[:-1] + det[1:] + det[:-1])),
+            "stops": [{"stop_number": i + 1, "lat": 45.0, "lon": 4.0, "found": True} for i in range(count)],
+            "total_distance": DISTANCE_KM, "driving_time": 7.75, "route": 0
+        })
+    directory = {
+        "version": VERSION, "built_at": 0, "min_range_km": 200, "charging_time": 30,
+        "pairs": [{"start_city": "Paris", "end_city": "Marseille", "start": list(START), "end": list(END),
+                   "distance_km": DISTANCE_KM, "speed_kmh": SPEED_KMH, "candidates": candidates,
+                   "routes": [route], "plans": plans}]
+    }
+    write_file(path, MAGIC, directory, data)
+
+
+def test_lookup_between_and_beyond_built_ranges(tmp_path):
+    path = str(tmp_path / "corridors.bin")
+    _write_table(path)
+    table = CorridorTable.from_file(path)
+
+    for vehicle_range in (200, 250, 330, 555, 860, 1000, 2000):
+        trip = table.lookup((START[0] + 0.01, START[1]), END, vehicle_range)
+        assert trip is not None, vehicle_range
+        positions = np.arange(10.0, DISTANCE_KM, 10.0)
+        expected = plan_stops(positions, np.full(len(positions), 1.0), DISTANCE_KM,
+                              usable_range_km(vehicle_range), 0.5, SPEED_KMH)
+        assert trip["num_stops"] == len(expected)
+        assert trip["route_coords"][0] == (48.8566, 2.3522)
+
+    assert table.lookup(START, END, 150) is None  # sous --min-range : calcul en direct
+    assert table.lookup((START[0] + 1, START[1]), END, 400) is None
+    assert table.stats() == dict(table.stats(), hits=7, stale=1, misses=1)
+
+
+def test_load_corridor_table_reloads_rebuilt_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "corridors.bin")
+    monkeypatch.setenv("CORRIDOR_TABLE_PATH", path)
+    monkeypatch.setattr(corridor_table, "RELOAD_CHECK_S", 0)
+    monkeypatch.setattr(corridor_table, "_table", None)
+
+    assert load_corridor_table() is None
+    _write_table(path)
+    table = load_corridor_table()
+    assert table is not None and len(table) == 1
+
+    table.lookup(START, END, 400)
+    _write_table(path)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+    reloaded = load_corridor_table()
+    assert reloaded is not table and reloaded.stats()["hits"] == 1
@@ -0,0 +1,78 @@
+# tests/test_irve_sync.py
+
+import math
+import os
+
+from irve_sync import ColumnarStore, StoreBuilder, sync
+
+HEADER = "n_enseigne,ad_station,consolidated_latitude,consolidated_longitude,puiss_max,id_pdc_itinerance\n"
+ROWS = [
+    "Borne A,1 rue A,48.85,2.35,50,FR*A*1\n",
+    "Borne B,2 rue B,45.76,4.83,150,FR*B*1\n",
+]
+
+
+def _export(path, rows, mtime):
+    path.write_text(HEADER + "".join(rows), encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def _rows(store):
+    return {store.ids[i]: (float(store.lats[i]), float(store.lons[i]), float(store.powers[i]),
+                           store.names[i], store.addresses[i]) for i in range(len(store))}
+
+
+def test_builder_upsert_remove_and_round_trip(tmp_path):
+    path = str(tmp_path / "irve.bin")
+    builder = StoreBuilder()
+    builder.upsert("A", 48.85, 2.35, "Borne A", "1 rue A", 50)
+    builder.upsert("B", 45.76, 4.83, "Borne B", "2 rue B", float("nan"))
+    builder.upsert("C", 43.30, 5.37, "Borne C", "3 rue C", 22)
+    assert (builder.added, builder.updated, builder.removed) == (3, 0, 0)
+    assert builder.write(path, {"cursor": "2024-01-01"}) == 3
+
+    store = ColumnarStore(path)
+    assert store.meta["cursor"] == "2024-01-01"
+    rows = _rows(store)
+    assert rows["A"][3:] == ("Borne A", "1 rue A") and rows["C"][2] == 22
+    assert math.isnan(rows["B"][2])
+
+    # Export complet suivant : A inchangée, B modifiée, C absente, D nouvelle
+    builder = StoreBuilder.from_store(store)
+    builder.upsert("A", 48.85, 2.35, "Borne A", "1 rue A", 50)
+    builder.upsert("B", 45.76, 4.83, "Borne B", "2 rue B", float("nan"))
+    assert not builder.changed
+    builder.upsert("B", 45.76, 4.83, "Borne B+", "2 rue B", 150)
+    builder.upsert("D", 47.22, -1.55, "Borne A", "4 rue D", 11)
+    builder.remove_unseen()
+    assert (builder.added, builder.updated, builder.removed) == (1, 1, 1)
+    assert builder.write(path, {}) == 3
+
+    rows = _rows(ColumnarStore(path))
+    assert sorted(rows) == ["A", "B", "D"]
+    assert rows["B"][2:4] == (150.0, "Borne B+")
+    assert rows["D"][3:] == ("Borne A", "4 rue D")
+    assert abs(rows["A"][0] - 48.85) < 1e-5
+
+
+def test_unchanged_export_keeps_its_signature(tmp_path, caplog):
+    """Export touché mais identique : signature enregistrée, colonnes et date du fichier intactes"""
+    out = str(tmp_path / "irve.bin")
+    source = _export(tmp_path / "irve.csv", ROWS, 1_700_000_000)
+    assert sync(out, source=source)["written"] is not False
+
+    _export(tmp_path / "irve.csv", ROWS, 1_700_000_100)
+    store_mtime = os.stat(out).st_mtime_ns
+    result = sync(out, source=source)
+    assert result["written"] is False and result["count"] == 2
+    assert os.stat(out).st_mtime_ns == store_mtime
+
+    store = ColumnarStore(out)
+    assert store.meta["source_signature"].endswith(":1700000100")
+    assert sorted(store.names[i] for i in range(len(store))) == ["Borne A", "Borne B"]
+
+    # Même export : plus relu du tout
+    caplog.set_level("INFO", logger="irve_sync")
+    assert sync(out, source=source)["written"] is False
+    assert "Export inchangé" in caplog.text
@@ -0,0 +1,96 @@
+# tests/test_jobs.py
+
+import sqlite3
+import threading
+import time
+
+from jobs import CANCELLED, DONE, EXPIRED, RUNNING, JobQueue
+
+
+def _queue(tmp_path, runner=None, **kwargs):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), runner or (lambda payload, checkpoint: payload),
+                    workers=0, **kwargs)
+
+
+def test_claim_is_exclusive_across_queues(tmp_path):
+    """Deux files sur la même base (deux workers), huit threads : chaque job n'est pris qu'une fois"""
+    queues = [_queue(tmp_path), _queue(tmp_path)]
+    submitted = {queues[0].submit({"n": n}) for n in range(40)}
+
+    claimed = []
+    claimed_lock = threading.Lock()
+
+    def claim(queue):
+        while True:
+            job = queue._claim()
+            if job is None:
+                return
+            with claimed_lock:
+                claimed.append(job[0])
+
+    threads = [threading.Thread(target=claim, args=(queues[i % 2],)) for i in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+    assert sorted(claimed) == sorted(submitted)
+    assert queues[1].stats()["by_status"][RUNNING] == 40
+
+
+def test_cancel_queued_and_running(tmp_path):
+    started = threading.Event()
+    release = threading.Event()
+
+    def runner(payload, checkpoint):
+        started.set()
+        release.wait(5)
+        checkpoint()
+        return payload
+
+    queue = _queue(tmp_path, runner)
+    queued_id = queue.submit({"n": 1})
+    assert queue.cancel(queued_id)["status"] == CANCELLED
+    assert queue._claim() is None  # un job annulé n'est jamais pris
+
+    running_id = queue.submit({"n": 2})
+    job = queue._claim()
+    worker = threading.Thread(target=queue._run, args=job)
+    worker.start()
+    started.wait(5)
+    assert queue.cancel(running_id)["status"] == RUNNING  # arrêt au prochain point de contrôle
+    release.set()
+    worker.join()
+    assert queue.get(running_id)["status"] == CANCELLED
+
+
+def test_done_and_deadline(tmp_path):
+    queue = _queue(tmp_path)
+    job_id = queue.submit({"n": 1})
+    queue._run(*queue._claim())
+    assert queue.get(job_id)["status"] == DONE and queue.get(job_id)["result"] == {"n": 1}
+
+    late_id = queue.submit({"n": 2}, deadline_s=0.01)
+    time.sleep(0.05)
+    assert queue._claim() is None
+    assert queue.get(late_id)["status"] == EXPIRED
+
+
+def test_reads_do_not_wait_for_a_write_lock(tmp_path):
+    """Une prise de job qui attend le verrou d'écriture ne bloque pas GET ni stats du même processus"""
+    queue = _queue(tmp_path)
+    job_id = queue.submit({"n": 1})
+
+    other = sqlite3.connect(queue.path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    claimer = threading.Thread(target=queue._claim)  # attend le verrou d'écriture
+    try:
+        claimer.start()
+        time.sleep(0.1)
+        started = time.perf_counter()
+        assert queue.get(job_id)["status"] == "queued"
+        assert queue.stats()["queue_depth"] == 1
+        assert time.perf_counter() - started < 0.5
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+        claimer.join()
+    assert queue.get(job_id)["status"] == RUNNING
@@ -0,0 +1,64 @@
+# tests/test_polyline.py
+
+import math
+
+import numpy as np
+
+from polyline import decode, encode, simplify
+
+
+def test_encode_reference_example():
+    """Exemple de la documentation du format encoded polyline"""
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    assert encode(points) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert np.allclose(decode("_p~iF~ps|U_ulLnnqC_mqNvxq`@"), points)
+
+
+def test_round_trip_within_precision():
+    rng = np.random.default_rng(3)
+    points = np.column_stack((rng.uniform(-89, 89, 500), rng.uniform(-179, 179, 500)))
+    decoded = decode(encode(points))
+    assert decoded.shape == points.shape
+    assert np.abs(decoded - points).max() <= 0.5e-5 + 1e-12
+    assert encode(decoded) == encode(points)
+    assert decode(encode([])).shape == (0, 2)
+
+
+def _distance_to_polyline_m(point, line):
+    """Distance (m) de point à la ligne brisée, dans la projection de simplify"""
+    lat0 = math.radians(point[0])
+
+    def xy(p):
+        return np.array([p[1] * 111320.0 * math.cos(lat0), p[0] * 110570.0])
+
+    p = xy(point)
+    best = math.inf
+    for a, b in zip(line[:-1], line[1:]):
+        a, b = xy(a), xy(b)
+        seg = b - a
+        t = np.clip((p - a) @ seg / (seg @ seg), 0.0, 1.0) if seg @ seg else 0.0
+        best = min(best, float(np.hypot(*(p - (a + t * seg)))))
+    return best
+
+
+def test_simplify_stays_within_tolerance():
+    rng = np.random.default_rng(5)
+    steps = np.column_stack((np.full(400, 0.002), rng.normal(0, 0.001, 400)))
+    points = np.array([48.0, 2.0]) + np.cumsum(steps, axis=0)
+
+    for tolerance_m in (5, 50, 500):
+        simplified = simplify(points, tolerance_m)
+        assert 2 <= len(simplified) < len(points)
+        assert (simplified[0] == points[0]).all() and (simplified[-1] == points[-1]).all()
+        # Sous-ensemble ordonné des points d'origine
+        rows = [int(np.flatnonzero((points == s).all(axis=1))[0]) for s in simplified]
+        assert rows == sorted(rows)
+        # La projection varie un peu avec la latitude de référence : 1 % de marge
+        worst = max(_distance_to_polyline_m(p, simplified) for p in points)
+        assert worst <= tolerance_m * 1.01
+
+
+def test_simplify_straight_line_and_no_tolerance():
+    line = [(45.0 + i * 0.01, 3.0) for i in range(50)]
+    assert len(simplify(line, 1)) == 2
+    assert len(simplify(line, 0)) == 50
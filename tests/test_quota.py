@@ -0,0 +1,61 @@
+# tests/test_quota.py
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from quota import HIGH, LOW, QuotaExceeded, SharedLevels, TokenBucket
+
+
+def test_shared_budget_across_processes(tmp_path):
+    """Deux seaux sur la même base (deux workers) : une seule rafale à eux deux"""
+    path = str(tmp_path / "quota.sqlite3")
+    buckets = [TokenBucket(1, 3, max_wait_s=0, name="ors", shared=SharedLevels(path)) for _ in range(2)]
+
+    granted = 0
+    for _ in range(4):
+        for b in buckets:
+            try:
+                b.acquire(HIGH)
+                granted += 1
+            except QuotaExceeded:
+                pass
+    assert granted == 3
+
+
+def test_low_priority_is_shed_while_database_is_locked(tmp_path):
+    """Une base verrouillée par un autre worker ne met pas en attente un appel LOW"""
+    path = str(tmp_path / "quota.sqlite3")
+    b = TokenBucket(60, 10, name="ors", shared=SharedLevels(path))
+    b.acquire(LOW)
+
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        started = time.perf_counter()
+        with pytest.raises(QuotaExceeded):
+            b.acquire(LOW)
+        assert time.perf_counter() - started < 0.5
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+
+    b.acquire(LOW)
+    assert b.stats()["granted"][LOW] == 2 and b.stats()["shed"] == 1
+
+
+def test_low_priority_not_blocked_by_waiting_high(tmp_path):
+    """Un HIGH en attente de jeton ne bloque pas le rejet immédiat d'un LOW"""
+    b = TokenBucket(6, 1, max_wait_s=0.5, name="ors", shared=SharedLevels(str(tmp_path / "quota.sqlite3")))
+    b.acquire(HIGH)
+
+    waiter = threading.Thread(target=lambda: pytest.raises(QuotaExceeded, b.acquire, HIGH))
+    waiter.start()
+    time.sleep(0.1)
+    started = time.perf_counter()
+    with pytest.raises(QuotaExceeded):
+        b.acquire(LOW)
+    assert time.perf_counter() - started < 0.1
+    waiter.join()
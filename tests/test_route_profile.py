@@ -0,0 +1,56 @@
+# tests/test_route_profile.py
+
+import random
+
+import numpy as np
+
+from route_profile import (cumulative_distance_km, points_at_distances, route_array, route_position,
+                           stop_distances)
+
+
+def _straight_route(length_km=600, n=121):
+    points = route_array([(48.85 - i * (length_km / 111.2) / (n - 1), 2.35) for i in range(n)])
+    return points, cumulative_distance_km(points)
+
+
+def test_profile_and_interpolation():
+    points, profile = _straight_route()
+    assert profile[0] == 0 and abs(profile[-1] - 600) < 1
+    lat, lon = points_at_distances(points, profile, [profile[-1] / 2])[0]
+    assert abs(lat - (points[0, 0] + points[-1, 0]) / 2) < 1e-9 and lon == 2.35
+
+
+def test_stop_distances_slack():
+    assert len(stop_distances(100, 135)) == 0
+    assert stop_distances(300, 135).tolist() == [135, 270]
+    assert stop_distances(300, 135, slack_km=50).tolist() == [85, 170, 255]
+    # La marge ne prend jamais plus de la moitié de l'autonomie
+    assert stop_distances(300, 60, slack_km=500).tolist() == [30 * i for i in range(1, 10)]
+
+
+def test_snapped_stops_keep_legs_within_range():
+    """Bornes à moins de slack/2 (écart le long de la route + détour) : aucune étape ne dépasse l'autonomie"""
+    random.seed(1)
+    points, profile = _straight_route()
+    total = float(profile[-1])
+    stations = [(random.uniform(43.5, 48.9), 2.35 + random.uniform(-0.5, 0.5)) for _ in range(500)]
+    located = [route_position(points, profile, lat, lon) for lat, lon in stations]
+
+    for usable, slack in ((135, 50), (180, 50), (270, 50), (60, 50)):
+        window = min(slack, usable / 2) / 2
+        previous, legs = 0.0, []
+        for target in stop_distances(total, usable, slack):
+            reachable = [(abs(p - target) + d, p, d) for p, d in located if abs(p - target) + d <= window]
+            _, p, d = min(reachable) if reachable else (0, target, 0.0)
+            legs.append(p + d - previous)
+            previous = p - d
+        legs.append(total - previous)
+        assert max(legs) <= usable + 1e-9, (usable, legs)
+
+
+def test_route_position():
+    points, profile = _straight_route()
+    position, detour = route_position(points, profile, 47.0, 2.35 + 0.2)
+    i = int(np.argmin(np.abs(points[:, 0] - 47.0)))
+    assert position == profile[i]
+    assert 14 < detour < 16  # 0,2° de longitude à 47° N ≈ 15 km
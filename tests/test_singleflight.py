@@ -0,0 +1,111 @@
+# tests/test_singleflight.py
+
+import threading
+import time
+
+import pytest
+
+from singleflight import CallAbandoned, SingleFlight
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def _caller(flight, key, compute, received, results, on_event=None):
+    def run():
+        def record(name, data):
+            received.append((name, data))
+            if on_event:
+                on_event(name, data)
+        try:
+            results.append(flight.do_with_progress(key, compute, record))
+        except BaseException as e:
+            results.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_late_joiner_replays_earlier_events():
+    flight = SingleFlight("test")
+    first_emitted, gate = threading.Event(), threading.Event()
+    runs = []
+
+    def compute(emit):
+        runs.append(1)
+        emit("step", 1)
+        first_emitted.set()
+        gate.wait(5)
+        emit("step", 2)
+        return 42
+
+    early, late, results = [], [], []
+    t1 = _caller(flight, "k", compute, early, results)
+    first_emitted.wait(5)
+    t2 = _caller(flight, "k", compute, late, results)
+    _wait_for(lambda: flight.collapsed == 1)
+    gate.set()
+    t1.join(5)
+    t2.join(5)
+
+    assert runs == [1] and results == [42, 42]
+    assert early == late == [("step", 1), ("step", 2)]
+    assert flight.stats() == {"calls": 2, "collapsed": 1, "in_flight": 0}
+
+
+def test_one_caller_aborting_does_not_stop_the_others():
+    flight = SingleFlight("test")
+    joined = threading.Event()
+
+    def compute(emit):
+        joined.wait(5)
+        for i in range(3):
+            emit("step", i)
+        return "done"
+
+    def abort(name, data):
+        raise RuntimeError("client parti")
+
+    quitter, stayer, results = [], [], []
+    t1 = _caller(flight, "k", compute, quitter, results, on_event=abort)
+    t2 = _caller(flight, "k", compute, stayer, results)
+    _wait_for(lambda: flight.collapsed == 1)
+    joined.set()
+    t1.join(5)
+    t2.join(5)
+
+    assert quitter == [("step", 0)]
+    assert stayer == [("step", 0), ("step", 1), ("step", 2)]
+    assert isinstance(results[0], RuntimeError) or isinstance(results[1], RuntimeError)
+    assert "done" in results
+
+
+def test_computation_stops_when_every_caller_left():
+    flight = SingleFlight("test")
+    stopped = threading.Event()
+    outcome = []
+
+    def compute(emit):
+        try:
+            for i in range(100):
+                emit("step", i)
+                time.sleep(0.01)
+        except CallAbandoned:
+            outcome.append("abandoned")
+            raise
+        finally:
+            stopped.set()
+
+    def abort(name, data):
+        raise RuntimeError("client parti")
+
+    with pytest.raises(RuntimeError):
+        flight.do_with_progress("k", compute, abort)
+    assert stopped.wait(5)
+    assert outcome == ["abandoned"]
+    _wait_for(lambda: flight.stats()["in_flight"] == 0)
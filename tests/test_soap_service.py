@@ -0,0 +1,47 @@
+# tests/test_soap_service.py
+
+import json
+
+import numpy as np
+import pytest
+from spyne.error import Fault
+
+from soap_service import TripCalculatorService
+from trip_model import BATTERY_SAFETY_MARGIN, stops_needed, usable_range_km
+
+calculate_trip_time = TripCalculatorService.public_methods["calculate_trip_time"].function
+calculate_trip_times = TripCalculatorService.public_methods["calculate_trip_times"].function
+
+
+def test_stops_needed_at_range_boundaries():
+    assert usable_range_km(400) == pytest.approx(400 * (1 - BATTERY_SAFETY_MARGIN))
+    assert stops_needed(360, 360) == 0
+    assert stops_needed(360.01, 360) == 1
+    assert stops_needed(0, 360) == 0
+    assert stops_needed(np.array([100, 720, 721]), 360).tolist() == [0, 1, 2]
+
+
+def test_batch_rows_match_single_calls():
+    rng = np.random.default_rng(11)
+    distances = rng.uniform(10, 2000, 200).round(1).tolist() + [270.0, 270.1]
+    ranges = rng.uniform(100, 700, 200).round(0).tolist() + [300.0, 300.0]
+    minutes = rng.integers(10, 90, 200).tolist() + [30, 30]
+
+    rows = calculate_trip_times(None, distances, ranges, minutes)
+    assert len(rows) == len(distances)
+    for row, distance, vehicle_range, charging in zip(rows, distances, ranges, minutes):
+        assert row.error is None
+        assert row.num_charging_stops == stops_needed(distance, usable_range_km(vehicle_range))
+        single = json.loads(calculate_trip_time(None, distance, vehicle_range, charging))
+        for field, value in single.items():
+            assert getattr(row, field) == pytest.approx(value), field
+    assert [row.num_charging_stops for row in rows[-2:]] == [0, 1]
+
+
+def test_batch_rejects_invalid_rows_and_mismatched_arrays():
+    rows = calculate_trip_times(None, [450.0, -1.0, None], [300.0, 300.0, 300.0], [30, 30, 30])
+    assert rows[0].num_charging_stops == 1 and rows[0].error is None
+    assert rows[1].error and rows[2].error
+
+    with pytest.raises(Fault):
+        calculate_trip_times(None, [450.0], [300.0, 400.0], [30])
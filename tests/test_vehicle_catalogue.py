@@ -0,0 +1,37 @@
+# tests/test_vehicle_catalogue.py
+
+import threading
+import time
+
+from vehicle_catalogue import VehicleCatalogue
+
+
+def test_stale_get_does_not_wait_for_refresh():
+    """Catalogue périmé : get() sert l'ancien catalogue pendant un rafraîchissement lent"""
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(time.time())
+        if len(calls) > 1:
+            release.wait(5)
+        return [{"id": "v1", "range": 300 + len(calls)}]
+
+    catalogue = VehicleCatalogue(fetch, ttl_s=0)
+    assert catalogue.get("v1")["range"] == 301
+
+    try:
+        started = time.perf_counter()
+        for _ in range(5):
+            assert catalogue.get("v1")["range"] == 301
+            assert catalogue.all()[0]["id"] == "v1"
+        assert time.perf_counter() - started < 0.5
+        time.sleep(0.1)
+        assert len(calls) == 2  # un seul rafraîchissement en arrière-plan
+    finally:
+        release.set()
+
+    deadline = time.time() + 5
+    while catalogue._refreshing and time.time() < deadline:
+        time.sleep(0.01)
+    assert catalogue._by_id["v1"]["range"] == 302
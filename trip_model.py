@@ -0,0 +1,28 @@
+# trip_model.py
+
+"""
+Règles de calcul communes à l'application Flask et au service SOAP.
+Les fonctions acceptent aussi bien des nombres que des tableaux NumPy.
+"""
+
+import numpy as np
+
+# 🔋 MARGE DE SÉCURITÉ : on ne descend pas en dessous de 10% de batterie
+BATTERY_SAFETY_MARGIN = 0.10  # 10% de réserve minimale
+
+# Vitesse moyenne utilisée quand aucune durée de route n'est connue
+FALLBACK_SPEED_KMH = 90.0
+
+
+def usable_range_km(vehicle_range):
+    """Autonomie utilisable en gardant BATTERY_SAFETY_MARGIN de réserve"""
+    return vehicle_range * (1 - BATTERY_SAFETY_MARGIN)
+
+
+def stops_needed(total_distance, usable_range):
+    """
+    Nombre d'arrêts de recharge : un arrêt tous les usable_range km,
+    aucun si l'arrivée est atteignable d'une traite.
+    """
+    count = np.maximum(np.ceil(np.asarray(total_distance, dtype=np.float64) / usable_range) - 1, 0)
+    return count.astype(np.int64) if np.ndim(count) else int(count)
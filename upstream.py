@@ -0,0 +1,254 @@
+# upstream.py
+
+"""
+Client HTTP commun à tous les appels sortants (ORS, IRVE, Chargetrip).
+
+- une Session requests par hôte, avec un pool de connexions keep-alive ;
+- des timeouts connexion/lecture par service ;
+- quelques nouvelles tentatives avec backoff exponentiel + jitter sur les
+  erreurs réseau et les réponses 429/5xx ;
+- un disjoncteur par service : après plusieurs échecs consécutifs, les
+  appels échouent tout de suite (UpstreamUnavailable) et l'appelant passe
+  directement à son fallback (distance géodésique, véhicules par défaut...) ;
+- un budget d'appels par service (quota.py) : chaque tentative prend un
+  jeton, les appels LOW (autocomplétion) sont rejetés avant les plans ;
+- chaque tentative est comptée et chronométrée par service et statut
+  (metrics.py, exporté sur /metrics).
+
+Chaque service se configure par variables d'environnement, par exemple
+UPSTREAM_ORS_READ_TIMEOUT=20 ou UPSTREAM_IRVE_RETRIES=0.
+"""
+
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import quota
+from metrics import UPSTREAM_REQUESTS, UPSTREAM_SECONDS
+from quota import HIGH, LOW
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+DEFAULTS = {
+    "ors": {"connect_timeout": 3.05, "read_timeout": 15, "retries": 2},
+    "irve": {"connect_timeout": 3.05, "read_timeout": 8, "retries": 1},
+    "chargetrip": {"connect_timeout": 3.05, "read_timeout": 15, "retries": 2},
+}
+FALLBACK_DEFAULTS = {"connect_timeout": 3.05, "read_timeout": 10, "retries": 1}
+
+POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "20"))
+BACKOFF_BASE_S = float(os.getenv("UPSTREAM_BACKOFF_BASE_S", "0.2"))
+BACKOFF_MAX_S = float(os.getenv("UPSTREAM_BACKOFF_MAX_S", "2"))
+BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN_S = float(os.getenv("UPSTREAM_BREAKER_COOLDOWN_S", "30"))
+
+
+class UpstreamUnavailable(Exception):
+    """Le disjoncteur du service est ouvert ou son budget est épuisé : pas d'appel réseau."""
+
+
+@lru_cache(maxsize=None)
+def service_config(service):
+    config = dict(DEFAULTS.get(service, FALLBACK_DEFAULTS))
+    prefix = f"UPSTREAM_{service.upper()}_"
+    for key, cast in (("connect_timeout", float), ("read_timeout", float), ("retries", int)):
+        value = os.getenv(prefix + key.upper())
+        if value:
+            config[key] = cast(value)
+    return config
+
+
+# ---------------------------------------------------------
+# 🔥 Disjoncteur
+# ---------------------------------------------------------
+class CircuitBreaker:
+    """Fermé -> ouvert après `threshold` échecs consécutifs -> semi-ouvert après `cooldown_s`."""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown_s=BREAKER_COOLDOWN_S):
+        self.threshold = threshold
+        self.cooldown_s = cooldown_s
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.cooldown_s:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown_s:
+                return False
+            # Semi-ouvert : un seul appel d'essai à la fois
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def release(self):
+        """L'appel autorisé n'est pas parti (pas de budget) : l'essai semi-ouvert est rendu, sans compter d'échec."""
+        with self._lock:
+            self._trial_running = False
+
+
+# ---------------------------------------------------------
+# 🔥 Sessions par hôte
+# ---------------------------------------------------------
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+_breakers = {}
+
+
+def _session_for(url):
+    global _sessions, _sessions_pid
+    host = urlsplit(url).netloc
+    with _sessions_lock:
+        # Sessions recréées après un fork (workers gunicorn)
+        if _sessions_pid != os.getpid():
+            _sessions = {}
+            _sessions_pid = os.getpid()
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+        return session
+
+
+def breaker(service):
+    with _sessions_lock:
+        if service not in _breakers:
+            _breakers[service] = CircuitBreaker()
+        return _breakers[service]
+
+
+def breaker_states():
+    with _sessions_lock:
+        services = list(_breakers)
+    return {service: breaker(service).state for service in services}
+
+
+def _backoff(attempt):
+    """Backoff exponentiel avec jitter complet"""
+    return random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** attempt)))
+
+
+# ---------------------------------------------------------
+# 🔥 Appels
+# ---------------------------------------------------------
+def _take_token(budget, service, priority):
+    try:
+        budget.acquire(priority)
+    except quota.QuotaExceeded as e:
+        UPSTREAM_REQUESTS.inc(service=service, status="quota")
+        raise UpstreamUnavailable(f"{service} indisponible ({e})")
+
+
+def _record(service, status, started):
+    UPSTREAM_REQUESTS.inc(service=service, status=status)
+    UPSTREAM_SECONDS.observe(time.perf_counter() - started, service=service, status=status)
+
+
+def request(service, method, url, priority=HIGH, **kwargs):
+    """
+    Appel HTTP via la session poolée de l'hôte.
+    Retourne la dernière réponse (même en erreur HTTP) ; lève une exception
+    requests après épuisement des tentatives, ou UpstreamUnavailable si le
+    disjoncteur du service est ouvert ou si son budget est épuisé.
+    priority : HIGH (plans, attend un jeton) ou LOW (rejeté plutôt que mis en attente)
+    """
+    config = service_config(service)
+    budget = quota.bucket(service)
+
+    # Disjoncteur d'abord : un service coupé échoue tout de suite, sans
+    # consommer de jeton ni attendre le budget
+    circuit = breaker(service)
+    if not circuit.allow():
+        UPSTREAM_REQUESTS.inc(service=service, status="breaker_open")
+        raise UpstreamUnavailable(f"{service} indisponible (disjoncteur ouvert)")
+
+    try:
+        _take_token(budget, service, priority)
+    except UpstreamUnavailable:
+        circuit.release()
+        raise
+
+    kwargs.setdefault("timeout", (config["connect_timeout"], config["read_timeout"]))
+    session = _session_for(url)
+
+    for attempt in range(config["retries"] + 1):
+        last_attempt = attempt == config["retries"]
+        if attempt:
+            try:
+                _take_token(budget, service, priority)
+            except UpstreamUnavailable:
+                # Nouvelle tentative après un échec : compte comme un échec
+                circuit.record_failure()
+                raise
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _record(service, "timeout" if isinstance(e, requests.Timeout) else "error", started)
+            if last_attempt:
+                circuit.record_failure()
+                raise
+            time.sleep(_backoff(attempt))
+            continue
+        except Exception:
+            _record(service, "error", started)
+            circuit.record_failure()
+            raise
+
+        _record(service, response.status_code, started)
+        if response.status_code in RETRY_STATUSES:
+            if response.status_code == 429:
+                budget.drain()
+            if last_attempt:
+                circuit.record_failure()
+                return response
+            retry_after = response.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else _backoff(attempt)
+            time.sleep(min(delay, BACKOFF_MAX_S))
+            continue
+
+        circuit.record_success()
+        return response
+
+
+def get(service, url, **kwargs):
+    return request(service, "GET", url, **kwargs)
+
+
+def post(service, url, **kwargs):
+    return request(service, "POST", url, **kwargs)
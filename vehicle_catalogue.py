@@ -0,0 +1,176 @@
+# vehicle_catalogue.py
+
+"""
+Cache en mémoire du catalogue de véhicules Chargetrip.
+
+Le catalogue est rechargé au plus une fois par TTL ; une fois expiré il
+continue d'être servi pendant qu'un thread le rafraîchit en arrière-plan
+(stale-while-revalidate). Un snapshot JSON optionnel permet à un worker
+qui démarre de répondre tout de suite, sans attendre Chargetrip.
+
+L'appel à Chargetrip se fait hors du verrou de l'état : une lecture
+n'attend jamais un rafraîchissement, seul le tout premier chargement
+(sans snapshot) est synchrone.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class VehicleCatalogue:
+    """Liste des véhicules + index par id, rafraîchis périodiquement."""
+
+    def __init__(self, fetch, ttl_s=6 * 3600, snapshot_path=None, fallback=None, error_ttl_s=60):
+        self._fetch = fetch
+        self._fallback = fallback
+        self.ttl_s = ttl_s
+        self.error_ttl_s = error_ttl_s
+        self.snapshot_path = snapshot_path
+
+        self._vehicles = None
+        self._by_id = {}
+        self._fetched_at = 0.0
+        self._expires_at = 0.0
+        self._lock = threading.Lock()        # état (catalogue, échéance, drapeau)
+        self._fetch_lock = threading.Lock()  # un seul appel Chargetrip à la fois
+        self._refreshing = False
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Un rafraîchissement en cours dans le parent n'existe pas dans le
+        # worker forké : verrous et drapeau repartent à zéro
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+
+    # ---------------------------------------------------------
+    # 🔥 Lecture
+    # ---------------------------------------------------------
+    def all(self):
+        """Liste complète des véhicules (éventuellement périmée pendant le rafraîchissement)."""
+        self._ensure_fresh()
+        return self._vehicles
+
+    def get(self, vehicle_id):
+        """Véhicule par id, en O(1)."""
+        self._ensure_fresh()
+        return self._by_id.get(str(vehicle_id))
+
+    def _ensure_fresh(self):
+        if self._vehicles is None:
+            with self._fetch_lock:
+                if self._vehicles is None and not self._load_snapshot():
+                    # Premier chargement sans snapshot : appel synchrone
+                    self._refresh_fetching()
+                    return
+
+        if time.time() >= self._expires_at:
+            self.refresh_in_background()
+
+    # ---------------------------------------------------------
+    # 🔥 Rafraîchissement
+    # ---------------------------------------------------------
+    def preload(self):
+        """
+        Catalogue du snapshot disque, sans appel réseau ni thread (master
+        gunicorn avant le fork des workers). None sans snapshot : chaque
+        worker chargera alors le catalogue à sa première requête.
+        """
+        with self._fetch_lock:
+            if self._vehicles is None:
+                self._load_snapshot()
+        return self._vehicles
+
+    def refresh(self):
+        """Recharger le catalogue maintenant. Retourne True si Chargetrip a répondu."""
+        with self._fetch_lock:
+            return self._refresh_fetching()
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="vehicle-catalogue", daemon=True).start()
+
+    def _refresh_fetching(self):
+        # Appelé avec _fetch_lock : le catalogue courant reste servi pendant l'appel
+        try:
+            vehicles = self._fetch()
+        except Exception as e:
+            logger.warning("Erreur rafraîchissement catalogue véhicules: %s", e)
+            vehicles = None
+
+        if vehicles:
+            self._set(vehicles, time.time(), self.ttl_s)
+            self._save_snapshot()
+            return True
+
+        # Échec : on garde l'ancien catalogue, sinon les véhicules par défaut,
+        # et on réessaie après error_ttl_s
+        with self._lock:
+            fallback = self._vehicles is None and self._fallback
+            if not fallback:
+                self._expires_at = time.time() + self.error_ttl_s
+        if fallback:
+            self._set(self._fallback(), 0.0, self.error_ttl_s)
+        return False
+
+    def _set(self, vehicles, fetched_at, ttl_s):
+        by_id = {str(v["id"]): v for v in vehicles}
+        with self._lock:
+            self._by_id = by_id
+            self._vehicles = vehicles
+            self._fetched_at = fetched_at
+            self._expires_at = time.time() + ttl_s
+
+    # ---------------------------------------------------------
+    # 🔥 Snapshot disque
+    # ---------------------------------------------------------
+    def _load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                data = json.load(f)
+            vehicles = data["vehicles"]
+            fetched_at = float(data.get("fetched_at", 0))
+        except Exception as e:
+            logger.warning("Snapshot véhicules illisible: %s", e)
+            return False
+        if not vehicles:
+            return False
+
+        # Un snapshot périmé est servi quand même, le rafraîchissement suit
+        remaining = max(0.0, fetched_at + self.ttl_s - time.time())
+        self._set(vehicles, fetched_at, remaining)
+        return True
+
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            data = {"fetched_at": self._fetched_at, "vehicles": self._vehicles}
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning("Impossible d'écrire le snapshot véhicules: %s", e)